@@ -0,0 +1,6 @@
+"""Benchmarks for scmoplot, run with `python -m benchmarks`.
+
+synthetic builds fake scan directories, stages times each step of the
+analysis on them. startup (`python -m benchmarks.startup`) times the imports
+of the entry points and guards them against regressions.
+"""
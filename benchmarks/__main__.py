@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Run the benchmarks on synthetic scans of several grid sizes.
+
+    python -m benchmarks [--sizes 5 20 50] [--points 2000] [--json out.json]
+
+The scans are written to --data-dir the first time they are needed and
+reused after that.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from . import stages, synthetic
+
+DEFAULT_SIZES = (5, 10, 20, 50, 100, 200)
+
+HEADER = '{:>9} {:<36} {:>7} {:>10} {:>10} {:>9}'
+ROW = '{:>9} {:<36} {:>7d} {:>10.3f} {:>10.1f} {:>9}'
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Time each stage of the scmoplot analysis on synthetic '
+                    'scans and report throughput and peak memory.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        metavar='N', help='run on N x N scans (default: '
+                        '{})'.format(' '.join(map(str, DEFAULT_SIZES))))
+    parser.add_argument('--points', type=int, default=2000,
+                        help='points per loop')
+    parser.add_argument('--noise', type=float, default=0.05,
+                        help='std of the noise of the synthetic loops')
+    parser.add_argument('--stage', dest='only', action='append',
+                        metavar='NAME', help='only run the stages whose name '
+                        'contains NAME. May be repeated.')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='worker processes of the pooled end to end '
+                             'benchmark (default: #CPUs)')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the peak memory measurements')
+    parser.add_argument('--data-dir', default=os.path.join(
+        tempfile.gettempdir(), 'scmoplot-benchmarks'),
+        help='where the synthetic scans are kept')
+    parser.add_argument('--json', default=None, metavar='PATH',
+                        help='also write the results to PATH as JSON')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = []
+    print(HEADER.format('grid', 'stage', 'loops', 'seconds', 'loops/s',
+                        'peak MB'))
+    for n in args.sizes:
+        root_path = synthetic.cached_scan(args.data_dir, n, n, args.points,
+                                          noise=args.noise)
+        grid = '{}x{}'.format(n, n)
+
+        def report(res):
+            res.update(grid=grid, points=args.points)
+            results.append(res)
+            peak = res['peak_mb']
+            print(ROW.format(grid, res['stage'], res['loops'], res['seconds'],
+                             res['loops_per_s'],
+                             '-' if peak is None else '{:.1f}'.format(peak)))
+            sys.stdout.flush()
+        stages.run(root_path, only=args.only, memory=args.memory,
+                   workers=args.workers, report=report)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
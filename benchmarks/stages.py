@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""Timed benchmarks of each stage of the analysis of a scan.
+
+Every benchmark is run over the averaged loops of a synthetic scan in the
+chunks that scmoplot.engine.analyze() hands to its workers, so the
+throughput (loops per second) and peak memory are those of a real run.
+Each benchmark is run once untimed first, so that one-off costs like the
+lazy SciPy imports of the transformations are not counted, then timed on
+its own, then run once more under tracemalloc to find the peak memory
+allocated by the stage. Inputs are prepared outside of the timed and traced
+sections.
+"""
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from scmoplot import transformations as tfms
+from scmoplot.batch import export_maps
+from scmoplot.engine import (default_ps, make_transformers, scan_chunks,
+                             scan_files)
+from scmoplot.loading import load_loop
+from scmoplot.loopstack import LoopStack
+from scmoplot.rawcache import RawCache
+
+# Chunks looked at when measuring the peak memory of chunked stages. Every
+# chunk is the same size so more would only take longer.
+MEMORY_CHUNKS = 4
+
+
+class Stage(object):
+    """One benchmark: func(*setup(item)) timed for every item.
+
+    Args:
+        name: name in the report.
+        func: the timed function.
+        items: function scan -> list of items, e.g. the chunks of paths.
+        setup: function (scan, item) -> args of func. Not timed.
+        n_loops: function (scan, item) -> number of loops in item.
+        chunked: whether the peak memory can be measured on the first few
+            items only.
+    """
+
+    def __init__(self, name, func, items, setup, n_loops, chunked=True):
+        self.name = name
+        self.func = func
+        self.items = items
+        self.setup = setup
+        self.n_loops = n_loops
+        self.chunked = chunked
+
+    def run(self, scan, memory=True):
+        """Time the stage on scan.
+
+        Returns:
+            dict: name, loops, seconds, loops_per_s and peak_mb (None if
+                memory is False).
+        """
+        items = self.items(scan)
+        if items:
+            # Warm up: imports, caches and first-call allocations.
+            self.func(*self.setup(scan, items[0]))
+        seconds, loops = 0.0, 0
+        for item in items:
+            args = self.setup(scan, item)
+            start = time.perf_counter()
+            self.func(*args)
+            seconds += time.perf_counter() - start
+            loops += self.n_loops(scan, item)
+        peak = None
+        if memory:
+            peak = self._peak(scan, items[:MEMORY_CHUNKS] if self.chunked
+                              else items)
+        return {'stage': self.name, 'loops': loops, 'seconds': seconds,
+                'loops_per_s': loops / seconds if seconds else float('inf'),
+                'peak_mb': peak}
+
+    def _peak(self, scan, items):
+        peak = 0
+        tracemalloc.start()
+        try:
+            for item in items:
+                args = self.setup(scan, item)
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                self.func(*args)
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+                del args
+        finally:
+            tracemalloc.stop()
+        return peak / 1024.**2
+
+
+class Scan(object):
+    """A synthetic scan directory and the inputs the stages need from it.
+
+    The raw loops are read through a RawCache in a temporary directory, so
+    preparing the input of a stage costs reading memory maps rather than a
+    parse.
+    The pipeline outputs that later stages start from are computed on
+    demand, chunk by chunk.
+
+    Args:
+        root_path: the scan directory.
+        ps: dict of parameters, see scmoplot.engine.default_ps.
+        chunksize: number of loops per chunk.
+        workers: worker processes of the end-to-end benchmark.
+    """
+
+    def __init__(self, root_path, ps, chunksize=16, workers=None):
+        self.root_path = root_path
+        self.ps = ps
+        self.workers = workers
+        self.paths = scan_files(root_path)
+        self.chunks = scan_chunks(self.paths, chunksize)
+        self.tmp = tempfile.mkdtemp(prefix='scmoplot-bench-')
+        self.cache = RawCache(os.path.join(self.tmp, 'raw'),
+                              max_bytes=2**62)
+        for chunk in self.chunks:
+            self.cache.load_scan(chunk)
+        self.tfmr, self.tfmr2 = make_transformers(ps)
+
+    def close(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def raw(self, chunk):
+        """(x, y) of a chunk as in-memory (n, N) arrays."""
+        return self.cache.load_scan(chunk)
+
+    def scaled(self, chunk):
+        """(x, y) of a chunk with the field scaled as in the pipelines."""
+        x, y = self.raw(chunk)
+        return tfms.scale(x, y, xsc=0.1)
+
+    def flattened(self, chunk):
+        """(x, y) of a chunk after the first pipeline."""
+        return self.tfmr.call_stack(self.raw(chunk), chunk)
+
+    def cleaned(self, chunk):
+        """(x, y) of a chunk after the second pipeline."""
+        return self.tfmr2.call_stack(self.raw(chunk), chunk)
+
+    def loops(self, chunk, pipeline):
+        """The loops of a chunk after pipeline, as a list of (x, y)."""
+        x, y = pipeline(chunk)
+        x = np.broadcast_to(x, y.shape)
+        return list(zip(x, y))
+
+
+def _chunks(scan):
+    return scan.chunks
+
+
+def _chunk_len(scan, chunk):
+    return len(chunk)
+
+
+def _per_loop(func, **kwargs):
+    """Run func on every loop of a list of (x, y), quietly."""
+    def run(loops):
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            for x, y in loops:
+                func(x, y, **kwargs)
+    return run
+
+
+def _export(scan, out_dir, workers):
+    export_maps(scan.root_path, os.path.join(out_dir, 'maps.npz'), scan.ps,
+                workers=workers)
+
+
+def resample_batched(x, y, n=500, lim=None):
+    """tfms.resample_branches with the interpolation of every row done at
+    once: each branch padded to the loop length, sorted row-wise, and
+    searched with one searchsorted over the rows laid end to end. Same
+    output; kept to compare against the per-row np.interp it uses.
+    """
+    x, y = np.broadcast_arrays(x, y)
+    shape = y.shape
+    x, y = x.reshape(-1, shape[-1]), y.reshape(-1, shape[-1])
+    if lim is None:
+        lim = (x.min(-1).max(), x.max(-1).min())
+    grid = np.linspace(lim[0], lim[1], n)
+    top = np.argmax(x, -1)
+    k = ((np.argmin(x, -1) - top) % shape[-1])[:, None]
+    pos = np.arange(shape[-1] + 1)
+    turn = (top[:, None] + pos) % shape[-1]
+    xr = np.take_along_axis(x, turn, -1)
+    yr = np.take_along_axis(y, turn, -1)
+    down = _interp_rows(grid, xr, yr, pos <= k)[:, ::-1]
+    up = _interp_rows(grid, xr, yr, pos >= k)[:, 1:-1]
+    out = np.concatenate((down, up), -1)
+    return (np.concatenate((grid[::-1], grid[1:-1])),
+            out.reshape(shape[:-1] + (2 * n - 2,)))
+
+
+def _interp_rows(grid, x, y, mask):
+    """np.interp(grid, x[i][mask[i]], y[i][mask[i]]) for every row i."""
+    rows, width = x.shape
+    order = np.argsort(np.where(mask, x, np.inf), axis=-1, kind='stable')
+    xs = np.take_along_axis(x, order, -1)
+    ys = np.take_along_axis(y, order, -1)
+    last = (mask.sum(-1) - 1)[:, None]
+    # Pad with the last point so every row stays sorted.
+    xs = np.where(np.arange(width) > last,
+                  np.take_along_axis(xs, last, -1), xs)
+    span = 2 * (np.abs(xs).max() + np.abs(grid).max()) + 1.0
+    off = np.arange(rows)[:, None] * span
+    j = np.searchsorted((xs + off).ravel(), (grid + off).ravel(), 'right')
+    j = np.clip(j.reshape(rows, -1) - np.arange(rows)[:, None] * width,
+                1, last)
+    x0, x1 = np.take_along_axis(xs, j - 1, -1), np.take_along_axis(xs, j, -1)
+    y0, y1 = np.take_along_axis(ys, j - 1, -1), np.take_along_axis(ys, j, -1)
+    dx = x1 - x0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(dx > 0, (grid - x0) / dx, grid >= x1)
+    return y0 + np.clip(t, 0.0, 1.0) * (y1 - y0)
+
+
+def stages(ps):
+    """The benchmarks, in the order they are run.
+
+    Args:
+        ps: dict of parameters, see scmoplot.engine.default_ps.
+
+    Returns:
+        list: Stage instances.
+    """
+    thresh, ks = ps['thresh'], ps['filt_ks']
+    fit_int = (ps['thresh'], ps['max'])
+    resample = {'n': ps.get('resample') or 500,
+                'lim': (-ps['max'], ps['max'])}
+
+    def raw(scan, chunk):
+        return scan.raw(chunk)
+
+    def scaled(scan, chunk):
+        return scan.scaled(chunk)
+
+    def flattened(scan, chunk):
+        return scan.flattened(chunk)
+
+    def cleaned(scan, chunk):
+        return scan.cleaned(chunk)
+
+    def stack_stage(name, func, setup, **kwargs):
+        return Stage(name, lambda x, y: func(x, y, **kwargs), _chunks, setup,
+                     _chunk_len)
+
+    def chunk_paths(scan, chunk):
+        return (chunk,)
+
+    def raw_chunk(scan, chunk):
+        return (scan.raw(chunk), chunk, scan)
+
+    def loops(pipeline):
+        return lambda scan, c: (scan.loops(c, getattr(scan, pipeline)),)
+
+    def cold_cache(scan, chunk):
+        cache = RawCache(os.path.join(scan.tmp, 'cold'), max_bytes=2**62)
+        cache.invalidate(chunk)
+        return (cache, chunk)
+
+    return [
+        Stage('load: loadtxt',
+              lambda paths: [load_loop(p) for p in paths],
+              _chunks, chunk_paths, _chunk_len),
+        Stage('load: LoopStack.from_files', LoopStack.from_files,
+              _chunks, chunk_paths, _chunk_len),
+        Stage('load: RawCache cold', lambda cache, c: cache.load_scan(c),
+              _chunks, cold_cache, _chunk_len),
+        Stage('load: RawCache warm', lambda cache, c: cache.load_scan(c),
+              _chunks, lambda scan, c: (scan.cache, c), _chunk_len),
+        stack_stage('tfms.scale', tfms.scale, raw, xsc=0.1),
+        stack_stage('tfms.flatten_saturation', tfms.flatten_saturation,
+                    scaled, threshold=thresh, polarity='+'),
+        stack_stage('tfms.center', tfms.center, scaled),
+        stack_stage('tfms.wrapped_medfilt', tfms.wrapped_medfilt, scaled,
+                    ks=ks),
+        stack_stage('tfms.saturation_normalize', tfms.saturation_normalize,
+                    scaled, thresh=thresh),
+        stack_stage('tfms.clean', tfms.clean, scaled),
+        stack_stage('tfms.resample_branches', tfms.resample_branches, scaled,
+                    **resample),
+        stack_stage('resample: batched searchsorted', resample_batched,
+                    scaled, **resample),
+        stack_stage('tfms.loop_features', tfms.loop_features, cleaned),
+        stack_stage('tfms.Hc_Mrem', tfms.Hc_Mrem, flattened,
+                    fit_int=fit_int),
+        Stage('tfms.Hc_of (per loop)', _per_loop(tfms.Hc_of, fit_int=fit_int),
+              _chunks, loops('flattened'), _chunk_len),
+        Stage('tfms.Mrem_of (per loop)',
+              _per_loop(tfms.Mrem_of, fit_int=fit_int),
+              _chunks, loops('flattened'), _chunk_len),
+        Stage('pipeline tfmr (stack)',
+              lambda xy, c, scan: scan.tfmr.call_stack(xy, c), _chunks,
+              raw_chunk, _chunk_len),
+        Stage('pipeline tfmr2 (stack)',
+              lambda xy, c, scan: scan.tfmr2.call_stack(xy, c), _chunks,
+              raw_chunk, _chunk_len),
+        Stage('pipeline tfmr (per loop)',
+              lambda xys, c, tfmr: [tfmr(xy, t) for xy, t in zip(xys, c)],
+              _chunks, lambda scan, c: (list(zip(*scan.raw(c))), c,
+                                        scan.tfmr), _chunk_len),
+        Stage('end to end: export_maps, 1 worker', _export,
+              lambda scan: [None], lambda scan, _: (scan, scan.tmp, 1),
+              lambda scan, _: len(scan.paths), chunked=False),
+        Stage('end to end: export_maps, pool', _export,
+              lambda scan: [None],
+              lambda scan, _: (scan, scan.tmp, scan.workers),
+              lambda scan, _: len(scan.paths), chunked=False),
+    ]
+
+
+def run(root_path, user_ps={}, only=None, memory=True, chunksize=16,
+        workers=None, report=None):
+    """Run the benchmarks on the scan in root_path.
+
+    Args:
+        root_path: a scan directory, e.g. from synthetic.cached_scan().
+        user_ps: dict of parameters that override default_ps.
+        only: if given, only the stages whose name contains one of these
+            strings are run.
+        memory: also measure the peak memory of each stage.
+        chunksize: loops per chunk, as in scmoplot.engine.analyze().
+        workers: worker processes of the pooled end-to-end benchmark.
+        report: called with each result dict as soon as it is ready.
+
+    Returns:
+        list: one result dict per stage, see Stage.run.
+    """
+    ps = dict(default_ps)
+    ps.update(user_ps)
+    scan = Scan(root_path, ps, chunksize, workers)
+    results = []
+    try:
+        for stage in stages(ps):
+            if only and not any(s in stage.name for s in only):
+                continue
+            res = stage.run(scan, memory)
+            results.append(res)
+            if report is not None:
+                report(res)
+    finally:
+        scan.close()
+    return results
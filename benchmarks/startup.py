@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Import time of the scmoplot entry points, with a regression guard.
+
+    python -m benchmarks.startup [--save BASELINE.json] [--baseline BASELINE.json]
+
+Every short lived CLI call and batch worker pays the import time of the
+package before it reads any data. Each entry point is imported in a fresh
+interpreter with -X importtime, which times the imports alone (not the
+interpreter start up), and the median over --repeat runs is reported.
+
+Two things count as a regression and make the exit status 1:
+  - an analysis entry point failing to import, or importing a module of
+    FORBIDDEN (plotting code, or SciPy that the transformations only import
+    when first used);
+  - with --baseline, an import time more than --tolerance above the
+    baseline saved with --save on the same machine.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules that don't plot and are used by headless runs.
+ENTRY_POINTS = ('scmoplot', 'scmoplot.engine', 'scmoplot.batch',
+                'scmoplot.cli', 'scmoplot.watch', 'scmoplot.sweep',
+                'scmoplot.archive', 'scmoplot.campaign')
+
+# Top level packages the entry points must not import.
+FORBIDDEN = ('matplotlib', 'scipy')
+
+# Printed by the child interpreter after the import, see measure().
+_PROBE = ('import sys; import {0}; '
+          'print(" ".join(set(m.split(".")[0] for m in sys.modules) & '
+          'set({1!r})))')
+
+
+def measure(module):
+    """Import module in a fresh interpreter.
+
+    Returns:
+        tuple: (seconds, list of the FORBIDDEN packages it imported)
+
+    Raises:
+        ImportError: if the import fails.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         _PROBE.format(module, FORBIDDEN)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if proc.returncode != 0:
+        raise ImportError(proc.stderr.strip().splitlines()[-1])
+    micros = 0
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            micros = int(parts[1])
+    return micros / 1e6, sorted(proc.stdout.split())
+
+
+def run(modules=ENTRY_POINTS, repeat=5):
+    """Return a dict of module -> {'seconds': median import time,
+    'forbidden': list of FORBIDDEN packages imported, 'error': None or why
+    the import failed}.
+    """
+    out = {}
+    for module in modules:
+        times, forbidden = [], []
+        try:
+            for _ in range(repeat):
+                seconds, forbidden = measure(module)
+                times.append(seconds)
+        except ImportError as e:
+            out[module] = {'seconds': float('nan'), 'forbidden': [],
+                           'error': str(e)}
+            continue
+        times.sort()
+        out[module] = {'seconds': times[len(times) // 2],
+                       'forbidden': forbidden, 'error': None}
+    return out
+
+
+def regressions(results, baseline=None, tolerance=0.25, slack=0.005):
+    """List the regressions of results as messages.
+
+    Args:
+        results: output of run().
+        baseline: an earlier output of run(), or None.
+        tolerance: allowed relative increase over the baseline.
+        slack: allowed absolute increase in seconds, so that modules that
+            import in a few ms don't trip on noise.
+    """
+    msgs = []
+    for module, res in sorted(results.items()):
+        if res['error'] is not None:
+            msgs.append('{} fails to import: {}'.format(module, res['error']))
+            continue
+        if res['forbidden']:
+            msgs.append('{} imports {}'.format(
+                module, ', '.join(res['forbidden'])))
+        base = (baseline or {}).get(module)
+        if base is None:
+            continue
+        limit = base['seconds'] * (1 + tolerance) + slack
+        if res['seconds'] > limit:
+            msgs.append('{} imports in {:.1f} ms, baseline {:.1f} ms'.format(
+                module, 1e3 * res['seconds'], 1e3 * base['seconds']))
+    return msgs
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.startup',
+        description='Time the imports of the scmoplot entry points and check '
+                    'them for regressions.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='fresh interpreters per entry point')
+    parser.add_argument('--baseline', default=None, metavar='PATH',
+                        help='fail if slower than the results saved in PATH')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slow down over the baseline')
+    parser.add_argument('--save', default=None, metavar='PATH',
+                        help='write the results to PATH as a new baseline')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = run(repeat=args.repeat)
+    print('{:<20} {:>10}  {}'.format('module', 'import ms', 'forbidden'))
+    for module, res in sorted(results.items()):
+        print('{:<20} {:>10.1f}  {}'.format(
+            module, 1e3 * res['seconds'],
+            res['error'] or ' '.join(res['forbidden']) or '-'))
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    msgs = regressions(results, baseline, args.tolerance)
+    for msg in msgs:
+        print('REGRESSION: ' + msg)
+    return 1 if msgs else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
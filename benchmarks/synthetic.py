@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Synthetic hysteresis loops and scan directories.
+
+The scans look like the ones written by the scanning MOKE software: a
+parameters.xml Cluster with the Rows and Cols of the raster, and one text
+file per pixel and scan named scan=<n>x=<x>y=<y>, with a 7 line header and
+field/signal columns. The averaged files end in 'averaged'.
+"""
+import os
+from os.path import exists, join
+
+import numpy as np
+
+PARAMETERS_XML = """<Cluster>
+<Name>parameters</Name>
+<NumElts>{n}</NumElts>
+{elements}
+</Cluster>
+"""
+
+ELEMENT_XML = """<{tag}>
+<Name>{name}</Name>
+<Val>{val}</Val>
+</{tag}>"""
+
+
+def make_loop(n_points=2000, Hc=30.0, width=8.0, Bmax=100.0, Msat=1.0,
+              slope=0.002, offset=0.5, noise=0.05, phase=-0.125, rng=None):
+    """Make one hysteresis loop.
+
+    The field follows a cosine over one period starting at phase (in
+    periods), and the signal is a tanh of width width centered on -Hc on
+    the descending branch and +Hc on the ascending one, plus a linear
+    background, an offset and gaussian noise.
+
+    Returns:
+        tuple: (B, V) arrays of n_points samples.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    t = np.arange(n_points) / float(n_points) + phase
+    B = Bmax * np.cos(2 * np.pi * t)
+    rising = np.sin(2 * np.pi * t) < 0
+    V = Msat * np.tanh((B - np.where(rising, Hc, -Hc)) / width)
+    V += slope * B + offset + rng.normal(0.0, noise, n_points)
+    return B, V
+
+
+def write_loop(path, B, V):
+    """Write a loop file: a 7 line header, then B, V (twice) columns."""
+    header = '\n'.join('synthetic header line {}'.format(i) for i in range(7))
+    np.savetxt(path, np.column_stack((B, V, V)), header=header, comments='')
+
+
+def write_parameters(path, rows, cols, **extra):
+    """Write a parameters.xml that lvxml2dict.Cluster can parse. Ints in
+    extra are written as I32, floats as DBL.
+    """
+    vals = [('I32', 'Rows', rows), ('I32', 'Cols', cols)]
+    for k, v in sorted(extra.items()):
+        vals.append(('DBL' if isinstance(v, float) else 'I32', k, v))
+    elements = '\n'.join(ELEMENT_XML.format(tag=t, name=n, val=v)
+                         for t, n, v in vals)
+    with open(path, 'w') as f:
+        f.write(PARAMETERS_XML.format(n=len(vals), elements=elements))
+
+
+def make_scan(root_path, gx=5, gy=5, n_points=2000, n_scans=0, Hc=(20., 40.),
+              noise=0.05, seed=0, **loop_kwargs):
+    """Write a synthetic scan directory.
+
+    Hc varies linearly across the raster from Hc[0] at x = y = 0 to Hc[1]
+    at the far corner, so the expected Hc map is known.
+
+    Args:
+        root_path: directory to write to, created if needed.
+        gx, gy: number of raster columns (Rows in parameters.xml, as in the
+            real data) and rows.
+        n_points: samples per loop.
+        n_scans: number of individual (not averaged) scans written per
+            pixel besides the averaged file.
+        Hc: (min, max) coercive field, in raw field units.
+        noise: std of the gaussian noise of the averaged loops. Individual
+            scans get noise * sqrt(n_scans) so that they average to it.
+        seed: seed of the random number generator.
+        loop_kwargs: passed on to make_loop.
+
+    Returns:
+        np.ndarray: (gy, gx) array of the Hc of each pixel.
+    """
+    if not exists(root_path):
+        os.makedirs(root_path)
+    rng = np.random.default_rng(seed)
+    write_parameters(join(root_path, 'parameters.xml'), gx, gy)
+    Hcs = np.empty((gy, gx))
+    for x in range(gx):
+        for y in range(gy):
+            frac = (x + y) / float(max(gx + gy - 2, 1))
+            Hcs[y, x] = Hc[0] + frac * (Hc[1] - Hc[0])
+            B, V = make_loop(n_points, Hc=Hcs[y, x], noise=noise, rng=rng,
+                             **loop_kwargs)
+            name = 'scan=0x={}y={}averaged'.format(x, y)
+            write_loop(join(root_path, name), B, V)
+            for s in range(n_scans):
+                B, V = make_loop(n_points, Hc=Hcs[y, x], rng=rng,
+                                 noise=noise * np.sqrt(n_scans), **loop_kwargs)
+                name = 'scan={}x={}y={}'.format(s, x, y)
+                write_loop(join(root_path, name), B, V)
+    return Hcs
+
+
+def cached_scan(data_dir, gx, gy, n_points=2000, **kwargs):
+    """Return the path of a synthetic scan in data_dir, writing it first if
+    it doesn't exist yet. The directory name encodes the arguments.
+    """
+    tag = '_'.join('{}={}'.format(k, kwargs[k]) for k in sorted(kwargs))
+    name = 'scan_{}x{}_{}pts{}'.format(gx, gy, n_points,
+                                       '_' + tag if tag else '')
+    root_path = join(data_dir, name)
+    done = join(root_path, '.complete')
+    if not exists(done):
+        make_scan(root_path, gx, gy, n_points, **kwargs)
+        open(done, 'w').close()
+    return root_path
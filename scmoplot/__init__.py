@@ -1 +1,11 @@
-from .main import scmoplot
+from .engine import analyze
+from .batch import export_maps
+
+
+def __getattr__(name):
+    # scmoplot() plots, so only pull in matplotlib when it is asked for.
+    # This keeps the headless entry points usable without a GUI backend.
+    if name == 'scmoplot':
+        from .main import scmoplot
+        return scmoplot
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
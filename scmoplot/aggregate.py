@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Average the individual scans of each pixel on the fly.
+
+Besides the averaged loop of every pixel the acquisition writes one file per
+scan, e.g. scan=3x=1y=2. Instead of waiting for the averaged files,
+scan_groups() groups the individual scan files of a directory by pixel and
+average_scans() folds the files of a pixel into a running mean and variance,
+one file at a time, so memory stays bounded by the size of a single loop
+however many scans there are. Bad scans can be left out of the groups.
+
+The standard error of the mean at each point is a direct measure of the
+noise of the averaged loop, which Hc_of, Mrem_of, coercivity and remanence
+take as s_y instead of estimating it with sigma_y.
+"""
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .loading import load_loop
+
+AveragedLoop = namedtuple('AveragedLoop', 'B V V_sem n')
+
+
+class RunningStats(object):
+    """Running mean and variance of equally shaped arrays (Welford's
+    algorithm), numerically stable and in constant memory.
+
+    Attributes:
+        n: number of arrays added so far.
+        mean: their elementwise mean, or None before the first add().
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self._m2 = None
+
+    def add(self, a):
+        """Fold one array into the statistics."""
+        a = np.asarray(a, dtype=float)
+        if self.n == 0:
+            self.n = 1
+            self.mean = a.copy()
+            self._m2 = np.zeros_like(self.mean)
+            return
+        if a.shape != self.mean.shape:
+            raise ValueError('shape {} does not match {}'.format(
+                a.shape, self.mean.shape))
+        self.n += 1
+        delta = a - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (a - self.mean)
+
+    def variance(self, ddof=1):
+        """Elementwise variance, nan where there are too few arrays."""
+        if self.n - ddof <= 0:
+            return np.full_like(self.mean, np.nan)
+        return self._m2 / (self.n - ddof)
+
+    def std(self, ddof=1):
+        return np.sqrt(self.variance(ddof))
+
+    def sem(self):
+        """Elementwise standard error of the mean."""
+        return self.std() / np.sqrt(self.n)
+
+
+def average_scans(paths, loader=load_loop):
+    """Average the loop files at paths, reading one at a time.
+
+    Args:
+        paths: paths of the individual scans of one pixel.
+        loader: function path -> (B, V) to read them with.
+
+    Returns:
+        AveragedLoop: (B, V, V_sem, n), the mean field and signal, the
+            standard error of the mean signal at each point (nan for a
+            single scan) and the number of scans.
+    """
+    if not paths:
+        raise ValueError('no scans to average')
+    Bs, Vs = RunningStats(), RunningStats()
+    for path in paths:
+        B, V = loader(path)
+        Bs.add(B)
+        Vs.add(V)
+    return AveragedLoop(Bs.mean, Vs.mean, Vs.sem(), Vs.n)
+
+
+def scan_groups(index, exclude=()):
+    """Group the individual scan files of a directory by pixel.
+
+    Args:
+        index: GleanIndex of the directory from scan_gleaner(), see
+            NameGleaner.index_directory.
+        exclude: scans to leave out: scan numbers to drop a whole scan, or
+            (scan, x, y) tuples to drop a single file.
+
+    Returns:
+        OrderedDict: (x, y) -> list of the paths of the pixel's scans in
+            scan order, the pixels sorted by (x, y).
+    """
+    index = index.where(averaged=None, scan=True, x=True, y=True)
+    scans, xs, ys = (index.as_int(c) for c in ('scan', 'x', 'y'))
+    drop_scans = set(int(e) for e in exclude if np.ndim(e) == 0)
+    drop_files = set(tuple(int(v) for v in e) for e in exclude
+                     if np.ndim(e) != 0)
+    groups = {}
+    for path, s, x, y in zip(index.paths, scans, xs, ys):
+        if s in drop_scans or (s, x, y) in drop_files:
+            continue
+        groups.setdefault((int(x), int(y)), []).append((s, path))
+    return OrderedDict((xy, [p for s, p in sorted(groups[xy])])
+                       for xy in sorted(groups))
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Single file archive of the full analysis of a scan.
+
+The maps npz of batch.save_maps only holds the derived maps. An archive also
+holds the transformed loops of both pipelines, the per-pixel results, the
+parsed parameters.xml and the pipeline configuration, so a scan can be
+reopened, plotted and compared later without reprocessing anything.
+
+An archive is a zip file:
+
+    meta.json               format, grid shape, parameters.xml dict, ps and
+                            the fingerprints of both pipelines
+    pixels.json             per-pixel results, without the loops
+    maps/<name>.npy         the arrays of batch.map_arrays()
+    loops/x=<x>y=<y>/loop.npy   (2, n) B, V of the first pipeline
+    loops/x=<x>y=<y>/loop2.npy  (2, n) B, V of the second pipeline
+
+Every array is its own compressed member, so ScanArchive can read the loop
+of a single pixel without reading (or decompressing) any other.
+"""
+import io
+import json
+import os
+import zipfile
+
+import numpy as np
+
+from .batch import map_arrays
+from .engine import ScanResult, make_transformers
+from .rawcache import write_atomic
+
+FORMAT = 1
+
+LOOP_KEYS = ('loop', 'loop2')
+
+
+def save_archive(result, path, compresslevel=6):
+    """Write a ScanResult to an archive.
+
+    Args:
+        result: ScanResult, analyzed with keep_loops=True for the loops to
+            be stored. Pixels without loops are stored without them.
+        path: path of the archive file. It is written to a temporary file
+            first, so readers never see a half written archive.
+        compresslevel: zlib compression level of the members, 0-9.
+    """
+    tfmr, tfmr2 = make_transformers(result.ps)
+    meta = {'format': FORMAT, 'shape': list(result.shape),
+            'parameters': result.parameters, 'ps': result.ps,
+            'pipeline': {'tfmr': tfmr.fingerprint().split('\n'),
+                         'tfmr2': tfmr2.fingerprint().split('\n')}}
+    pixels = [dict((k, v) for k, v in result[xy].items()
+                   if k not in LOOP_KEYS) for xy in result]
+
+    def write(f):
+        with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED,
+                             compresslevel=compresslevel) as zf:
+            zf.writestr('meta.json', json.dumps(jsonable(meta), indent=1))
+            zf.writestr('pixels.json', json.dumps(jsonable(pixels)))
+            for name, a in map_arrays(result).items():
+                _write_array(zf, 'maps/{}.npy'.format(name), a)
+            for xy in result:
+                for k in LOOP_KEYS:
+                    loop = result[xy].get(k)
+                    if loop is not None:
+                        _write_array(zf, _loop_member(xy, k),
+                                     np.stack(np.broadcast_arrays(*loop)))
+
+    write_atomic(os.path.abspath(path), write)
+
+
+def archive_path(root_path, out_dir):
+    """Name of the archive of the scan in root_path when saved to out_dir."""
+    return os.path.join(out_dir, os.path.basename(os.path.normpath(root_path)) +
+                        '_archive.zip')
+
+
+class ScanArchive(object):
+    """Reader of an archive written by save_archive().
+
+    Opening an archive only reads its metadata and per-pixel results; maps
+    and loops are read when asked for. Use as a context manager, or call
+    close().
+
+    Attributes:
+        shape: (gy, gx) of the scan.
+        parameters: dict parsed from the scan's parameters.xml.
+        ps: dict of the analysis parameters.
+        pipeline: dict of 'tfmr' and 'tfmr2' -> list of the fingerprints of
+            their stages, see Transformer.fingerprint.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        meta = json.loads(self._zip.read('meta.json').decode('utf-8'))
+        if meta['format'] > FORMAT:
+            self._zip.close()
+            raise ValueError('{} has archive format {}, this version reads '
+                             'up to {}'.format(path, meta['format'], FORMAT))
+        self.shape = tuple(meta['shape'])
+        self.parameters = meta['parameters']
+        self.ps = meta['ps']
+        self.pipeline = meta['pipeline']
+        self._pixels = {}
+        for p in json.loads(self._zip.read('pixels.json').decode('utf-8')):
+            for k in ('Hc', 'Mr'):
+                p[k] = np.array(p[k])
+            self._pixels[(p['x'], p['y'])] = p
+        self._names = set(self._zip.namelist())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    def __len__(self):
+        return len(self._pixels)
+
+    def __contains__(self, xy):
+        return tuple(xy) in self._pixels
+
+    def __iter__(self):
+        return iter(sorted(self._pixels))
+
+    def maps(self):
+        """Names of the stored maps."""
+        return sorted(n[len('maps/'):-len('.npy')] for n in self._names
+                      if n.startswith('maps/'))
+
+    def map(self, name):
+        """One of the maps, e.g. 'Hcs', as a (gy, gx[, 3]) array."""
+        return self._read_array('maps/{}.npy'.format(name))
+
+    def loop(self, x, y, key='loop'):
+        """The (B, V) loop of pixel (x, y) from the first pipeline, or the
+        second one with key='loop2'. Only this loop is read.
+
+        Raises:
+            KeyError: if the archive has no such loop.
+        """
+        if key not in LOOP_KEYS:
+            raise ValueError('key must be one of {}'.format(LOOP_KEYS))
+        a = self._read_array(_loop_member((x, y), key))
+        return a[0], a[1]
+
+    def pixel(self, x, y, loops=True):
+        """The per-pixel results dict of pixel (x, y), with its loops if
+        loops is True and they were stored.
+        """
+        res = dict(self._pixels[(x, y)])
+        for k in LOOP_KEYS if loops else ():
+            if _loop_member((x, y), k) in self._names:
+                res[k] = self.loop(x, y, k)
+        return res
+
+    def to_result(self, loops=True):
+        """Read the whole archive back into a ScanResult, e.g. to plot it
+        with the functions of rendering.
+        """
+        result = ScanResult(self.shape, self.parameters, self.ps)
+        for x, y in self:
+            result.add(self.pixel(x, y, loops))
+        return result
+
+    def _read_array(self, name):
+        try:
+            data = self._zip.read(name)
+        except KeyError:
+            raise KeyError('{} has no {}'.format(self.path, name))
+        return np.load(io.BytesIO(data))
+
+
+def _loop_member(xy, key):
+    return 'loops/x={}y={}/{}.npy'.format(xy[0], xy[1], key)
+
+
+def _write_array(zf, name, a):
+    buf = io.BytesIO()
+    np.save(buf, np.asarray(a), allow_pickle=False)
+    zf.writestr(name, buf.getvalue())
+
+
+def jsonable(obj):
+    """obj with numpy arrays and scalars turned into lists and Python
+    numbers, so it can be dumped as JSON.
+    """
+    if isinstance(obj, dict):
+        return dict((str(k), jsonable(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [jsonable(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return jsonable(obj.tolist())
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
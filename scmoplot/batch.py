@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Headless batch processing: analyze scans and write the maps to disk.
+
+Nothing in here imports matplotlib, so it can run on machines without a
+display or GUI backend.
+"""
+import json
+from os.path import basename, join, normpath, splitext
+
+import numpy as np
+
+from .engine import analyze, default_ps
+
+
+# Per-pixel results that are written out, as (key in the npz, pixel key).
+map_keys = (
+    ('Hcs', 'Hc'),
+    ('Mrs', 'Mr'),
+    ('areas', 'area'),
+    ('lsat_fields', 'lsat_field'),
+    ('rsat_fields', 'rsat_field'),
+    ('lslopes', 'lslope'),
+    ('rslopes', 'rslope'),
+)
+
+
+def map_arrays(result):
+    """The maps of a ScanResult as a dict of arrays: one (gy, gx[, 3]) array
+    per entry of map_keys, a boolean 'failed' map of pixels whose analysis
+    raised, and for results of individual scans averaged on the fly
+    (analyze(aggregate=True)) an int 'n_scans' map.
+    """
+    arrays = dict((k, result.grid(pk, fill=np.nan)) for k, pk in map_keys)
+    failed = np.zeros(result.shape, dtype=bool)
+    for x, y in result.errors():
+        failed[y, x] = True
+    arrays['failed'] = failed
+    if any('n_scans' in p for p in result.pixels.values()):
+        arrays['n_scans'] = result.grid('n_scans', fill=0).astype(int)
+    return arrays
+
+
+def save_maps(result, out_path, ps=None):
+    """Write the maps of a ScanResult to a .npz file.
+
+    The file holds the arrays of map_arrays() and the parameters used as a
+    JSON string under 'ps'.
+
+    Args:
+        result: ScanResult from scmoplot.engine.analyze()
+        out_path: path of the .npz file.
+        ps: dict of parameters the result was computed with. Defaults to
+            result.ps.
+    """
+    arrays = map_arrays(result)
+    arrays['ps'] = np.array(json.dumps(ps if ps is not None else result.ps))
+    np.savez(out_path, **arrays)
+
+
+def export_maps(root_path, out_path, user_ps={}, workers=None, cache=None,
+                results=None, profile=False, aggregate=False, exclude=(),
+                keep_loops=False, prefetch=2):
+    """Analyze a scan directory without plotting and save its maps.
+
+    Args:
+        root_path: the scan directory.
+        out_path: path of the .npz file to write.
+        user_ps: dict of parameters that override default_ps.
+        workers: number of worker processes, defaults to the number of CPUs.
+        cache: RawCache to read the loop files through, see analyze().
+        results: ResultCache of per-pixel results, see analyze().
+        profile: also profile the analysis and write the profile as JSON
+            next to the maps, see profile_path().
+        aggregate: average the individual scans instead of reading the
+            averaged files, see analyze().
+        exclude: scans left out with aggregate, see analyze().
+        keep_loops: keep the transformed loops in the result, e.g. to save
+            it with archive.save_archive() afterwards.
+        prefetch: read-ahead depth in chunks, see analyze().
+
+    Returns:
+        ScanResult
+    """
+    ps = dict(default_ps)
+    ps.update(user_ps)
+    result = analyze(root_path, ps, workers=workers, keep_loops=keep_loops,
+                     cache=cache, results=results, profile=profile,
+                     aggregate=aggregate, exclude=exclude, prefetch=prefetch)
+    save_maps(result, out_path, ps)
+    if result.profile is not None:
+        result.profile.to_json(profile_path(out_path))
+    return result
+
+
+def maps_path(root_path, out_dir):
+    """Name of the maps file of the scan in root_path when saved to out_dir."""
+    return join(out_dir, basename(normpath(root_path)) + '_maps.npz')
+
+
+def profile_path(out_path):
+    """Name of the profile written next to the maps file out_path."""
+    return splitext(out_path)[0] + '_profile.json'
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""Analyze the scans of a whole campaign, resumably.
+
+A wafer campaign is dozens of scan directories. run_campaign() analyzes
+them all in one go: the chunks of every scan are scheduled on one worker
+pool, through one RawCache and ResultCache, and the maps of each scan are
+written as soon as its last chunk is in.
+
+Progress is checkpointed to a JSON lines file, one line per analyzed pixel
+with its results and one per scan whose maps were written. If the run is
+interrupted (a crash, a reboot, Ctrl-C), running it again with the same
+checkpoint skips the finished scans and pixels and only analyzes the rest.
+
+A crash while analyzing a chunk fails the pixels of that chunk, and a scan
+that cannot be read at all (no parameters.xml, ...) fails as a whole; the
+other scans carry on either way. All failures are collected in a
+CampaignSummary, which the command line writes next to the maps.
+"""
+import glob
+import json
+import multiprocessing
+import os
+from collections import OrderedDict
+from os.path import abspath, isdir, join
+
+import numpy as np
+
+from .aggregate import scan_groups
+from .archive import jsonable
+from .batch import maps_path, save_maps
+from .engine import (PixelAnalyzer, ScanResult, default_ps, scan_chunks,
+                     scan_files)
+from .lvxml2dict import Cluster
+from .prefetch import Prefetcher
+
+FORMAT = 1
+
+
+def find_scans(patterns):
+    """Expand scan directories and glob patterns into the sorted list of the
+    scan directories (those with a parameters.xml) they match.
+    """
+    scans = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern) or [pattern]:
+            if isdir(path) and os.path.exists(join(path, 'parameters.xml')):
+                scans.add(abspath(path))
+    return sorted(scans)
+
+
+def summary_path(out_dir):
+    """Name of the campaign summary written to out_dir."""
+    return join(out_dir, 'campaign_summary.json')
+
+
+def checkpoint_path(out_dir):
+    """Default name of the checkpoint of a campaign writing to out_dir."""
+    return join(out_dir, 'campaign_checkpoint.jsonl')
+
+
+class Checkpoint(object):
+    """Append-only JSON lines log of the progress of a campaign.
+
+    The first line records the parameters of the campaign, so that a
+    checkpoint is never resumed with other ones. Every following line is
+    either {'scan': root, 'pixel': results dict} or {'scan': root,
+    'maps': path of the written maps}. Each line is flushed as it is
+    written; a line cut short by a crash is ignored when reading.
+
+    Args:
+        path: path of the checkpoint file, created if needed.
+
+    Attributes:
+        pixels: dict of scan root -> dict of file path -> results dict of
+            the pixels read from the file.
+        maps: dict of scan root -> path of its maps, for the finished scans.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.pixels = {}
+        self.maps = {}
+        if os.path.exists(path):
+            self._read()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def start(self, header):
+        """Check header against the one in the file, or write it if the
+        file is new.
+
+        Raises:
+            ValueError: if the file was written with another header.
+        """
+        header = json.loads(json.dumps(jsonable(header)))
+        if self.header is not None and self.header != header:
+            raise ValueError(
+                '{} was written by a campaign with other parameters, use '
+                'another checkpoint to start over'.format(self.path))
+        if self.header is None:
+            self.header = header
+            self._write(dict(header, format=FORMAT))
+
+    def add_pixels(self, scan, pixels):
+        """Record the results dicts of analyzed pixels of scan."""
+        done = self.pixels.setdefault(scan, {})
+        for pixel in pixels:
+            done[pixel['path']] = pixel
+        self._write(*({'scan': scan, 'pixel': p} for p in pixels))
+
+    def scan_done(self, scan, maps):
+        """Record that the maps of scan were written to maps."""
+        self.maps[scan] = maps
+        self._write({'scan': scan, 'maps': maps})
+
+    def _write(self, *records):
+        if self._f is None:
+            self._f = open(self.path, 'a')
+        for record in records:
+            self._f.write(json.dumps(jsonable(record)) + '\n')
+        self._f.flush()
+
+    def _read(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Cut short by a crash.
+                    continue
+                if 'format' in record:
+                    if record['format'] > FORMAT:
+                        raise ValueError(
+                            '{} has checkpoint format {}, this version reads '
+                            'up to {}'.format(self.path, record['format'],
+                                              FORMAT))
+                    record.pop('format')
+                    self.header = record
+                elif 'pixel' in record:
+                    pixel = record['pixel']
+                    for k in ('Hc', 'Mr'):
+                        pixel[k] = np.array(pixel[k])
+                    self.pixels.setdefault(record['scan'], {})[
+                        pixel['path']] = pixel
+                elif 'maps' in record:
+                    self.maps[record['scan']] = record['maps']
+
+
+class CampaignSummary(object):
+    """Outcome of every scan of a campaign.
+
+    Attributes:
+        scans: OrderedDict of scan root -> dict with 'maps' (path of the
+            maps file, or None if the scan failed), 'pixels' (number of
+            pixels analyzed), 'failures' (list of {'x', 'y', 'path',
+            'error'} of the failed pixels) and 'error' (why the whole scan
+            failed, or None).
+    """
+
+    def __init__(self):
+        self.scans = OrderedDict()
+
+    def add_scan(self, scan, maps=None, pixels=(), error=None):
+        """Record the outcome of scan from its results dicts."""
+        pixels = list(pixels)
+        failures = [dict((k, p[k]) for k in ('x', 'y', 'path', 'error'))
+                    for p in sorted(pixels, key=lambda p: (p['x'], p['y']))
+                    if p.get('error') is not None]
+        self.scans[scan] = {'maps': maps, 'pixels': len(pixels),
+                            'failures': failures, 'error': error}
+
+    def failed_scans(self):
+        """Roots of the scans that failed as a whole."""
+        return [s for s, v in self.scans.items() if v['error'] is not None]
+
+    def n_failures(self):
+        """Number of failed pixels over all scans."""
+        return sum(len(v['failures']) for v in self.scans.values())
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'scans': self.scans,
+                       'failed_scans': self.failed_scans(),
+                       'failed_pixels': self.n_failures()}, f, indent=1)
+
+
+class _ChunkRunner(object):
+    """Analyzes the (scan index, chunk) tasks of a campaign. Exceptions fail
+    the pixels of the chunk rather than the campaign. Picklable, like the
+    PixelAnalyzer it wraps.
+    """
+
+    def __init__(self, analyzer, grouped):
+        self.analyzer = analyzer
+        self.grouped = grouped
+
+    def __call__(self, task):
+        return self.analyze(self.read(task))
+
+    def read(self, task):
+        i, items = task
+        try:
+            return i, items, self.analyzer.read_chunk(items, self.grouped)
+        except Exception as e:
+            return i, items, e
+
+    def analyze(self, read):
+        i, items, chunk = read
+        try:
+            if isinstance(chunk, Exception):
+                raise chunk
+            return i, self.analyzer.analyze_chunk(chunk)
+        except Exception as e:
+            return i, [self.analyzer.failed(self._path(item), e)
+                       for item in items]
+
+    def _path(self, item):
+        return item[0] if self.grouped else item
+
+
+class _Scan(object):
+    """State of one scan of a running campaign."""
+
+    def __init__(self, root, result, items):
+        self.root = root
+        self.result = result
+        self.items = items
+        self.remaining = 0
+
+
+def run_campaign(scans, out_dir, user_ps={}, workers=None, chunksize=16,
+                 cache=None, results=None, checkpoint=None, aggregate=False,
+                 exclude=(), retry_failed=False, prefetch=2, progress=None):
+    """Analyze many scan directories on one worker pool and save their maps.
+
+    Args:
+        scans: scan directories or glob patterns, see find_scans().
+        out_dir: directory to write the maps to, see batch.maps_path().
+        user_ps: dict of parameters that override default_ps.
+        workers: number of worker processes shared by all scans. Defaults to
+            the number of CPUs. With workers=1 everything runs in the
+            calling process.
+        chunksize: number of files handed to a worker at a time.
+        cache: RawCache to read the loop files through, or None.
+        results: ResultCache of per-pixel results, or None.
+        checkpoint: path of the checkpoint file. Defaults to
+            checkpoint_path(out_dir). Pass the same path again to resume.
+        aggregate: average the individual scans of every pixel instead of
+            reading the averaged files, see engine.analyze().
+        exclude: scans left out with aggregate, see engine.analyze().
+        retry_failed: when resuming, analyze the pixels that failed in the
+            earlier run again rather than keeping their failure, and rewrite
+            the maps of the finished scans that had any.
+        prefetch: with workers=1, read-ahead depth in chunks, see
+            engine.analyze().
+        progress: function (scan root, summary dict of the scan) called as
+            each scan is finished, see CampaignSummary.scans.
+
+    Returns:
+        CampaignSummary
+
+    Raises:
+        ValueError: if checkpoint was written by a campaign with other
+            parameters.
+    """
+    ps = dict(default_ps)
+    ps.update(user_ps)
+    if not isdir(out_dir):
+        os.makedirs(out_dir)
+    if checkpoint is None:
+        checkpoint = checkpoint_path(out_dir)
+    analyzer = PixelAnalyzer(ps, keep_loops=False, cache=cache,
+                             results=results)
+    runner = _ChunkRunner(analyzer, aggregate)
+    summary = CampaignSummary()
+
+    def finish(scan):
+        out_path = maps_path(scan.root, out_dir)
+        try:
+            save_maps(scan.result, out_path)
+        except Exception as e:
+            summary.add_scan(scan.root, None, scan.result.pixels.values(),
+                             '{}: {}'.format(type(e).__name__, e))
+        else:
+            ckpt.scan_done(scan.root, out_path)
+            summary.add_scan(scan.root, out_path,
+                             scan.result.pixels.values())
+        if progress is not None:
+            progress(scan.root, summary.scans[scan.root])
+
+    with Checkpoint(checkpoint) as ckpt:
+        ckpt.start({'ps': ps, 'aggregate': aggregate,
+                    'exclude': sorted(exclude, key=str)})
+        pending, tasks = [], []
+        for root in find_scans(scans):
+            done = ckpt.pixels.get(root, {})
+            retry = retry_failed and any(p.get('error') is not None
+                                         for p in done.values())
+            if root in ckpt.maps and not retry:
+                summary.add_scan(root, ckpt.maps[root], done.values())
+                if progress is not None:
+                    progress(root, summary.scans[root])
+                continue
+            try:
+                scan = _open_scan(root, ps, analyzer, aggregate, exclude)
+            except Exception as e:
+                summary.add_scan(root, error='{}: {}'.format(
+                    type(e).__name__, e))
+                if progress is not None:
+                    progress(root, summary.scans[root])
+                continue
+            todo = []
+            for item in scan.items:
+                pixel = done.get(runner._path(item))
+                if pixel is None or (retry_failed and
+                                     pixel.get('error') is not None):
+                    todo.append(item)
+                else:
+                    scan.result.add(pixel)
+            chunks = scan_chunks(todo, chunksize)
+            scan.remaining = len(chunks)
+            pending.append(scan)
+            tasks.extend((len(pending) - 1, chunk) for chunk in chunks)
+
+        for scan in pending:
+            if scan.remaining == 0:
+                finish(scan)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(tasks)))
+
+        def collect(outputs):
+            for i, pixels in outputs:
+                scan = pending[i]
+                for pixel in pixels:
+                    scan.result.add(pixel)
+                ckpt.add_pixels(scan.root, pixels)
+                scan.remaining -= 1
+                if scan.remaining == 0:
+                    finish(scan)
+
+        if workers == 1 and prefetch:
+            collect(map(runner.analyze,
+                        Prefetcher(tasks, runner.read, depth=prefetch)))
+        elif workers == 1:
+            collect(map(runner, tasks))
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                collect(pool.imap_unordered(runner, tasks))
+    return summary
+
+
+def _open_scan(root, ps, analyzer, aggregate, exclude):
+    """_Scan of the scan directory root, with an empty ScanResult and the
+    items (paths, or lists of paths if aggregate) to analyze.
+    """
+    clust = Cluster(join(root, 'parameters.xml')).to_dict()
+    gx, gy = (clust['Rows'], clust['Cols'])
+    if aggregate:
+        index = analyzer.gleaner.index_directory(root)
+        items = list(scan_groups(index, exclude).values())
+    else:
+        items = scan_files(root, analyzer.gleaner)
+    return _Scan(root, ScanResult((gy, gx), clust, ps), items)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""Command line interface for headless processing of scans.
+
+    scmoplot-batch maps SCAN_DIR [SCAN_DIR ...] -o OUT_DIR [-p thresh=8]
+    scmoplot-batch maps SCAN_DIR -o OUT_DIR --aggregate --exclude 3
+    scmoplot-batch maps SCAN_DIR -o OUT_DIR --archive
+    scmoplot-batch sweep SCAN_DIR -o OUT_DIR -g thresh=6,7,8 -g filt_ks=101,157
+    scmoplot-batch campaign 'wafer*/scan*' -o OUT_DIR [--retry-failed]
+"""
+import argparse
+import ast
+import os
+import sys
+
+import numpy as np
+
+from .archive import archive_path, save_archive
+from .batch import export_maps, maps_path, save_maps
+from .campaign import checkpoint_path, run_campaign, summary_path
+from .engine import scan_files
+from .prefetch import format_stats
+from .rawcache import RawCache
+from .resultcache import ResultCache
+from .sweep import save_sweep, sweep, sweep_path
+from .watch import ScanWatcher
+
+
+def parse_param(s):
+    """Parse 'key=value' into (key, value). value is a Python literal if it
+    looks like one (7, 10.0, ...) and a string otherwise.
+    """
+    try:
+        k, v = s.split('=', 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected key=value, got ' + s)
+    try:
+        v = ast.literal_eval(v)
+    except (ValueError, SyntaxError):
+        pass
+    return k, v
+
+
+def parse_grid(s):
+    """Parse 'key=v1,v2,...' into (key, [v1, v2, ...]), each value parsed
+    like in parse_param.
+    """
+    k, v = parse_param(s)
+    if isinstance(v, str):
+        vals = [parse_param('_=' + u)[1] for u in v.split(',')]
+    elif isinstance(v, (tuple, list)):
+        vals = list(v)
+    else:
+        vals = [v]
+    return k, vals
+
+
+def parse_exclude(s):
+    """Parse a scan number '3', or 'scan,x,y' for a single file, as taken by
+    aggregate.scan_groups.
+    """
+    try:
+        vals = tuple(int(v) for v in s.split(','))
+    except ValueError:
+        vals = ()
+    if len(vals) not in (1, 3):
+        raise argparse.ArgumentTypeError('expected SCAN or SCAN,X,Y, got ' + s)
+    return vals[0] if len(vals) == 1 else vals
+
+
+def _add_common_args(parser):
+    parser.add_argument('-p', '--param', dest='params', action='append',
+                        type=parse_param, default=[], metavar='KEY=VALUE',
+                        help='override a default parameter, e.g. thresh=8. '
+                             'May be repeated.')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes (default: #CPUs)')
+    _add_cache_args(parser)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse and analyze every raw file, without the '
+                             'binary cache or the results cache')
+
+
+def _add_cache_args(parser):
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory of the binary cache of raw files and '
+                             'the results cache (default: '
+                             '$SCMOPLOT_CACHE_DIR or ~/.cache/scmoplot)')
+    parser.add_argument('--cache-size', type=float, default=2.0,
+                        metavar='GB', help='size limit of each cache in GB')
+
+
+def _raw_cache(args):
+    if getattr(args, 'no_cache', False):
+        return None
+    cache_dir = None
+    if args.cache_dir is not None:
+        cache_dir = os.path.join(args.cache_dir, 'raw')
+    return RawCache(cache_dir, max_bytes=int(args.cache_size * 1024**3))
+
+
+def _result_cache(args):
+    if getattr(args, 'no_cache', False):
+        return None
+    cache_dir = None
+    if args.cache_dir is not None:
+        cache_dir = os.path.join(args.cache_dir, 'results')
+    return ResultCache(cache_dir, max_bytes=int(args.cache_size * 1024**3))
+
+
+def cmd_maps(args):
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    user_ps = dict(args.params)
+    status = 0
+    for root_path in args.scans:
+        out_path = maps_path(root_path, args.out)
+        print('{} -> {}'.format(root_path, out_path))
+        try:
+            result = export_maps(root_path, out_path, user_ps, args.workers,
+                                 cache=_raw_cache(args),
+                                 results=_result_cache(args),
+                                 profile=args.profile,
+                                 aggregate=args.aggregate,
+                                 exclude=args.exclude,
+                                 keep_loops=args.archive,
+                                 prefetch=args.prefetch)
+            if args.archive:
+                save_archive(result, archive_path(root_path, args.out))
+        except Exception as e:
+            print('\tfailed: {}'.format(e))
+            status = 1
+            continue
+        for (x, y), msg in sorted(result.errors().items()):
+            print('\tx={} y={}\t{}'.format(x, y, msg))
+        if result.profile is not None:
+            print(result.profile.table())
+            if result.io_stats is not None:
+                print(format_stats(result.io_stats))
+    return status
+
+
+def cmd_watch(args):
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    out_path = maps_path(args.scan, args.out)
+
+    def saved(watcher, updated):
+        save_maps(watcher.result, out_path, watcher.ps)
+        print('{} pixels updated, {}/{} done -> {}'.format(
+            len(updated), len(watcher.result),
+            watcher.result.shape[0] * watcher.result.shape[1], out_path))
+
+    with ScanWatcher(args.scan, dict(args.params), args.workers or 1,
+                     cache=_raw_cache(args),
+                     results=_result_cache(args)) as watcher:
+        watcher.watch(args.interval, saved, timeout=args.timeout)
+    return 0
+
+
+def cmd_sweep(args):
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    out_path = sweep_path(args.scan, args.out)
+    grid = dict(args.grid)
+    result = sweep(args.scan, grid, dict(args.params), args.workers,
+                   cache=_raw_cache(args))
+    save_sweep(result, out_path)
+    names = sorted(grid)
+    print('\t'.join(names + ['failed', 'median Hc', 'median Mr']))
+    Hcs, Mrs, failed = result.Hcs[..., 1], result.Mrs[..., 1], result.failed()
+    for i, ps in enumerate(result.params):
+        ok = ~failed[i]
+        print('\t'.join([str(ps[k]) for k in names] + [
+            str(failed[i].sum()),
+            '{:.4g}'.format(np.median(Hcs[i][ok])) if ok.any() else '-',
+            '{:.4g}'.format(np.median(Mrs[i][ok])) if ok.any() else '-']))
+    print('-> {}'.format(out_path))
+    return 0
+
+
+def cmd_campaign(args):
+    def progress(scan, outcome):
+        if outcome['error'] is not None:
+            print('{}\tfailed: {}'.format(scan, outcome['error']))
+        else:
+            print('{} -> {}\t{} pixels, {} failed'.format(
+                scan, outcome['maps'], outcome['pixels'],
+                len(outcome['failures'])))
+
+    summary = run_campaign(args.scans, args.out, dict(args.params),
+                           args.workers, cache=_raw_cache(args),
+                           results=_result_cache(args),
+                           checkpoint=args.checkpoint,
+                           aggregate=args.aggregate, exclude=args.exclude,
+                           retry_failed=args.retry_failed,
+                           prefetch=args.prefetch, progress=progress)
+    out_path = summary_path(args.out)
+    summary.to_json(out_path)
+    print('{} scans, {} failed, {} failed pixels -> {}'.format(
+        len(summary.scans), len(summary.failed_scans()),
+        summary.n_failures(), out_path))
+    return 1 if summary.failed_scans() else 0
+
+
+def cmd_cache(args):
+    cache, results = _raw_cache(args), _result_cache(args)
+    if args.action == 'clear':
+        cache.clear()
+        results.clear()
+    elif args.action == 'rebuild':
+        for root_path in args.scans:
+            for path in scan_files(root_path):
+                cache.rebuild(path)
+    for c in (cache, results):
+        print('{}: {} entries, {:.1f} MB'.format(
+            c.cache_dir, len(c.entries()), c.size() / 1024.**2))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='scmoplot-batch',
+        description='Process scanning MOKE scans without a display.')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    p = sub.add_parser('maps', help='write Hc/Mrem/area/saturation maps of '
+                                    'each scan to OUT/<scan>_maps.npz')
+    p.add_argument('scans', nargs='+', metavar='SCAN_DIR')
+    p.add_argument('-o', '--out', required=True, metavar='OUT_DIR')
+    p.add_argument('--profile', action='store_true',
+                   help='time each step of the analysis, print a table and '
+                        'write OUT/<scan>_maps_profile.json')
+    p.add_argument('--prefetch', type=int, default=2, metavar='N',
+                   help='with one worker, read up to N chunks of files ahead '
+                        'of the analysis on background threads (0: off)')
+    p.add_argument('--archive', action='store_true',
+                   help='also write the transformed loops, maps and '
+                        'parameters to OUT/<scan>_archive.zip')
+    p.add_argument('--aggregate', action='store_true',
+                   help='average the individual scan files of each pixel '
+                        'instead of reading the averaged files. The Hc and '
+                        'Mrem uncertainties then come from the standard '
+                        'error of the scans, scaled by the gain and median '
+                        'filter of the pipeline like the sigma_y estimate '
+                        'used otherwise')
+    p.add_argument('--exclude', action='append', type=parse_exclude,
+                   default=[], metavar='SCAN[,X,Y]',
+                   help='with --aggregate, leave out a scan, or the file of '
+                        'a single pixel of it. May be repeated.')
+    _add_common_args(p)
+    p.set_defaults(func=cmd_maps)
+
+    p = sub.add_parser('watch', help='analyze a scan while it is acquired '
+                                     'and keep OUT/<scan>_maps.npz current')
+    p.add_argument('scan', metavar='SCAN_DIR')
+    p.add_argument('-o', '--out', required=True, metavar='OUT_DIR')
+    p.add_argument('-i', '--interval', type=float, default=2.0,
+                   help='seconds between polls of SCAN_DIR')
+    p.add_argument('-t', '--timeout', type=float, default=None,
+                   help='give up after this many seconds')
+    _add_common_args(p)
+    p.set_defaults(func=cmd_watch)
+
+    p = sub.add_parser('sweep', help='analyze a scan for every combination '
+                                     'of parameter values and write the '
+                                     'stacked maps to OUT/<scan>_sweep.npz')
+    p.add_argument('scan', metavar='SCAN_DIR')
+    p.add_argument('-o', '--out', required=True, metavar='OUT_DIR')
+    p.add_argument('-g', '--grid', action='append', type=parse_grid,
+                   required=True, metavar='KEY=V1,V2,...',
+                   help='values of a parameter to sweep, e.g. '
+                        'thresh=6,7,8. May be repeated.')
+    _add_common_args(p)
+    p.set_defaults(func=cmd_sweep)
+
+    p = sub.add_parser('campaign', help='analyze many scans on one worker '
+                                        'pool, resumably, and write their '
+                                        'maps and a summary of the failures '
+                                        'to OUT')
+    p.add_argument('scans', nargs='+', metavar='SCAN_DIR_OR_GLOB')
+    p.add_argument('-o', '--out', required=True, metavar='OUT_DIR')
+    p.add_argument('--checkpoint', default=None, metavar='PATH',
+                   help='progress file to resume from (default: '
+                        'OUT/{})'.format(os.path.basename(checkpoint_path(''))))
+    p.add_argument('--retry-failed', action='store_true',
+                   help='analyze the pixels that failed in an earlier run '
+                        'again')
+    p.add_argument('--prefetch', type=int, default=2, metavar='N',
+                   help='with one worker, read up to N chunks of files ahead '
+                        'of the analysis on background threads (0: off)')
+    p.add_argument('--aggregate', action='store_true',
+                   help='average the individual scan files of each pixel '
+                        'instead of reading the averaged files. The Hc and '
+                        'Mrem uncertainties then come from the standard '
+                        'error of the scans, scaled by the gain and median '
+                        'filter of the pipeline like the sigma_y estimate '
+                        'used otherwise')
+    p.add_argument('--exclude', action='append', type=parse_exclude,
+                   default=[], metavar='SCAN[,X,Y]',
+                   help='with --aggregate, leave out a scan, or the file of '
+                        'a single pixel of it, in every scan directory. May '
+                        'be repeated.')
+    _add_common_args(p)
+    p.set_defaults(func=cmd_campaign)
+
+    p = sub.add_parser('cache', help='inspect or clear the binary cache of '
+                                     'raw files and the results cache, or '
+                                     'rebuild the binary cache')
+    p.add_argument('action', choices=('info', 'clear', 'rebuild'))
+    p.add_argument('scans', nargs='*', metavar='SCAN_DIR',
+                   help='scans to rebuild the entries of')
+    _add_cache_args(p)
+    p.set_defaults(func=cmd_cache)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,733 @@
+# -*- coding: utf-8 -*-
+"""Per-pixel analysis of a scan directory.
+
+The analysis of each pixel (load, run both Transformer pipelines, extract
+Hc, Mrem, loop area, ...) is independent of every other pixel, so it is run
+in a process pool. The results are collected into a ScanResult laid out on
+the scan grid, which the plotting code renders afterwards.
+"""
+import functools
+import multiprocessing
+import warnings
+from os.path import join, basename
+
+import numpy as np
+
+from .lvxml2dict import Cluster
+from .namegleaner import NameGleaner
+from .transformer import Transformer
+from . import transformations as tfms
+from .aggregate import average_scans, scan_groups
+from .loading import load_loop
+from .loopstack import LoopStack
+from .prefetch import Prefetcher
+from .profiling import Profile
+from .rawcache import RawCache, file_key
+from .resultcache import LOCATION_KEYS, ResultCache
+
+
+default_ps = {
+    'xlim': 10.0,
+    'ylim': 1.1,
+    'thresh': 7,  # where to start fits
+    'max': 10,  # highest field
+    'filt_ks': 157,
+    # Fields per branch of the shared grid every loop is resampled onto
+    # (see transformations.resample_branches), or None to keep the samples.
+    'resample': None,
+}
+
+
+# The pipelines work in tenths of the raw field units.
+FIELD_SCALE = 0.1
+
+
+def scan_gleaner():
+    """Return the NameGleaner used to pick apart scan file names."""
+    return NameGleaner(scan=r'scan=(\d+)', x=r'x=(\d+)', y=r'y=(\d+)',
+                       averaged=r'(averaged)')
+
+
+def make_transformers(ps, gleaner=None, memo=None, inplace=False):
+    """Build the two pipelines that every loop is run through.
+
+    The first (tfmr) produces the flattened, normalized loop that Hc and Mrem
+    are extracted from. The second (tfmr2) only smooths and centers the loop
+    and is used for the tangent lines, saturation fields and loop area.
+
+    With ps['resample'] both end by resampling the loops onto one field grid
+    over -max..max, so a transformed stack has a single 1-D x. The
+    saturation corrections and filters before it work on the measured
+    points, so filt_ks and thresh mean the same with and without it.
+
+    Args:
+        ps: dict of parameters, see default_ps.
+        gleaner: passed on to the Transformers.
+        memo: PrefixMemo shared by both Transformers, or None.
+        inplace: run both in the in-place mode of Transformer. Each copies
+            its input, so neither changes what the other is given.
+
+    Returns:
+        tuple: (tfmr, tfmr2)
+    """
+    resample = resample_params(ps)
+
+    tfmr = Transformer(gleaner=gleaner, memo=memo, inplace=inplace)
+    tfmr.add(10, tfms.scale, params={'xsc': FIELD_SCALE})
+    tfmr.add(20, tfms.flatten_saturation,
+             params={'threshold': ps['thresh'], 'polarity': '+'})
+    tfmr.add(25, tfms.center)
+    tfmr.add(30, tfms.wrapped_medfilt, params={'ks': ps['filt_ks']})
+    tfmr.add(40, tfms.saturation_normalize, params={'thresh': ps['thresh']})
+    if resample:
+        tfmr.add(50, tfms.resample_branches, params=resample)
+
+    tfmr2 = Transformer(gleaner=gleaner, memo=memo, inplace=inplace)
+    tfmr2.add(10, tfms.scale, params={'xsc': FIELD_SCALE})
+    tfmr2.add(30, tfms.wrapped_medfilt, params={'ks': ps['filt_ks']})
+    tfmr2.add(40, tfms.clean)
+    tfmr2.add(50, tfms.center)
+    if resample:
+        tfmr2.add(60, tfms.resample_branches, params=resample)
+    return tfmr, tfmr2
+
+
+def resample_params(ps):
+    """Params of the resample_branches stage of the pipelines, or None if
+    ps doesn't resample.
+    """
+    if not ps.get('resample'):
+        return None
+    return {'n': ps['resample'], 'lim': (-ps['max'], ps['max'])}
+
+
+class PixelAnalyzer(object):
+    """Callable that runs the full analysis of a single loop file.
+
+    Instances only hold plain data and module level functions so they can be
+    pickled and shipped to worker processes.
+
+    Both pipelines run in place (see Transformer), in arrays that are reused
+    from one loop or chunk to the next, so the loops kept with keep_loops
+    are copies.
+
+    Args:
+        ps: dict of parameters, see default_ps.
+        keep_loops: if True the transformed loops are kept in the results so
+            that they can be plotted.
+        cache: RawCache to read the loop files through, or None.
+        loader: function path -> (B, V) that reads the loop files instead,
+            e.g. a reader.CycleLoader to analyze one cycle of each file.
+            The cache is not used for loading when it is given.
+        results: ResultCache that batch() looks the results of each file
+            up in before analyzing it, or None.
+        memo: PrefixMemo of the intermediate outputs of both pipelines, so
+            that only the stages whose params changed are rerun. Or None.
+            Loops read whole from their files are looked up by the identity
+            of the file (see rawcache.file_key) rather than by hashing them.
+        profile: if True, loading, every stage of both pipelines and the
+            feature extraction are timed into the Profile in profile.
+    """
+
+    def __init__(self, ps, keep_loops=True, cache=None, loader=None,
+                 results=None, memo=None, profile=False):
+        self.ps = ps
+        self.keep_loops = keep_loops
+        self.cache = cache
+        self.loader = loader
+        self.results = results
+        self.gleaner = scan_gleaner()
+        self.tfmr, self.tfmr2 = make_transformers(ps, self.gleaner, memo,
+                                                  inplace=True)
+        self.profile = None
+        if profile:
+            self.profile = Profile()
+            self.tfmr.enable_profiling(self.profile, 'tfmr')
+            self.tfmr2.enable_profiling(self.profile, 'tfmr2')
+
+    def __call__(self, path):
+        """Analyze the loop file at path.
+
+        Returns:
+            dict: the per-pixel results. 'error' is None unless something
+                went wrong, in which case it holds the message and the
+                numeric results that could not be computed are zeroed.
+        """
+        try:
+            Bi, Vi = self._timed('load', self.load, path)
+        except Exception as e:
+            return self.failed(path, e)
+        return self.analyze_loop(path, Bi, Vi, key=self.data_key(path))
+
+    def analyze_loop(self, path, Bi, Vi, noise=None, key=None):
+        """Analyze a loop that was read from the file at path.
+
+        Args:
+            noise: per-point noise of Vi, e.g. the V_sem of
+                aggregate.average_scans, used for the uncertainties of Hc
+                and Mrem. Estimated with sigma_y if None.
+            key: memo key of (Bi, Vi), see data_key(), or None.
+
+        Returns:
+            dict: the per-pixel results, see __call__.
+        """
+        f = basename(path)
+        res = self._new_result(path)
+        try:
+            B, V = self.tfmr((Bi, Vi), f, key)
+            B2, V2 = self.tfmr2((Bi, Vi), f, key)
+        except Exception as e:
+            res['error'] = '{}: {}'.format(type(e).__name__, e)
+            return res
+        s_y = self._noise(Bi, Vi, B, V, noise)
+        return self._extract(res, B, V, B2, V2, s_y=s_y)
+
+    def batch(self, paths):
+        """Analyze the loop files at paths as one LoopStack.
+
+        The files are loaded into a stack and each pipeline is run once over
+        the whole stack. If the files differ in length or the stack fails to
+        transform, the files are analyzed one by one instead so that a bad
+        file only spoils its own pixel.
+
+        With a ResultCache only the files that have no entry are analyzed,
+        and their results are stored.
+
+        This is read_chunk() followed by analyze_chunk().
+
+        Returns:
+            list: per-pixel results dicts, see __call__.
+        """
+        return self.analyze_chunk(self.read_chunk(paths))
+
+    def read_chunk(self, items, grouped=False):
+        """The I/O half of batch(), or of batch_groups() if grouped: look
+        the files up in the ResultCache and load the rest.
+
+        Only reads, so it can run on another thread than the
+        analyze_chunk() of the previous chunk (see prefetch).
+
+        Args:
+            items: list of paths, or of lists of the paths of the scans of
+                each pixel if grouped.
+
+        Returns:
+            Chunk
+        """
+        chunk = Chunk(items, grouped)
+        if grouped:
+            self._read_groups(chunk)
+            return chunk
+        if self.results is not None:
+            fingerprint = self.fingerprint
+            chunk.keys = [self._result_key(p, fingerprint) for p in items]
+            for i, (path, key) in enumerate(zip(items, chunk.keys)):
+                if key is None:
+                    continue
+                res = self.results.get(key)
+                if res is not None:
+                    new = self._new_result(path)
+                    res.update((k, new[k]) for k in LOCATION_KEYS)
+                    chunk.pixels[i] = res
+        chunk.todo = [i for i, res in enumerate(chunk.pixels) if res is None]
+        paths = [items[i] for i in chunk.todo]
+        if paths:
+            try:
+                chunk.stack = LoopStack(*self._timed(
+                    'load', self._load_stack, paths, rows=len(paths)),
+                    targets=paths)
+            except Exception:
+                # Analyzed one by one.
+                chunk.stack = None
+        return chunk
+
+    def _result_key(self, path, fingerprint):
+        """ResultCache key of the file at path, or None if it can't be read.
+        The file then counts as a miss and fails to load like it would
+        without a cache, failing only its own pixel.
+        """
+        try:
+            return self.results.key(path, fingerprint)
+        except (IOError, OSError):
+            return None
+
+    def _read_groups(self, chunk):
+        loops = []
+        for i, paths in enumerate(chunk.items):
+            try:
+                loops.append((i, self._timed('load', average_scans, paths,
+                                             self.load, rows=len(paths))))
+            except Exception as e:
+                chunk.pixels[i] = self.failed(paths[0], e)
+        chunk.todo = [i for i, loop in loops]
+        chunk.loops = [loop for i, loop in loops]
+        try:
+            chunk.stack = LoopStack([loop.B for loop in chunk.loops],
+                                    [loop.V for loop in chunk.loops],
+                                    targets=[chunk.items[i][0]
+                                             for i in chunk.todo])
+            chunk.noise = np.array([loop.V_sem for loop in chunk.loops])
+        except ValueError:
+            # Pixels with loops of different lengths.
+            chunk.stack = None
+
+    def analyze_chunk(self, chunk):
+        """The compute half of batch() or batch_groups(): analyze a Chunk
+        from read_chunk().
+
+        Returns:
+            list: per-pixel results dicts, see __call__.
+        """
+        out = list(chunk.pixels)
+        if not chunk.todo:
+            return out
+        if chunk.stack is not None:
+            keys = None
+            if not chunk.grouped:
+                keys = [self.data_key(chunk.items[i]) for i in chunk.todo]
+            new = self.analyze_stack(chunk.stack, chunk.noise, keys)
+        elif chunk.grouped:
+            new = [self.analyze_loop(chunk.items[i][0], loop.B, loop.V,
+                                     loop.V_sem)
+                   for i, loop in zip(chunk.todo, chunk.loops)]
+        else:
+            new = [self(chunk.items[i]) for i in chunk.todo]
+        for j, (i, res) in enumerate(zip(chunk.todo, new)):
+            if chunk.grouped:
+                res['n_scans'] = chunk.loops[j].n
+                res['scans'] = [int(self.gleaner.glean(basename(p))['scan'])
+                                for p in chunk.items[i]]
+            elif chunk.keys is not None and chunk.keys[i] is not None:
+                self.results.put(chunk.keys[i], res)
+            out[i] = res
+        return out
+
+    def analyze_stack(self, stack, noise=None, keys=None):
+        """Analyze the loops of a LoopStack whose targets are the paths of
+        their files, as batch() does after loading them. If the stack fails
+        to transform, its loops are analyzed one by one instead.
+
+        Args:
+            noise: per-point noise of stack.y, same shape, or None. See
+                analyze_loop.
+            keys: memo keys of the rows of the stack (see data_key()), or
+                None.
+
+        Returns:
+            list: per-pixel results dicts, see __call__.
+        """
+        paths = stack.targets
+        if keys is None or None in keys:
+            keys, key = [None] * len(paths), None
+        else:
+            key = '\n'.join(keys)
+        try:
+            targets = [basename(p) for p in paths]
+            Bs, Vs = self.tfmr.call_stack((stack.x, stack.y), targets, key)
+            B2s, V2s = self.tfmr2.call_stack((stack.x, stack.y), targets, key)
+        except Exception:
+            xs = np.broadcast_to(stack.x, stack.y.shape)
+            return [self.analyze_loop(path, xs[i], stack.y[i],
+                                      None if noise is None else noise[i],
+                                      keys[i])
+                    for i, path in enumerate(paths)]
+        Bs, B2s = np.broadcast_to(Bs, Vs.shape), np.broadcast_to(B2s, V2s.shape)
+        s_y = self._noise(stack.x, stack.y, Bs, Vs, noise)
+        features = self._timed('extract/loop_features', tfms.loop_features,
+                               B2s, V2s, rows=len(paths))
+        Hcs, Mrs = self._timed('extract/Hc_Mrem', tfms.Hc_Mrem, Bs, Vs,
+                               fit_int=self.fit_int, s_y=s_y, rows=len(paths))
+        return [self._extract(self._new_result(path), Bs[i], Vs[i], B2s[i],
+                              V2s[i], dict((k, v[i])
+                                           for k, v in features.items()),
+                              (Hcs[i], Mrs[i]))
+                for i, path in enumerate(paths)]
+
+    def batch_groups(self, groups):
+        """Analyze pixels from their individual scans rather than their
+        averaged files.
+
+        The scans of each pixel are averaged with aggregate.average_scans
+        and the averages analyzed as one LoopStack, using the standard error
+        of each averaged loop as its noise. The results also hold the number
+        of scans averaged ('n_scans') and their scan numbers ('scans').
+        Results are not looked up in or stored to the ResultCache.
+
+        Args:
+            groups: list of lists of the paths of the scans of each pixel,
+                see aggregate.scan_groups.
+
+        Returns:
+            list: per-pixel results dicts, see __call__. 'path' is the path
+                of the first scan of the pixel.
+        """
+        return self.analyze_chunk(self.read_chunk(groups, grouped=True))
+
+    def profiled_batch(self, paths, grouped=False):
+        """Like batch(), or batch_groups() if grouped, but also return the
+        Profile of this call.
+
+        Needs profile=True. This is what analyze() hands to its workers to
+        get their profiles back.
+
+        Returns:
+            tuple: (list of per-pixel results, Profile)
+        """
+        self.profile.clear()
+        pixels = self.batch_groups(paths) if grouped else self.batch(paths)
+        return pixels, Profile().merge(self.profile)
+
+    def load(self, path):
+        """Read a loop file with the loader, or through the cache if there
+        is one.
+        """
+        if self.loader is not None:
+            return self.loader(path)
+        if self.cache is not None:
+            return self.cache.load(path)
+        return load_loop(path)
+
+    def data_key(self, path):
+        """Memo key of the loop that load() reads from the file at path: the
+        rawcache.file_key of the file. None without a memo, or with a
+        loader, which may read only part of the file.
+        """
+        if self.tfmr.memo is None or self.loader is not None:
+            return None
+        return file_key(path)
+
+    def _load_stack(self, paths):
+        """Read the loop files at paths into (x, y) stacks."""
+        if self.loader is None and self.cache is not None:
+            return self.cache.load_scan(paths)
+        stack = LoopStack.from_files(paths, self.loader or load_loop)
+        return stack.x, stack.y
+
+    def _timed(self, step, func, *args, **kwargs):
+        """Call func, recording it as step if profiling."""
+        rows = kwargs.pop('rows', 1)
+        if self.profile is None:
+            return func(*args, **kwargs)
+        return self.profile.call(step, func, args, kwargs, rows=rows)
+
+    def _noise(self, Bi, Vi, B, V, noise):
+        """Turn the per-point noise of the raw signal Vi into the s_y of the
+        output (B, V) of tfmr.
+
+        The noise is scaled by the gain of the pipeline and by how much its
+        median filter reduces white noise (see tfms.median_noise_gain), so
+        that it estimates the same thing as the sigma_y of the loops without
+        a noise: the scatter of the points of V. With ps['resample'] the
+        noise is resampled like the loop.
+
+        Loops whose noise isn't finite (a single scan) get a sigma_y
+        estimate instead. Returns None if there is no noise to use, with a
+        warning if that is because it doesn't match the points of V.
+        """
+        if noise is None:
+            return None
+        resample = resample_params(self.ps)
+        if resample is not None and np.shape(noise) == np.shape(Vi):
+            x = FIELD_SCALE * np.broadcast_to(Bi, np.shape(Vi))
+            _, Vi = tfms.resample_branches(x, Vi, **resample)
+            Bi, noise = tfms.resample_branches(x, noise, **resample)
+        if np.shape(noise) != np.shape(V):
+            warnings.warn('noise of shape {} does not match the transformed '
+                          'loops of shape {}, using sigma_y instead'.format(
+                              np.shape(noise), np.shape(V)))
+            return None
+        gain = tfms.linear_gain(Bi, Vi, V)
+        s_y = (np.abs(gain)[..., None] *
+               tfms.median_noise_gain(self.ps['filt_ks']) * noise)
+        bad = ~np.isfinite(s_y)
+        if bad.any():
+            s_y = np.where(bad, tfms.sigma_y(B, V, self.fit_int)[..., None],
+                           s_y)
+        return s_y
+
+    def failed(self, path, error):
+        """Results dict of the pixel of the file at path whose analysis
+        raised the exception error, see __call__.
+        """
+        res = self._new_result(path)
+        res['error'] = '{}: {}'.format(type(error).__name__, error)
+        return res
+
+    def _new_result(self, path):
+        gleaned = self.gleaner.glean(basename(path))
+        return {'x': int(gleaned['x']), 'y': int(gleaned['y']), 'path': path,
+                'Hc': np.zeros(3), 'Mr': np.zeros(3), 'error': None}
+
+    @property
+    def fit_int(self):
+        return (self.ps['thresh'], self.ps['max'])
+
+    @property
+    def fingerprint(self):
+        """String that identifies everything the results depend on besides
+        the contents of the loop file: both pipelines and the extraction
+        parameters. See resultcache.
+        """
+        return '\n'.join((self.tfmr.fingerprint(), self.tfmr2.fingerprint(),
+                          'fit_int {!r}'.format(self.fit_int),
+                          'keep_loops {!r}'.format(self.keep_loops),
+                          'loader {!r}'.format(self.loader)))
+
+    def _extract(self, res, B, V, B2, V2, features=None, Hc_Mr=None,
+                 s_y=None):
+        """Extract the loop features of one pixel into its results dict.
+
+        features is this pixel's part of the output of
+        transformations.loop_features and Hc_Mr its (Hc, Mrem) triplets
+        from transformations.Hc_Mrem. They are computed here if not given,
+        with the y noise s_y if given.
+        """
+        try:
+            if features is None:
+                features = tfms.loop_features(B2, V2)
+            lsat, rsat = int(features['lsat']), int(features['rsat'])
+            res.update(lslope=float(features['lslope']),
+                       rslope=float(features['rslope']),
+                       lindex=int(features['lindex']),
+                       rindex=int(features['rindex']),
+                       lsat=lsat, rsat=rsat,
+                       lsat_field=B2[lsat], rsat_field=B2[rsat],
+                       area=float(features['area']))
+            if self.keep_loops:
+                # The pipelines' arrays are reused for the next loop.
+                res.update(loop=(np.array(B), np.array(V)),
+                           loop2=(np.array(B2), np.array(V2)))
+        except Exception as e:
+            res['error'] = '{}: {}'.format(type(e).__name__, e)
+            return res
+        try:
+            if Hc_Mr is None:
+                Hc_Mr = tfms.Hc_Mrem(B, V, fit_int=self.fit_int, s_y=s_y)
+            Hc, Mr = Hc_Mr
+            if not (np.isfinite(Hc[1]) and np.isfinite(Mr[1])):
+                raise ValueError('loop does not cross both axes')
+            res['Hc'], res['Mr'] = Hc, Mr
+        except Exception as e:
+            res['Hc'], res['Mr'] = np.zeros(3), np.zeros(3)
+            res['error'] = '{}: {}'.format(type(e).__name__, e)
+        return res
+
+
+class Chunk(object):
+    """A chunk of files read by PixelAnalyzer.read_chunk(), ready for
+    analyze_chunk().
+
+    Attributes:
+        items: the paths, or lists of paths if grouped.
+        grouped: whether the items are the scans of each pixel.
+        pixels: the results known without analysis (hits of the
+            ResultCache, pixels whose scans failed to load), None for the
+            rest.
+        todo: indices of the items to analyze.
+        keys: ResultCache keys of the items (None for the files that
+            could not be read), or None.
+        stack: LoopStack of the loops of todo, or None if they have to be
+            analyzed one by one.
+        loops: if grouped, the aggregate.AveragedLoop of each item of todo.
+        noise: if grouped, the per-point noise of the rows of stack.
+    """
+
+    def __init__(self, items, grouped=False):
+        self.items = items
+        self.grouped = grouped
+        self.pixels = [None] * len(items)
+        self.todo = []
+        self.keys = None
+        self.stack = None
+        self.loops = None
+        self.noise = None
+
+
+class ScanResult(object):
+    """Results of analyzing every pixel of a scan.
+
+    Pixels are keyed by the (x, y) values gleaned from their file names.
+    Use grid() to get any scalar or fixed size result laid out as an array
+    with shape (gy, gx, ...), indexed as [y, x] like the scan itself.
+
+    Attributes:
+        shape: (gy, gx), the number of rows and columns of the grid.
+        parameters: dict parsed from the scan's parameters.xml.
+        ps: dict of the analysis parameters, see default_ps.
+        pixels: dict of (x, y) -> per-pixel results dict.
+        profile: profiling.Profile of the run, or None if it wasn't
+            profiled.
+        io_stats: prefetch.Prefetcher.stats() of the run (time spent
+            reading vs computing), or None if it wasn't prefetched.
+    """
+
+    def __init__(self, shape, parameters=None, ps=None):
+        self.shape = tuple(shape)
+        self.parameters = parameters if parameters is not None else {}
+        self.ps = ps if ps is not None else {}
+        self.pixels = {}
+        self.profile = None
+        self.io_stats = None
+
+    def __getitem__(self, xy):
+        return self.pixels[tuple(xy)]
+
+    def __contains__(self, xy):
+        return tuple(xy) in self.pixels
+
+    def __iter__(self):
+        return iter(sorted(self.pixels))
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def add(self, pixel):
+        """Store a per-pixel results dict under its (x, y) key."""
+        self.pixels[(pixel['x'], pixel['y'])] = pixel
+
+    def errors(self):
+        """Return a dict of (x, y) -> error message for failed pixels."""
+        return dict((k, p['error']) for k, p in self.pixels.items()
+                    if p['error'] is not None)
+
+    def grid(self, key, fill=0.0):
+        """Lay a per-pixel result out on the scan grid.
+
+        Args:
+            key: name of the per-pixel result, e.g. 'Hc' or 'area'.
+            fill: value used for pixels that are missing or lack the key.
+
+        Returns:
+            np.ndarray: shape (gy, gx) + shape of the per-pixel value.
+        """
+        values = [p[key] for p in self.pixels.values()
+                  if p.get(key) is not None]
+        vshape = np.shape(values[0]) if values else ()
+        out = np.empty(self.shape + vshape)
+        out[...] = fill
+        for (x, y), p in self.pixels.items():
+            if p.get(key) is not None:
+                out[y, x] = p[key]
+        return out
+
+    @property
+    def Hcs(self):
+        """Hc uncertainty triplets, shape (gy, gx, 3)."""
+        return self.grid('Hc')
+
+    @property
+    def Mrs(self):
+        """Mrem/Msat uncertainty triplets, shape (gy, gx, 3)."""
+        return self.grid('Mr')
+
+
+def scan_files(root_path, gleaner=None):
+    """Return the paths of the averaged loop files in root_path."""
+    if gleaner is None:
+        gleaner = scan_gleaner()
+    return gleaner.index_directory(root_path).lookup(averaged=True)
+
+
+def scan_chunks(paths, chunksize=16):
+    """Split the file paths of a scan into the chunks that analyze() hands
+    to its workers (and that a RawCache stores as single entries).
+    """
+    return [paths[i:i + chunksize] for i in range(0, len(paths), chunksize)]
+
+
+def analyze(root_path, user_ps={}, workers=None, chunksize=16,
+            keep_loops=True, cache=None, loader=None, results=None, memo=None,
+            profile=False, aggregate=False, exclude=(), prefetch=2):
+    """Analyze every averaged loop file of a scan directory, or average the
+    individual scans of every pixel and analyze those.
+
+    Args:
+        root_path: the scan directory. Must contain parameters.xml.
+        user_ps: dict of parameters that override default_ps.
+        workers: number of worker processes. Defaults to the number of CPUs.
+            With workers=1 everything runs in the calling process.
+        chunksize: number of files handed to a worker at a time. Each chunk
+            is transformed as one LoopStack.
+        keep_loops: keep the transformed loops in the results (needed for
+            plotting them).
+        cache: a RawCache to read the loop files through, True to use a
+            RawCache in the default location, or None to parse the files
+            every time.
+        loader: function path -> (B, V) to read the loop files with, e.g. a
+            reader.CycleLoader. See PixelAnalyzer.
+        results: a ResultCache of per-pixel results, True to use a
+            ResultCache in the default location, or None to analyze every
+            file.
+        memo: a PrefixMemo of intermediate pipeline outputs (see
+            prefixmemo). Keep one around between calls that only change
+            late parameters. Worker processes only share its spill_dir.
+        profile: time every step of the analysis into result.profile (a
+            profiling.Profile summed over all workers).
+        aggregate: if True, ignore the averaged files and average the
+            individual scans of each pixel instead (see
+            PixelAnalyzer.batch_groups). chunksize then counts pixels.
+        exclude: with aggregate, the scans to leave out, as scan numbers or
+            (scan, x, y) tuples. See aggregate.scan_groups.
+        prefetch: when running in the calling process (workers=1), read up
+            to this many chunks ahead on a thread pool while the current one
+            is analyzed (see prefetch.Prefetcher). 0 to read each chunk
+            when it is needed. Worker processes already overlap each
+            other's reads.
+
+    Returns:
+        ScanResult
+    """
+    ps = dict(default_ps)
+    ps.update(user_ps)
+    clust = Cluster(join(root_path, 'parameters.xml')).to_dict()
+    gx, gy = (clust['Rows'], clust['Cols'])
+    result = ScanResult((gy, gx), clust, ps)
+    if cache is True:
+        cache = RawCache()
+    if results is True:
+        results = ResultCache()
+    analyzer = PixelAnalyzer(ps, keep_loops=keep_loops, cache=cache or None,
+                             loader=loader, results=results or None,
+                             memo=memo, profile=profile)
+    if aggregate:
+        index = analyzer.gleaner.index_directory(root_path)
+        items = list(scan_groups(index, exclude).values())
+        func = analyzer.batch_groups
+    else:
+        items = scan_files(root_path, analyzer.gleaner)
+        func = analyzer.batch
+    if profile:
+        func = functools.partial(analyzer.profiled_batch, grouped=aggregate)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    chunks = scan_chunks(items, chunksize)
+    workers = max(1, min(workers, len(chunks)))
+    if profile:
+        result.profile = Profile()
+    if workers == 1 and prefetch:
+        read = functools.partial(analyzer.read_chunk, grouped=aggregate)
+        prefetcher = Prefetcher(chunks, read, depth=prefetch)
+        for pixels in map(analyzer.analyze_chunk, prefetcher):
+            for pixel in pixels:
+                result.add(pixel)
+        if profile:
+            result.profile.merge(analyzer.profile)
+        result.io_stats = prefetcher.stats()
+    elif workers == 1:
+        _collect(result, map(func, chunks))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            _collect(result, pool.imap_unordered(func, chunks))
+    return result
+
+
+def _collect(result, outputs):
+    """Add the outputs of PixelAnalyzer.batch, batch_groups or
+    profiled_batch to result.
+    """
+    for out in outputs:
+        if result.profile is not None:
+            out, profile = out
+            result.profile.merge(profile)
+        for pixel in out:
+            result.add(pixel)
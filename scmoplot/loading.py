@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Readers for the raw loop files written by the scanning MOKE software."""
+import itertools
+import shutil
+import tempfile
+
+import numpy as np
+
+# Lines before the data in a loop file.
+HEADER_ROWS = 7
+
+
+def load_loop(path):
+    """Read the field and signal columns of a loop file.
+
+    The files have a 7 line header followed by whitespace delimited columns,
+    the first two of which are the applied field and the detector voltage.
+
+    Args:
+        path: path to the loop file.
+
+    Returns:
+        tuple: (B, V) as 1-D float arrays.
+    """
+    return np.loadtxt(path, usecols=(0, 1), unpack=True, skiprows=HEADER_ROWS)
+
+
+def iter_blocks(path, block_bytes=1 << 22, skiprows=HEADER_ROWS):
+    """Parse a loop file a block of about block_bytes bytes of rows at a
+    time.
+
+    Yields:
+        tuple: (B, V) 1-D arrays.
+    """
+    with open(path) as f:
+        for line in itertools.islice(f, skiprows):
+            pass
+        while True:
+            lines = f.readlines(block_bytes)
+            if not lines:
+                return
+            block = np.loadtxt(lines, usecols=(0, 1), ndmin=2)
+            if len(block):
+                yield block[:, 0], block[:, 1]
+
+
+def convert_loop(path, out, block_bytes=1 << 22):
+    """Write the (B, V) columns of a loop file as a (2, N) .npy file.
+
+    The file is parsed and written block_bytes at a time (see iter_blocks),
+    so memory use does not grow with its length.
+
+    Args:
+        path: path to the loop file.
+        out: file object opened for binary writing.
+
+    Returns:
+        int: N, the number of points.
+    """
+    n = 0
+    with tempfile.TemporaryFile() as Vs:
+        # B goes into a temporary file first, since the header with N has
+        # to come before it in the .npy file.
+        with tempfile.TemporaryFile() as Bs:
+            for B, V in iter_blocks(path, block_bytes):
+                Bs.write(np.ascontiguousarray(B, dtype=float).tobytes())
+                Vs.write(np.ascontiguousarray(V, dtype=float).tobytes())
+                n += len(B)
+            np.lib.format.write_array_header_1_0(out, {
+                'descr': np.dtype(float).str, 'fortran_order': False,
+                'shape': (2, n)})
+            Bs.seek(0)
+            shutil.copyfileobj(Bs, out)
+        Vs.seek(0)
+        shutil.copyfileobj(Vs, out)
+    return n
+
+
+def cycle_bounds(n, i, ncyc, delta=0):
+    """Start and end index of the i-th of ncyc equal cycles in n points,
+    shifted by delta points.
+    """
+    length = n // ncyc
+    return i * length + delta, (i + 1) * length + delta
+
+
+def half_index(n):
+    """Index splitting n points into the first_half and second_half."""
+    return int((n - 1) / 2)
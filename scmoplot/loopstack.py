@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Many loops held in contiguous 2-D arrays, one loop per row."""
+import numpy as np
+
+from .loading import load_loop
+
+
+class LoopStack(object):
+    """The loops of many pixels stacked into (n_pixels, n_points) arrays.
+
+    A LoopStack can be passed through a Transformer in one go with
+    Transformer.call_stack(), which runs each transformation once on the
+    whole stack instead of once per loop.
+
+    Attributes:
+        targets: list of the file paths of the loops, one per row.
+        x: (n_pixels, n_points) array of field values.
+        y: (n_pixels, n_points) array of signal values.
+    """
+
+    def __init__(self, x, y, targets):
+        x, y = np.asarray(x), np.asarray(y)
+        if x.shape != y.shape or x.ndim != 2:
+            msg = 'x and y must be 2-D arrays of equal shape, got {} and {}'
+            raise ValueError(msg.format(x.shape, y.shape))
+        if len(targets) != len(y):
+            msg = 'Got {} targets for {} loops'
+            raise ValueError(msg.format(len(targets), len(y)))
+        self.x, self.y = x, y
+        self.targets = list(targets)
+
+    @classmethod
+    def from_files(cls, paths, loader=load_loop):
+        """Load the loop files at paths into a new LoopStack.
+
+        Args:
+            paths: list of loop file paths.
+            loader: function path -> (x, y) used to read each file.
+
+        Raises:
+            ValueError: if the files do not all have the same length.
+        """
+        x = y = None
+        for i, path in enumerate(paths):
+            xi, yi = loader(path)
+            if x is None:
+                x = np.empty((len(paths), len(xi)), dtype=xi.dtype)
+                y = np.empty((len(paths), len(yi)), dtype=yi.dtype)
+            if len(xi) != x.shape[1]:
+                msg = '{} has {} points, expected {}'
+                raise ValueError(msg.format(path, len(xi), x.shape[1]))
+            x[i], y[i] = xi, yi
+        if x is None:
+            x = y = np.empty((0, 0))
+        return cls(x, y, paths)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, i):
+        """The (x, y) loop in row i."""
+        return self.x[i], self.y[i]
+
+    def transformed(self, transformer):
+        """Return a new LoopStack with the loops run through transformer."""
+        x, y = transformer.call_stack((self.x, self.y), self.targets)
+        return LoopStack(np.broadcast_to(x, np.shape(y)), y, self.targets)
@@ -1,18 +1,8 @@
 import matplotlib.pyplot as plt
-from matplotlib.colors import Normalize
-from matplotlib.gridspec import GridSpec
-from matplotlib.ticker import FixedLocator
-import numpy as np
-from os import listdir
-from os.path import join
-from lvxml2dict import Cluster
-from namegleaner import NameGleaner
-from transformer import Transformer
-import transformations as tfms
-import re
-import scipy
-from transformations import toggle
-from matplotlib.widgets import CheckButtons
+
+from .archive import save_archive
+from .engine import analyze, default_ps
+from .rendering import plot_loop_grid, plot_loops, plot_maps
 
 """ TODO
   - Need a way to detect non-magnetic areas and normalize them differently...
@@ -22,133 +12,55 @@ from matplotlib.widgets import CheckButtons
 """
 
 
-xlim, ylim = 10.0, 1.1
-thresh, max = 7, 10  # thresh: where to start fits, max: highest field
-filt_ks = 157
-
-default_ps = {
-    'xlim': 10.0,
-    'ylim': 1.1,
-    'thresh': 7,
-    'max': 10,
-    'filt_ks': 157
-}
-
-def scmoplot(root_path, user_ps):
-
-    ps = dict(default_ps)
-    ps.update(user_ps)
-
-    ng = NameGleaner(scan=r'scan=(\d+)', x=r'x=(\d+)', y=r'y=(\d+)',
-                     averaged=r'(averaged)')
-
-    tfmr = Transformer(gleaner=ng)
-    tfmr.add(10, tfms.scale, params={'xsc': 0.1})
-    tfmr.add(20, tfms.flatten_saturation, 
-              params={'threshold': ps['thresh'], 'polarity': '+'})
-    tfmr.add(25, tfms.center)
-    tfmr.add(30, tfms.wrapped_medfilt, params={'ks': ps['filt_ks']})
-    tfmr.add(40, tfms.saturation_normalize, params={'thresh': ps['thresh']})
-    
-    tfmr2 = Transformer(gleaner=ng)
-    tfmr2.add(10, tfms.scale, params={'xsc': 0.1})
-    tfmr2.add(30, tfms.wrapped_medfilt, params={'ks': ps['filt_ks']})
-    tfmr2.add(40, tfms.clean)
-
-    clust = Cluster(join(root_path, 'parameters.xml')).to_dict()
-    gx, gy = (clust['Rows'], clust['Cols'])
-
-    fig, axarr = plt.subplots(ncols=gx, nrows=gy, 
-                              figsize=(10, 10))
-
-    for row in axarr:
-        for ax in row:
-            ax.xaxis.set_ticklabels([])
-            ax.yaxis.set_ticklabels([])
-            #ax.set_xlim(-ps['xlim'], ps['xlim'])
-            #ax.set_ylim(-ps['ylim'], ps['ylim'])
-
-    Hcs = [[None for i in range(gx)] for i in range(gy)]
-    Mrs = [[None for i in range(gx)] for i in range(gy)]
-    for f in listdir(root_path):
-        gleaned = ng.glean(f)
-        if gleaned['averaged']:
-            print('Plotting %s' % f)
-            x, y = int(gleaned['x']), int(gleaned['y'])
-            ax = axarr[y, x]
-            Bi, Vi = np.loadtxt(join(root_path, f), usecols=(0, 1), unpack=True, 
-                              skiprows=7)
-                              
-                              
-            B,V = tfmr((Bi,Vi),f)             
-            B2, V2 = tfmr2((Bi, Vi), f)
-            
-                
-            ##data set 2 graphs
-            lslope,rslope,tan=tfms.x0slope(B2,V2)
-            lsat,rsat=tfms.sat_field(B2,V2)
-            area = tfms.loop_area(B2,V2)
-            data = ax.plot(B2,V2,'k')
-            tanlines = ax.plot(tan[0],tan[1],'r',tan[2],tan[3],'y*',tan[4],tan[5],'b',tan[6],tan[7], 'y*')
-            satfields = ax.plot(B2[lsat],V2[lsat],'ro',B2[rsat],V2[rsat],'go')
-            areatext = ax.text(B2.min(),V2.max(), ("loop area: "+str(area+.0005)[0:6]))
-            
-            rax = plt.axes([0.05, 0.4, 0.1, 0.15])
-            check = CheckButtons(rax, ('data', 'tangent lines',
-                'saturation points', 'loop area'), (True, True, True, True))
-            def func(label):
-                if label == 'data': toggle(data)
-                elif label == 'tangent lines': toggle(tanlines)
-                elif label == 'saturation points': toggle(satfields)
-                elif label == 'loop area': areatext.set_visible(not areatext.get_visible())
-                plt.draw()
-            check.on_clicked(func)
-            
-            try:
-                Hc = tfms.Hc_of(B, V, fit_int=(ps['thresh'], ps['max']))
-                Hcs[y][x] = Hc
-                Mr = tfms.Mrem_of(B, V, fit_int=(ps['thresh'], ps['max']))
-                Mrs[y][x] = Mr
-                zs = np.zeros(3)
-                ax.plot(zs, Mr, 'ro', ms=7)
-                ax.plot(Hc, zs, 'ro', ms=7)
-            except Exception as e:
-                print('\t{}'.format(e))
-                Hcs[y][x] = 0.0
-                Mrs[y][x] = 0.0
-                
-          
-
-    plt.tight_layout(w_pad=0, h_pad=0)
+def scmoplot(root_path, user_ps, workers=None, cache=None, results=None,
+             grid=None, archive=None):
+    """Analyze a scan directory and plot the loops and the Hc/Mrem maps.
+
+    The per-pixel analysis runs in parallel (see scmoplot.engine.analyze),
+    the plotting happens once all pixels are done.
+
+    Args:
+        root_path: the scan directory.
+        user_ps: dict of parameters that override default_ps.
+        workers: number of worker processes, defaults to the number of CPUs.
+        cache: RawCache (or True for the default one, under
+            $SCMOPLOT_CACHE_DIR or ~/.cache/scmoplot) that keeps binary
+            copies of the loop files so re-runs skip parsing them. None
+            (default) parses the files every time.
+        results: ResultCache (or True for the default one) of per-pixel
+            results, so re-runs with the same parameters skip the analysis
+            of unchanged files. None (default) analyzes every file.
+        grid: if True all loops are drawn into one Axes (see
+            rendering.plot_loop_grid), if False each loop gets its own Axes.
+            The default picks the single Axes for scans of more than 100
+            pixels.
+        archive: path to also save the result to with
+            archive.save_archive, so it can be reopened without
+            reprocessing. Or None.
+
+    Returns:
+        ScanResult
+    """
+    result = analyze(root_path, user_ps, workers=workers, cache=cache,
+                     results=results)
+    if archive is not None:
+        save_archive(result, archive)
+    for (x, y), msg in sorted(result.errors().items()):
+        print('x={} y={}\t{}'.format(x, y, msg))
+
+    if grid is None:
+        grid = result.shape[0] * result.shape[1] > 100
+    if grid:
+        fig, check = plot_loop_grid(result)
+    else:
+        fig, check = plot_loops(result)
+        plt.tight_layout(w_pad=0, h_pad=0)
     plt.show()
 
-    Hcs = np.array([x[1] for row in Hcs for x in row]).reshape(gy, gx)
-    Mrs = np.array([x[1] for row in Mrs for x in row]).reshape(gy, gx)
-
-    gs = GridSpec(10, 10)
-    ax0 = plt.subplot(gs[0:9, :5])
-    ax1 = plt.subplot(gs[9, :5])
-    ax2 = plt.subplot(gs[0:9, 5:])
-    ax3 = plt.subplot(gs[9, 5:])
-    fig = ax0.get_figure()
-    fig.set_size_inches(12, 8)
-
-# Plot Hc pcolor map
-    n = Normalize(vmin=0.0, vmax=5.0, clip=True)
-    res = ax0.pcolor(Hcs, cmap='afmhot', norm=n, edgecolors='k')
-    plt.colorbar(res, cax=ax1, orientation='horizontal', ticks=(0, 2.5, 5))
-
-# Plot Mr pcolor map
-    n = Normalize(vmin=0.0, vmax=1.0, clip=True)
-    res = ax2.pcolor(Mrs, cmap='afmhot', norm=n, edgecolors='k')
-    plt.colorbar(res, cax=ax3, orientation='horizontal', ticks=(0, 0.5, 1))
-
-    ax0.set_title('Hc (mT)')
-    ax0.set_aspect('equal', adjustable='box')
-    ax2.set_title('Mrem/Msat')
-    ax2.set_aspect('equal', adjustable='box')
+    plot_maps(result)
     plt.tight_layout()
     plt.show()
+    return result
 
 if __name__ == '__main__':
     root_path = '/home/jji/Desktop/scanning_moke_test/trial1_5x5_BFO_test_sample'
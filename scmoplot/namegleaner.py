@@ -1,5 +1,15 @@
 # -*- coding: utf-8 -*-
+import os
 import re
+import threading
+from collections import OrderedDict
+from os.path import join
+
+import numpy as np
+
+# Default NameGleaner.memo_size. Not a constructor argument, as every
+# keyword argument of NameGleaner is a category.
+MEMO_SIZE = 10000
 
 class NameGleaner(object):
     """Extracts metadata from filepaths of data files.
@@ -25,15 +35,35 @@ class NameGleaner(object):
             as 'dn', then translate('category_name', 'dn', 'down') would
             automatically make glean() return 'down' instead of 'dn' in 
             the 'category_name' value of the dict it returns.
+        memo_size: number of glean() results that are remembered, MEMO_SIZE
+            unless set after construction. The patterns are compiled once,
+            and names that have been gleaned before are looked up instead
+            of searched again. Changing the categories, translations or
+            regex_subs clears the memo.
     """
 
     def __init__(self, **kwargs):
         self.categories = {}
         self.translations = {}
         self.regex_subs = {}
+        self.memo_size = MEMO_SIZE
+        self._compiled = {}
+        self._compiled_subs = {}
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
         for k, v in kwargs.items():
             self.add_category(k, v)
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        state['_memo'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
     def add_category(self, category, pattern):
         """Add a category that the gleaner will search for in the strings that
         are to be gleaned.  
@@ -46,25 +76,40 @@ class NameGleaner(object):
             pattern: the pattern that will be searched for in the filename
         """
         self.categories[category] = pattern
+        self._compiled[category] = re.compile(pattern)
         if category not in list(self.translations.keys()):
             self.translations[category] = {}
             self.regex_subs[category] = {}
+            self._compiled_subs[category] = []
+        self.clear_memo()
 
     def remove_category(self, category):
         """Remove a category by name"""
         self.categories.pop(category, None)
+        self._compiled.pop(category, None)
+        self.clear_memo()
+
+    def clear_memo(self):
+        """Forget all remembered glean() results."""
+        with self._lock:
+            self._memo.clear()
 
     def translate(self, category=None, value=None, translation=None):
         """If `all` is set to true then the translation will be added
         for all existing categories (but not categories added later!).
         """
         self.translations[category][value] = translation
+        self.clear_memo()
 
     def regex_sub(self, category, pattern, repl, count=0, flags=0):
         """Regular expression substitutions to be run on the gleaned
         metadata. This just wraps re.sub().
         """
         self.regex_subs[category][pattern] = (repl, count, flags)
+        self._compiled_subs[category] = [
+            (re.compile(pat, flags), repl, count)
+            for pat, (repl, count, flags) in self.regex_subs[category].items()]
+        self.clear_memo()
 
     def glean(self, name, fill_obj=None):
         """Extract metadata fromt the filenames.
@@ -80,18 +125,53 @@ class NameGleaner(object):
             dict: keys are the names of each category, values are the extracted
                 values or in the case of no match, `fill_obj`.
         """
-        result = {}
-        for category, pat in list(self.categories.items()):
-            match = re.search(pat, name)
-            if match:
-                gleaned = self._maybe_delistify(match.groups())
-                result[category] = self._translated(category, gleaned)
-                if result[category] == None:
-                    result[category] = fill_obj
-                    continue
-            else:
-                result[category] = fill_obj
-        return result
+        with self._lock:
+            result = self._memo.get(name)
+            if result is not None:
+                self._memo.move_to_end(name)
+        if result is None:
+            result = {}
+            for category, pat in self._compiled.items():
+                match = pat.search(name)
+                if match:
+                    gleaned = self._maybe_delistify(match.groups())
+                    result[category] = self._translated(category, gleaned)
+                else:
+                    result[category] = None
+            with self._lock:
+                self._memo[name] = result
+                if len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+        return dict((k, fill_obj if v is None else v)
+                    for k, v in result.items())
+
+    def glean_many(self, names):
+        """Glean a list of names at once.
+
+        Args:
+            names: the filenames (or paths) to be gleaned.
+
+        Returns:
+            GleanIndex: one row per name, one column per category.
+        """
+        names = list(names)
+        columns = dict((c, []) for c in self.categories)
+        for name in names:
+            for c, v in self.glean(name).items():
+                columns[c].append(v)
+        return GleanIndex(names, names, columns)
+
+    def index_directory(self, root_path):
+        """Glean every file name in a directory listing.
+
+        Returns:
+            GleanIndex: one row per file, with the full paths in its paths
+                attribute.
+        """
+        names = sorted(os.listdir(root_path))
+        index = self.glean_many(names)
+        index.paths = [join(root_path, n) for n in names]
+        return index
 
     def gleanable(self, name):
         """Check if name matches at least one category.
@@ -102,9 +182,14 @@ class NameGleaner(object):
         Returns:
             bool: whether at least one category found a match.
         """
-        result = self.glean(name)
-        for k, v in list(result.items()):
-            if v != None:
+        with self._lock:
+            result = self._memo.get(name)
+        if result is not None:
+            return any(v is not None for v in result.values())
+        for category, pat in self._compiled.items():
+            match = pat.search(name)
+            if match and self._translated(
+                    category, self._maybe_delistify(match.groups())) is not None:
                 return True
         return False
 
@@ -123,11 +208,10 @@ class NameGleaner(object):
             translated = self.translations[category].get(gleaned, gleaned)
         except:
             translated = gleaned
-        try:
-            for pat, (repl, count, flags) in self.regex_subs[category].items():
-                translated = re.sub(pat, repl, translated, count, flags)
-        except KeyError:
-            pass
+        if translated is None:
+            return None
+        for pat, repl, count in self._compiled_subs.get(category, ()):
+            translated = pat.sub(repl, translated, count)
         return translated
 
     def _maybe_delistify(self, x):
@@ -138,3 +222,65 @@ class NameGleaner(object):
             return None
         else:
             return x[0]
+
+
+class GleanIndex(object):
+    """Columnar table of gleaned metadata, one row per name.
+
+    Attributes:
+        names: the gleaned names.
+        paths: the path of each row (the names themselves unless the index
+            was built by NameGleaner.index_directory()).
+        columns: dict of category -> list of gleaned values (None where the
+            category was not found).
+    """
+
+    def __init__(self, names, paths, columns):
+        self.names = list(names)
+        self.paths = list(paths)
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, category):
+        return self.columns[category]
+
+    def rows(self):
+        """Iterate over the rows as dicts with a 'path' key and a key for
+        each category.
+        """
+        for i, path in enumerate(self.paths):
+            row = dict((c, v[i]) for c, v in self.columns.items())
+            row['path'] = path
+            yield row
+
+    def where(self, **conditions):
+        """Return the rows where every category equals the given value.
+        Pass True to select the rows where a category was found at all, e.g.
+        index.where(averaged=True, x='3').
+        """
+        keep = []
+        for i in range(len(self)):
+            for c, v in conditions.items():
+                val = self.columns[c][i]
+                if (val is None) if v is True else (val != v):
+                    break
+            else:
+                keep.append(i)
+        return self._take(keep)
+
+    def lookup(self, **conditions):
+        """Return the paths of the rows that match conditions, see where()."""
+        return self.where(**conditions).paths
+
+    def as_int(self, category, fill=-1):
+        """Return a column converted to an array of ints."""
+        return np.array([fill if v is None else int(v)
+                         for v in self.columns[category]], dtype=int)
+
+    def _take(self, idx):
+        return GleanIndex([self.names[i] for i in idx],
+                          [self.paths[i] for i in idx],
+                          dict((c, [v[i] for i in idx])
+                               for c, v in self.columns.items()))
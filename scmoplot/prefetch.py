@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Read upcoming chunks of files while the current one is analyzed.
+
+In a single process the analysis of a scan alternates between reading a
+chunk of loop files and transforming it, and the CPU idles during every
+read. That is most of the run time when the scan is on a network share or
+a USB drive. A Prefetcher reads the next chunks on a small thread pool while
+the caller computes: reading (file system calls, parsing text, decompressing)
+mostly releases the GIL, so the two overlap.
+
+At most depth chunks are read ahead of the one being used, so memory stays
+bounded however long the scan is: a new read is only started when the
+caller takes a chunk.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher(object):
+    """Iterate over read(item) for each item, in order, reading ahead on a
+    thread pool.
+
+    Args:
+        items: the items (e.g. chunks of paths) to read.
+        read: function item -> value. Exceptions it raises are raised by the
+            iteration when the value is reached.
+        depth: number of items read ahead of the one being used.
+        threads: number of reader threads, at most depth. Defaults to depth.
+
+    Attributes:
+        read_seconds: total time spent in read, summed over the threads.
+        wait_seconds: time the iteration blocked waiting for a read.
+        compute_seconds: time the caller spent between taking a value and
+            asking for the next one.
+    """
+
+    def __init__(self, items, read, depth=2, threads=None):
+        if depth < 1:
+            raise ValueError('depth must be at least 1, got {}'.format(depth))
+        self.items = items
+        self.read = read
+        self.depth = depth
+        self.threads = min(threads or depth, depth)
+        self.count = 0
+        self.read_seconds = self.wait_seconds = self.compute_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        items = iter(self.items)
+        pending = deque()
+        with ThreadPoolExecutor(self.threads) as pool:
+            try:
+                self._fill(pool, pending, items)
+                while pending:
+                    start = time.perf_counter()
+                    value = pending.popleft().result()
+                    self.wait_seconds += time.perf_counter() - start
+                    # Only read on once a value has been taken: this is the
+                    # backpressure that bounds memory to depth + 1 items.
+                    self._fill(pool, pending, items)
+                    start = time.perf_counter()
+                    yield value
+                    self.compute_seconds += time.perf_counter() - start
+                    self.count += 1
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _fill(self, pool, pending, items):
+        while len(pending) < self.depth:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            pending.append(pool.submit(self._timed_read, item))
+
+    def _timed_read(self, item):
+        start = time.perf_counter()
+        try:
+            return self.read(item)
+        finally:
+            with self._lock:
+                self.read_seconds += time.perf_counter() - start
+
+    def stats(self):
+        """Return an OrderedDict of the counters: items, read_seconds,
+        wait_seconds, compute_seconds and overlap, the fraction of the read
+        time that was hidden behind computation.
+        """
+        overlap = 0.0
+        if self.read_seconds > 0:
+            overlap = max(0.0, 1.0 - self.wait_seconds / self.read_seconds)
+        return OrderedDict((('items', self.count),
+                            ('read_seconds', self.read_seconds),
+                            ('wait_seconds', self.wait_seconds),
+                            ('compute_seconds', self.compute_seconds),
+                            ('overlap', overlap)))
+
+
+def format_stats(stats):
+    """One line summary of Prefetcher.stats()."""
+    return ('I/O {read_seconds:.3f} s ({wait_seconds:.3f} s not overlapped, '
+            '{pct:.0f}% hidden), compute {compute_seconds:.3f} s, '
+            '{items} chunks'.format(pct=100 * stats['overlap'], **stats))
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Memo of the intermediate outputs of Transformer pipelines.
+
+Tweaking a late stage of a pipeline (the thresh of saturation_normalize,
+say) leaves the output of every stage before it unchanged. A Transformer
+with a PrefixMemo stores the output of each stage under a key made of the
+digest of its input data (or of a key the caller gives for it, such as the
+identity of the file it was read from), its target(s) and the fingerprints
+of that stage and every stage before it. A later call only runs the stages
+after the longest prefix found in the memo.
+
+Entries are stored and handed out as read-only views rather than copies,
+so a hit costs no more than a dict lookup. Whoever wants to change them
+copies them first, as Transformer does in its in-place mode.
+
+The entries are kept in memory up to max_bytes, least recently used first
+out. With a spill_dir they are also written there (up to spill_max_bytes),
+so they outlive the process, are shared by worker processes and survive
+eviction from memory.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from os.path import exists, join
+
+import numpy as np
+
+from .rawcache import evict_entries, list_entries, write_atomic
+
+
+def data_digest(datacols, targets=()):
+    """sha1 of the shapes, dtypes and bytes of the arrays in datacols and
+    of the targets, as a hashlib object that prefix keys are chained from.
+    """
+    h = hashlib.sha1()
+    for c in datacols:
+        c = np.ascontiguousarray(c)
+        h.update('{}{}'.format(c.dtype.str, c.shape).encode('utf-8'))
+        h.update(c.data)
+    return _add_targets(h, targets)
+
+
+def key_digest(key, targets=()):
+    """Like data_digest, for data identified by key (a string) instead of
+    its bytes. Data given the same key must be the same.
+    """
+    h = hashlib.sha1(b'key\0')
+    h.update(key.encode('utf-8'))
+    h.update(b'\0')
+    return _add_targets(h, targets)
+
+
+def _add_targets(h, targets):
+    for t in targets:
+        h.update(str(t).encode('utf-8'))
+        h.update(b'\0')
+    return h
+
+
+def readonly(a):
+    """A read-only view of a."""
+    a = np.asarray(a).view()
+    a.setflags(write=False)
+    return a
+
+
+class PrefixMemo(object):
+    """LRU memo of pipeline stage outputs, bounded in bytes.
+
+    A PrefixMemo can be shared by several Transformers: the keys include the
+    fingerprints of the stages, so pipelines only share the entries of the
+    stages they have in common. Pickling a PrefixMemo (e.g. to send it to a
+    worker process) drops its in-memory entries; the spill_dir is kept.
+
+    Args:
+        max_bytes: limit on the total size of the entries kept in memory.
+        spill_dir: directory to also write the entries to, or None.
+        spill_max_bytes: limit on the total size of the entries in
+            spill_dir.
+    """
+
+    def __init__(self, max_bytes=256 * 1024**2, spill_dir=None,
+                 spill_max_bytes=2 * 1024**3):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._spilled = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        state['_entries'], state['_bytes'] = OrderedDict(), 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def nbytes(self):
+        """Total size of the entries kept in memory."""
+        return self._bytes
+
+    def get(self, key):
+        """Return the datacols stored under key, as read-only arrays, or
+        None.
+        """
+        with self._lock:
+            cols = self._entries.get(key)
+            if cols is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cols
+        # Read from spill_dir without holding the lock.
+        if self.spill_dir is not None:
+            cols = self._load(key)
+            if cols is not None:
+                self._keep(key, cols)
+        with self._lock:
+            if cols is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cols
+
+    def put(self, key, datacols):
+        """Store datacols (a tuple of arrays) under key, as read-only views.
+        The caller must not change the arrays afterwards.
+
+        Returns:
+            tuple: the stored read-only views.
+        """
+        cols = tuple(readonly(c) for c in datacols)
+        self._keep(key, cols)
+        if self.spill_dir is not None:
+            self._spill(key, cols)
+        return cols
+
+    def clear(self):
+        """Delete every entry, in memory and in spill_dir."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.spill_dir is not None:
+            for path, size, atime in list_entries(self.spill_dir, '.npz'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._spilled = None
+
+    def _keep(self, key, cols):
+        size = sum(c.nbytes for c in cols)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= sum(c.nbytes for c in old)
+            self._entries[key] = cols
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= sum(c.nbytes for c in old)
+
+    def _path(self, key):
+        return join(self.spill_dir, key + '.npz')
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as npz:
+                cols = tuple(readonly(npz['arr_{}'.format(i)])
+                             for i in range(len(npz.files)))
+            # The mtime of an entry is its last use, for LRU eviction.
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return cols
+
+    def _spill(self, key, cols):
+        if not exists(self.spill_dir):
+            os.makedirs(self.spill_dir, exist_ok=True)
+        path = self._path(key)
+        write_atomic(path, lambda f: np.savez(f, *cols))
+        # Like ResultCache, keep a running estimate of the size of spill_dir
+        # so it is only listed when it may have to be trimmed.
+        if self._spilled is None:
+            self._spilled = sum(e[1] for e in list_entries(self.spill_dir,
+                                                           '.npz'))
+        else:
+            self._spilled += os.path.getsize(path)
+        if self._spilled > self.spill_max_bytes:
+            self._spilled = evict_entries(
+                list_entries(self.spill_dir, '.npz'), self.spill_max_bytes)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Opt-in timing and counters for the steps of an analysis.
+
+A Profile aggregates, per named step, the number of calls, the number of
+loops (rows) processed, the wall time, the bytes of the input and output
+arrays and how many of the output arrays were newly allocated rather than
+views of (or the same memory as) an input. Transformers record each of
+their stages into a Profile once profiling is enabled on them, see
+Transformer.enable_profiling().
+
+Profiles are plain data and can be pickled, so the profiles of worker
+processes can be sent back and merged.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+FIELDS = ('calls', 'rows', 'seconds', 'in_bytes', 'out_bytes', 'allocs',
+          'alloc_bytes')
+
+
+class Profile(object):
+    """Counters of the steps of a run, aggregated by step name.
+
+    Attributes:
+        steps: OrderedDict of step name -> dict of counters (see FIELDS),
+            in the order the steps were first recorded.
+    """
+
+    def __init__(self):
+        self.steps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.steps)
+
+    def call(self, step, func, args, kwargs, rows=1):
+        """Call func(*args, **kwargs), record it under step and return its
+        output.
+        """
+        start = time.perf_counter()
+        out = func(*args, **kwargs)
+        self.add(step, time.perf_counter() - start, args, out, rows)
+        return out
+
+    def add(self, step, seconds, inputs=(), outputs=(), rows=1):
+        """Record one call of step.
+
+        Args:
+            step: name of the step.
+            seconds: wall time of the call.
+            inputs: the arrays the step was given.
+            outputs: the arrays it returned. The ones that don't share
+                memory with any input count as allocations.
+            rows: number of loops processed.
+        """
+        ins = _arrays(inputs)
+        outs = _arrays(outputs)
+        new = [o for o in outs
+               if not any(np.may_share_memory(o, i) for i in ins)]
+        with self._lock:
+            counts = self.steps.get(step)
+            if counts is None:
+                counts = self.steps[step] = dict.fromkeys(FIELDS, 0)
+            counts['calls'] += 1
+            counts['rows'] += rows
+            counts['seconds'] += seconds
+            counts['in_bytes'] += sum(a.nbytes for a in ins)
+            counts['out_bytes'] += sum(a.nbytes for a in outs)
+            counts['allocs'] += len(new)
+            counts['alloc_bytes'] += sum(a.nbytes for a in new)
+
+    def merge(self, other):
+        """Add the counters of another Profile to this one."""
+        with self._lock:
+            for step, other_counts in other.steps.items():
+                counts = self.steps.get(step)
+                if counts is None:
+                    counts = self.steps[step] = dict.fromkeys(FIELDS, 0)
+                for k in FIELDS:
+                    counts[k] += other_counts[k]
+        return self
+
+    def clear(self):
+        with self._lock:
+            self.steps.clear()
+
+    def records(self):
+        """Return a list of dicts, one per step, with the step name, its
+        counters and its share of the total time.
+        """
+        total = sum(c['seconds'] for c in self.steps.values())
+        out = []
+        for step, counts in self.steps.items():
+            rec = OrderedDict(step=step)
+            rec.update((k, counts[k]) for k in FIELDS)
+            rec['percent'] = 100.0 * counts['seconds'] / total if total else 0.0
+            out.append(rec)
+        return out
+
+    def to_json(self, path=None):
+        """Return the records as a JSON string, and write it to path if
+        given.
+        """
+        s = json.dumps(self.records(), indent=1)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(s)
+        return s
+
+    def table(self):
+        """Return the records as a text table, slowest step first."""
+        head = '{:<40} {:>7} {:>8} {:>9} {:>6} {:>9} {:>9} {:>7}'
+        row = '{:<40} {:>7d} {:>8d} {:>9.3f} {:>6.1f} {:>9.1f} {:>9.1f} {:>7d}'
+        lines = [head.format('step', 'calls', 'loops', 'seconds', '%',
+                             'in MB', 'out MB', 'allocs')]
+        for r in sorted(self.records(), key=lambda r: -r['seconds']):
+            lines.append(row.format(r['step'][:40], r['calls'], r['rows'],
+                                    r['seconds'], r['percent'],
+                                    r['in_bytes'] / 1024.**2,
+                                    r['out_bytes'] / 1024.**2, r['allocs']))
+        return '\n'.join(lines)
+
+
+def _arrays(values):
+    """The ndarrays in values, which may be an array, a sequence or a dict
+    of them.
+    """
+    if isinstance(values, np.ndarray):
+        return [values]
+    if isinstance(values, dict):
+        values = values.values()
+    try:
+        return [v for v in values if isinstance(v, np.ndarray)]
+    except TypeError:
+        return []
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""On-disk binary cache of parsed loop files.
+
+Parsing the text loop files with np.loadtxt is the slowest part of loading
+a scan. The first time a file is read through a RawCache it is saved as a
+.npy file, later reads memory-map that instead. Entries are keyed by the
+absolute path, size and modification time of the raw file, so editing or
+replacing a raw file invalidates its entry.
+"""
+import hashlib
+import os
+import tempfile
+from os.path import abspath, exists, expanduser, join
+
+import numpy as np
+
+from .loading import convert_loop, load_loop
+
+
+def default_cache_dir():
+    """$SCMOPLOT_CACHE_DIR if set, otherwise ~/.cache/scmoplot"""
+    return os.environ.get('SCMOPLOT_CACHE_DIR',
+                          join(expanduser('~'), '.cache', 'scmoplot'))
+
+
+def file_key(path):
+    """Identify a raw file by its absolute path, size and mtime."""
+    st = os.stat(path)
+    return '{}\0{}\0{}'.format(abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def list_entries(cache_dir, suffix):
+    """List the files in cache_dir ending in suffix as (path, size in bytes,
+    mtime) tuples, oldest first.
+    """
+    if not exists(cache_dir):
+        return []
+    res = []
+    for f in os.listdir(cache_dir):
+        if not f.endswith(suffix):
+            continue
+        path = join(cache_dir, f)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        res.append((path, st.st_size, st.st_mtime))
+    return sorted(res, key=lambda e: e[2])
+
+
+def evict_entries(entries, max_bytes):
+    """Delete the oldest of entries (as returned by list_entries) until
+    the rest fit in max_bytes.
+
+    Returns:
+        int: the total size of the entries left.
+    """
+    total = sum(e[1] for e in entries)
+    for path, size, atime in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+    return total
+
+
+def write_atomic(path, write):
+    """Call write(f) on a temporary file next to path, then move it to path,
+    so that other processes never see a half written file.
+    """
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+class RawCache(object):
+    """Binary cache of raw loop files.
+
+    Each entry is a .npy file holding the (2, n_points) array of a single
+    file; load_scan() stacks the entries of a group of files, so any subset
+    or regrouping of the files of a scan shares their entries. Entries are
+    memory-mapped copy-on-write, so the returned arrays can be modified
+    without touching the cache.
+
+    When the total size of the cache exceeds max_bytes the least recently
+    used entries are deleted, except for the one just added, which is kept
+    even if it alone is bigger than max_bytes (a very long loop file).
+
+    Args:
+        cache_dir: directory that holds the entries. Defaults to
+            default_cache_dir()/raw.
+        max_bytes: limit on the total size of the entries.
+        loader: function path -> (x, y) used to parse raw files.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=2 * 1024**3,
+                 loader=load_loop):
+        if cache_dir is None:
+            cache_dir = join(default_cache_dir(), 'raw')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.loader = loader
+        # Running estimate of size(), so that adding an entry only lists the
+        # cache directory when it may have to evict.
+        self._size = None
+
+    def load(self, path):
+        """Load one raw file through the cache.
+
+        Returns:
+            tuple: (x, y) 1-D arrays.
+        """
+        arr = self._get(self._entry(path),
+                        lambda: np.array(self.loader(path)))
+        return arr[0], arr[1]
+
+    def open(self, path):
+        """Memory-map the entry of one raw file, creating it if needed.
+
+        Unlike load(), a missing entry is made by converting the raw file a
+        block of rows at a time (see loading.convert_loop, the loader is not
+        used), so the file never has to fit in memory. The entry is the same
+        one load() uses.
+
+        Returns:
+            np.memmap: (2, n_points) copy-on-write array of B and V.
+        """
+        entry = self._entry(path)
+        arr = self._hit(entry)
+        if arr is None:
+            if not exists(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            write_atomic(entry, lambda f: convert_loop(path, f))
+            # Mapped before anything is evicted. The entry itself is kept
+            # even if it alone is bigger than max_bytes.
+            arr = np.load(entry, mmap_mode='c')
+            self._added(entry)
+        return arr
+
+    def load_scan(self, paths):
+        """Load a group of raw files, e.g. a chunk of a scan, through the
+        cache, stacked into one in-memory array.
+
+        Returns:
+            tuple: (x, y), each an (n_files, n_points) array.
+
+        Raises:
+            ValueError: if the files do not all have the same length.
+        """
+        arrs = [self._get(self._entry(p),
+                          lambda p=p: np.array(self.loader(p)))
+                for p in paths]
+        if len(set(a.shape for a in arrs)) > 1:
+            raise ValueError('Cannot stack loop files of unequal length')
+        arr = np.stack(arrs, axis=1)
+        return arr[0], arr[1]
+
+    def invalidate(self, paths):
+        """Remove the entry of a file (a path), or the entries of a group of
+        files (a list of paths), if there are any.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        for path in paths:
+            entry = self._entry(path)
+            try:
+                size = os.path.getsize(entry)
+                os.remove(entry)
+            except OSError:
+                continue
+            if self._size is not None:
+                self._size -= size
+
+    def rebuild(self, paths):
+        """Re-parse a file or group of files and replace their entries."""
+        self.invalidate(paths)
+        if isinstance(paths, str):
+            return self.load(paths)
+        return self.load_scan(paths)
+
+    def clear(self):
+        """Delete every entry."""
+        for path, size, atime in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = None
+
+    def entries(self):
+        """List the entries as (path, size in bytes, last use time) tuples,
+        least recently used first.
+        """
+        return list_entries(self.cache_dir, '.npy')
+
+    def size(self):
+        """Total size of the entries in bytes."""
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the cache fits in
+        max_bytes, except for the entry keep (a path) if given.
+        """
+        entries = self.entries()
+        kept = sum(e[1] for e in entries if e[0] == keep)
+        self._size = kept + evict_entries(
+            [e for e in entries if e[0] != keep], self.max_bytes - kept)
+
+    def _added(self, entry):
+        """Count the new entry in the running size, and evict (keeping the
+        entry) if the cache may have grown past max_bytes.
+        """
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += os.path.getsize(entry)
+        if self._size > self.max_bytes:
+            self.evict(keep=entry)
+
+    def _entry(self, path):
+        h = hashlib.sha1(file_key(path).encode('utf-8'))
+        return join(self.cache_dir, h.hexdigest() + '.npy')
+
+    def _hit(self, entry):
+        """Memory-map entry, or return None if it doesn't exist."""
+        try:
+            arr = np.load(entry, mmap_mode='c')
+            # The mtime of an entry is its last use, for LRU eviction.
+            os.utime(entry, None)
+            return arr
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _get(self, entry, build):
+        arr = self._hit(entry)
+        if arr is not None:
+            return arr
+        arr = np.ascontiguousarray(build(), dtype=float)
+        if not exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomic(entry, lambda f: np.save(f, arr))
+        self._added(entry)
+        return arr
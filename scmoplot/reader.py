@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Lazy access to parts of long loop files.
+
+Long averaging and multi-cycle acquisitions write loop files of millions of
+points. Parsing one of those with load_loop only to keep a cycle of it with
+transformations.ith_cycle costs memory and time proportional to the whole
+file. A LoopReader converts the file to a binary RawCache entry once, a
+block at a time, and then serves cycles and ranges as slices of a memory
+map, so only the selected points are ever read.
+"""
+import numpy as np
+
+from .loading import cycle_bounds, half_index
+from .rawcache import RawCache
+
+
+class LoopReader(object):
+    """Cycles and ranges of one loop file, read on demand.
+
+    The returned arrays are copy-on-write views of the memory-mapped cache
+    entry: they can be modified without touching the cache, and only the
+    pages that are used are read from disk.
+
+    Args:
+        path: path to the loop file.
+        cache: RawCache that holds the binary copy. Defaults to RawCache().
+    """
+
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.cache = cache if cache is not None else RawCache()
+        self._data = self.cache.open(path)
+
+    def __len__(self):
+        return self._data.shape[1]
+
+    def range(self, start=None, stop=None, step=None):
+        """Return (B, V) of the points start:stop:step."""
+        sl = slice(start, stop, step)
+        return self._data[0, sl], self._data[1, sl]
+
+    def cycle(self, i, ncyc, delta=0):
+        """Return (B, V) of the i-th of ncyc cycles, shifted by delta points.
+        Same selection as transformations.ith_cycle.
+        """
+        return self.range(*cycle_bounds(len(self), i, ncyc, delta))
+
+    def first_half(self):
+        """Same selection as transformations.first_half."""
+        return self.range(None, half_index(len(self)))
+
+    def second_half(self):
+        """Same selection as transformations.second_half."""
+        return self.range(half_index(len(self)), None)
+
+    def middle(self, nseg=100):
+        """Same selection as transformations.middle."""
+        n = len(self)
+        return self.range(half_index(n) - nseg, n - 1 - nseg)
+
+
+class CycleLoader(object):
+    """Loader (path -> (B, V)) that reads a single cycle of each file.
+
+    Pass it as the loader of PixelAnalyzer or analyze() to analyze one
+    cycle of multi-cycle files without loading the rest of them.
+
+    Args:
+        i: index of the cycle.
+        ncyc: number of cycles in each file.
+        delta: shift of the cycle in points.
+        cache: RawCache that holds the binary copies of the files.
+    """
+
+    def __init__(self, i, ncyc, delta=0, cache=None):
+        self.i = i
+        self.ncyc = ncyc
+        self.delta = delta
+        self.cache = cache
+
+    def __repr__(self):
+        return 'CycleLoader(i={!r}, ncyc={!r}, delta={!r})'.format(
+            self.i, self.ncyc, self.delta)
+
+    def __call__(self, path):
+        B, V = LoopReader(path, self.cache).cycle(self.i, self.ncyc,
+                                                  self.delta)
+        return np.array(B), np.array(V)
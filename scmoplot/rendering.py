@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""Matplotlib rendering of ScanResults produced by scmoplot.engine."""
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import Normalize
+from matplotlib.gridspec import GridSpec
+from matplotlib.widgets import CheckButtons
+import numpy as np
+
+from .transformations import tangent_lines, toggle
+
+
+def plot_loops(result):
+    """Plot every pixel's loop in its own Axes, arranged like the scan.
+
+    One set of check buttons toggles the data, tangent lines, saturation
+    points and loop area text of all pixels at once.
+
+    Args:
+        result: ScanResult from scmoplot.engine.analyze(..., keep_loops=True)
+
+    Returns:
+        tuple: (fig, check) the figure and the CheckButtons widget. Keep a
+            reference to check or the buttons will stop responding.
+    """
+    gy, gx = result.shape
+    fig, axarr = plt.subplots(ncols=gx, nrows=gy, figsize=(10, 10),
+                              squeeze=False)
+
+    for row in axarr:
+        for ax in row:
+            ax.xaxis.set_ticklabels([])
+            ax.yaxis.set_ticklabels([])
+
+    layers = {'data': [], 'tangent lines': [], 'saturation points': [],
+              'loop area': []}
+    for x, y in result:
+        pixel = result[x, y]
+        if 'loop2' not in pixel:
+            continue
+        ax = axarr[y, x]
+        B2, V2 = pixel['loop2']
+        tan = pixel_tangent_lines(pixel)
+        lsat, rsat = pixel['lsat'], pixel['rsat']
+        layers['data'] += ax.plot(B2, V2, 'k')
+        layers['tangent lines'] += ax.plot(tan[0], tan[1], 'r',
+                                           tan[2], tan[3], 'y*',
+                                           tan[4], tan[5], 'b',
+                                           tan[6], tan[7], 'y*')
+        layers['saturation points'] += ax.plot(B2[lsat], V2[lsat], 'ro',
+                                               B2[rsat], V2[rsat], 'go')
+        layers['loop area'].append(ax.text(
+            B2.min(), V2.max(),
+            ("loop area: " + str(pixel['area'] + .0005)[0:6])))
+        if pixel['error'] is None:
+            zs = np.zeros(3)
+            ax.plot(zs, pixel['Mr'], 'ro', ms=7)
+            ax.plot(pixel['Hc'], zs, 'ro', ms=7)
+
+    rax = fig.add_axes([0.05, 0.4, 0.1, 0.15])
+    labels = ('data', 'tangent lines', 'saturation points', 'loop area')
+    check = CheckButtons(rax, labels, (True,) * len(labels))
+
+    def func(label):
+        toggle(layers[label])
+        fig.canvas.draw_idle()
+    check.on_clicked(func)
+    return fig, check
+
+
+def plot_loop_grid(result, max_points=400, pad=0.1):
+    """Plot every pixel's loop into a single Axes, arranged like the scan.
+
+    Unlike plot_loops this does not make an Axes per pixel. Each layer is a
+    single artist for the whole grid (a LineCollection of all loops, one of
+    all tangent lines, ...), offset so every loop sits in its own cell, so
+    building and redrawing the figure stays cheap for large rasters. Each
+    loop is scaled to fill its cell.
+
+    The layers are toggled with one set of check buttons:
+        data: the loops.
+        tangent lines: tangent lines at the x intercepts, cut off at the
+            edges of their cells.
+        saturation points: the left (red) and right (green) saturation
+            points.
+        loop area: cell backgrounds shaded by loop area.
+    As in plot_loops the Hc and Mrem of every pixel without errors are
+    marked (red dots, one scatter for the grid), where they fall inside
+    the cell.
+
+    Args:
+        result: ScanResult from scmoplot.engine.analyze(..., keep_loops=True)
+        max_points: loops are decimated to at most this many points for
+            drawing.
+        pad: fraction of each cell left empty around its loop.
+
+    Returns:
+        tuple: (fig, check) the figure and the CheckButtons widget. Keep a
+            reference to check or the buttons will stop responding.
+    """
+    gy, gx = result.shape
+    loops, tans, tan_colors, marks, lsats, rsats, cells, areas, hcmr = (
+        [], [], [], [], [], [], [], [], [])
+    for x, y in result:
+        pixel = result[x, y]
+        if 'loop2' not in pixel:
+            continue
+        B2, V2 = (np.asarray(u) for u in pixel['loop2'])
+        # Map this loop's bounding box onto its cell. Row 0 is at the top,
+        # like the subplots of plot_loops.
+        x0, y0 = x + pad / 2, gy - 1 - y + pad / 2
+        xsc = (1 - pad) / max(np.ptp(B2), np.finfo(float).tiny)
+        ysc = (1 - pad) / max(np.ptp(V2), np.finfo(float).tiny)
+
+        def to_cell(u, v, Bmin=B2.min(), Vmin=V2.min(), x0=x0, y0=y0,
+                    xsc=xsc, ysc=ysc):
+            return (np.asarray(u) - Bmin) * xsc + x0, \
+                (np.asarray(v) - Vmin) * ysc + y0
+        step = max(1, len(B2) // max_points)
+        loops.append(np.column_stack(to_cell(B2[::step], V2[::step])))
+        box = (x, gy - 1 - y, x + 1, gy - y)
+        tan = pixel_tangent_lines(pixel)
+        for u, v, color in ((tan[0], tan[1], 'r'), (tan[4], tan[5], 'b')):
+            # Tangent lines are straight, so their ends are enough.
+            seg = _clip_segment(*to_cell(u[[0, -1]], v[[0, -1]]), box=box)
+            if seg is not None:
+                tans.append(seg)
+                tan_colors.append(color)
+        marks += [to_cell(tan[2], tan[3]), to_cell(tan[6], tan[7])]
+        if pixel['error'] is None:
+            zs = np.zeros(3)
+            u, v = to_cell(np.concatenate((zs, pixel['Hc'])),
+                           np.concatenate((pixel['Mr'], zs)))
+            inside = ((u >= box[0]) & (u <= box[2]) &
+                      (v >= box[1]) & (v <= box[3]))
+            hcmr.append((u[inside], v[inside]))
+        lsats.append(to_cell(B2[pixel['lsat']], V2[pixel['lsat']]))
+        rsats.append(to_cell(B2[pixel['rsat']], V2[pixel['rsat']]))
+        cells.append([(x, gy - 1 - y), (x + 1, gy - 1 - y),
+                      (x + 1, gy - y), (x, gy - y)])
+        areas.append(pixel['area'])
+
+    fig, ax = plt.subplots(figsize=(10, 10))
+    area_layer = PolyCollection(cells, array=np.array(areas), cmap='Blues',
+                                alpha=0.4, edgecolors='0.8', zorder=0)
+    ax.add_collection(area_layer)
+    data = LineCollection(loops, colors='k', linewidths=0.5)
+    ax.add_collection(data)
+    tanlines = LineCollection(tans, colors=tan_colors, linewidths=0.5)
+    ax.add_collection(tanlines)
+    ax.scatter(*_points(hcmr), s=49, c='r', zorder=3)
+    layers = {'data': [data],
+              'tangent lines': [tanlines] + ax.plot(
+                  *_points(marks), ls='none', marker='*', color='y'),
+              'saturation points': ax.plot(
+                  *_points(lsats), ls='none', marker='o', color='r') +
+              ax.plot(*_points(rsats), ls='none', marker='o', color='g'),
+              'loop area': [area_layer]}
+    ax.set_xlim(0, gx)
+    ax.set_ylim(0, gy)
+    ax.set_aspect('equal', adjustable='box')
+    ax.xaxis.set_ticklabels([])
+    ax.yaxis.set_ticklabels([])
+
+    rax = fig.add_axes([0.01, 0.4, 0.12, 0.15])
+    labels = ('data', 'tangent lines', 'saturation points', 'loop area')
+    check = CheckButtons(rax, labels, (True,) * len(labels))
+
+    def func(label):
+        toggle(layers[label])
+        fig.canvas.draw_idle()
+    check.on_clicked(func)
+    return fig, check
+
+
+def pixel_tangent_lines(pixel):
+    """Tangent lines at the x intercepts of a pixel's loop2, built from the
+    crossings stored in its results (see transformations.tangent_lines).
+    """
+    B2, V2 = pixel['loop2']
+    return tangent_lines(B2, V2, pixel['lindex'], pixel['rindex'],
+                         pixel['lslope'], pixel['rslope'])
+
+
+def _clip_segment(u, v, box):
+    """The part of the segment from (u[0], v[0]) to (u[1], v[1]) inside box
+    (umin, vmin, umax, vmax) as a (2, 2) array, or None if it misses the
+    box (Liang-Barsky).
+    """
+    du, dv = u[1] - u[0], v[1] - v[0]
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-du, u[0] - box[0]), (du, box[2] - u[0]),
+                 (-dv, v[0] - box[1]), (dv, box[3] - v[0])):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            t0 = max(t0, t)
+        else:
+            t1 = min(t1, t)
+    if t0 > t1:
+        return None
+    return np.array([[u[0] + t0 * du, v[0] + t0 * dv],
+                     [u[0] + t1 * du, v[0] + t1 * dv]])
+
+
+def _points(pts):
+    """Split a list of (x, y) pairs into arrays of xs and ys."""
+    if not pts:
+        return np.empty(0), np.empty(0)
+    return (np.concatenate([np.ravel(p[0]) for p in pts]),
+            np.concatenate([np.ravel(p[1]) for p in pts]))
+
+
+def plot_maps(result):
+    """Plot pcolor maps of Hc and Mrem/Msat.
+
+    Args:
+        result: ScanResult from scmoplot.engine.analyze()
+
+    Returns:
+        matplotlib.figure.Figure
+    """
+    Hcs = result.Hcs[..., 1]
+    Mrs = result.Mrs[..., 1]
+
+    gs = GridSpec(10, 10)
+    ax0 = plt.subplot(gs[0:9, :5])
+    ax1 = plt.subplot(gs[9, :5])
+    ax2 = plt.subplot(gs[0:9, 5:])
+    ax3 = plt.subplot(gs[9, 5:])
+    fig = ax0.get_figure()
+    fig.set_size_inches(12, 8)
+
+    # Plot Hc pcolor map
+    n = Normalize(vmin=0.0, vmax=5.0, clip=True)
+    res = ax0.pcolor(Hcs, cmap='afmhot', norm=n, edgecolors='k')
+    plt.colorbar(res, cax=ax1, orientation='horizontal', ticks=(0, 2.5, 5))
+
+    # Plot Mr pcolor map
+    n = Normalize(vmin=0.0, vmax=1.0, clip=True)
+    res = ax2.pcolor(Mrs, cmap='afmhot', norm=n, edgecolors='k')
+    plt.colorbar(res, cax=ax3, orientation='horizontal', ticks=(0, 0.5, 1))
+
+    ax0.set_title('Hc (mT)')
+    ax0.set_aspect('equal', adjustable='box')
+    ax2.set_title('Mrem/Msat')
+    ax2.set_aspect('equal', adjustable='box')
+    return fig
+
+
+def plot_sweep(sweep_result, key='Hc', ncols=None):
+    """Plot the map of one result for every combination of a sweep side by
+    side, all on the same color scale.
+
+    Args:
+        sweep_result: SweepResult from scmoplot.sweep.sweep()
+        key: per-pixel result to map, 'Hc' or 'Mr' (the middle value of the
+            triplet is used) or any scalar result like 'area'.
+        ncols: number of columns of maps. Defaults to the number of values
+            of the last swept parameter.
+
+    Returns:
+        matplotlib.figure.Figure
+    """
+    maps = sweep_result.stack(key, fill=np.nan)
+    if maps.ndim == 4:
+        maps = maps[..., 1]
+    names = sorted(sweep_result.grid)
+    if ncols is None:
+        ncols = len(sweep_result.grid[names[-1]]) if names else 1
+    nrows = -(-len(maps) // ncols)
+    fig, axarr = plt.subplots(nrows=nrows, ncols=ncols, squeeze=False,
+                              figsize=(3 * ncols, 3 * nrows))
+    norm = Normalize(np.nanmin(maps), np.nanmax(maps))
+    for ax, m, ps in zip(axarr.flat, maps, sweep_result.params):
+        mesh = ax.pcolormesh(m, cmap='afmhot', norm=norm)
+        ax.set_title(', '.join('{}={}'.format(k, ps[k]) for k in names),
+                     fontsize='small')
+        ax.set_aspect('equal', adjustable='box')
+        ax.xaxis.set_ticklabels([])
+        ax.yaxis.set_ticklabels([])
+    for ax in axarr.flat[len(maps):]:
+        ax.set_visible(False)
+    fig.colorbar(mesh, ax=axarr.ravel().tolist(), label=key)
+    return fig
+
+
+class LiveMaps(object):
+    """Hc and Mrem/Msat maps that follow a ScanWatcher.
+
+    Pass the update method as the callback of ScanWatcher.watch(). Only the
+    colors of the existing meshes are changed on every update, the figure
+    is not rebuilt.
+
+    Args:
+        watcher: a ScanWatcher whose result has been set up (polled once).
+    """
+
+    def __init__(self, watcher):
+        self.fig, (ax0, ax2) = plt.subplots(ncols=2, figsize=(12, 6))
+        self.Hc_mesh = ax0.pcolormesh(watcher.Hcs[..., 1], cmap='afmhot',
+                                      norm=Normalize(0.0, 5.0, clip=True),
+                                      edgecolors='k')
+        self.Mr_mesh = ax2.pcolormesh(watcher.Mrs[..., 1], cmap='afmhot',
+                                      norm=Normalize(0.0, 1.0, clip=True),
+                                      edgecolors='k')
+        self.fig.colorbar(self.Hc_mesh, ax=ax0, orientation='horizontal')
+        self.fig.colorbar(self.Mr_mesh, ax=ax2, orientation='horizontal')
+        ax0.set_title('Hc (mT)')
+        ax0.set_aspect('equal', adjustable='box')
+        ax2.set_title('Mrem/Msat')
+        ax2.set_aspect('equal', adjustable='box')
+        plt.ion()
+        plt.show()
+
+    def update(self, watcher, updated):
+        """ScanWatcher callback: recolor the maps and redraw."""
+        self.Hc_mesh.set_array(watcher.Hcs[..., 1].ravel())
+        self.Mr_mesh.set_array(watcher.Mrs[..., 1].ravel())
+        self.fig.canvas.draw_idle()
+        plt.pause(0.001)
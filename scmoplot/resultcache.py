@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""On-disk cache of per-pixel analysis results.
+
+Re-running the analysis of a scan with the same parameters gives the same
+Hc, Mrem, loop area, saturation fields, ... for every pixel. A ResultCache
+keeps the per-pixel results dicts of PixelAnalyzer so that a repeat run
+only has to hash the raw files.
+
+Entries are content addressed: the key of a pixel is a hash of the bytes of
+its raw file together with the fingerprint of the analysis (both pipelines'
+stages and params and the extraction parameters, see
+PixelAnalyzer.fingerprint). Moving or touching a file keeps its entry,
+changing its contents or any parameter does not. Changes to the code of the
+transformations are not part of the key; clear the cache after upgrading.
+"""
+import hashlib
+import os
+import pickle
+from os.path import exists, join
+
+from .rawcache import (default_cache_dir, evict_entries, list_entries,
+                       write_atomic)
+
+# Results that depend on where the file is rather than what is in it. They
+# are not stored, the caller fills them back in on a hit.
+LOCATION_KEYS = ('x', 'y', 'path')
+
+
+def file_digest(path):
+    """sha1 hex digest of the contents of the file at path."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """Content addressed cache of per-pixel results dicts.
+
+    Each entry is a pickle of one results dict without its location keys.
+    When the total size of the cache exceeds max_bytes the least recently
+    used entries are deleted.
+
+    Args:
+        cache_dir: directory that holds the entries. Defaults to
+            default_cache_dir()/results.
+        max_bytes: limit on the total size of the entries.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=2 * 1024**3):
+        if cache_dir is None:
+            cache_dir = join(default_cache_dir(), 'results')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Running estimate of size(), so that put() only lists the cache
+        # directory when it may have to evict.
+        self._size = None
+
+    def key(self, path, fingerprint):
+        """Key of the results of the raw file at path analyzed with the
+        analysis identified by fingerprint.
+        """
+        return hashlib.sha1('{}\0{}'.format(
+            file_digest(path), fingerprint).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the results dict stored under key, without its location
+        keys, or None if there is no entry. An entry that can't be read
+        (truncated, or pickled by an incompatible version) is deleted and
+        counts as a miss.
+        """
+        entry = self._entry(key)
+        try:
+            with open(entry, 'rb') as f:
+                res = pickle.load(f)
+            # The mtime of an entry is its last use, for LRU eviction.
+            os.utime(entry, None)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            # Unpickling can raise nearly anything for a bad entry.
+            self.invalidate(key)
+            return None
+        return res
+
+    def put(self, key, res):
+        """Store a results dict under key."""
+        res = dict((k, v) for k, v in res.items() if k not in LOCATION_KEYS)
+        entry = self._entry(key)
+        if not exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomic(entry, lambda f: pickle.dump(
+            res, f, protocol=pickle.HIGHEST_PROTOCOL))
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += os.path.getsize(entry)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def invalidate(self, key):
+        """Remove the entry of key if there is one."""
+        try:
+            os.remove(self._entry(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Delete every entry."""
+        for path, size, atime in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = None
+
+    def entries(self):
+        """List the entries as (path, size in bytes, last use time) tuples,
+        least recently used first.
+        """
+        return list_entries(self.cache_dir, '.pkl')
+
+    def size(self):
+        """Total size of the entries in bytes."""
+        return sum(e[1] for e in self.entries())
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in
+        max_bytes.
+        """
+        self._size = evict_entries(self.entries(), self.max_bytes)
+
+    def _entry(self, key):
+        return join(self.cache_dir, key + '.pkl')
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Analyze a scan for every combination of a grid of parameter values.
+
+Running the analysis once per combination would reload and refilter every
+loop each time. sweep() instead loads each chunk of loop files once and
+runs every combination over it with one PrefixMemo shared by all of them,
+so each pipeline stage runs once per distinct prefix of stage params: the
+loading and scaling once, the median filter of the second pipeline once
+per filt_ks, and the first pipeline once per (thresh, filt_ks) since its
+median filter follows the thresh dependent flatten_saturation. Parameters
+that only affect the extraction, like max, don't rerun the pipelines at
+all.
+"""
+import itertools
+import json
+import multiprocessing
+from os.path import basename, join, normpath
+
+import numpy as np
+
+from .batch import map_keys
+from .engine import (PixelAnalyzer, ScanResult, default_ps, scan_chunks,
+                     scan_files)
+from .loopstack import LoopStack
+from .lvxml2dict import Cluster
+from .prefixmemo import PrefixMemo
+from .rawcache import RawCache, file_key
+
+
+def combinations(grid, base_ps={}):
+    """Expand a grid of parameter values into a list of parameter dicts.
+
+    Args:
+        grid: dict of parameter name -> sequence of values.
+        base_ps: dict of parameters that every combination starts from.
+
+    Returns:
+        list: one dict per combination, the last parameter of the grid (in
+            sorted order) varying fastest.
+    """
+    names = sorted(grid)
+    out = []
+    for values in itertools.product(*[grid[k] for k in names]):
+        ps = dict(base_ps)
+        ps.update(zip(names, values))
+        out.append(ps)
+    return out
+
+
+class SweepAnalyzer(object):
+    """Callable that analyzes a chunk of loop files for every combination.
+
+    Like PixelAnalyzer it can be pickled and shipped to worker processes.
+
+    Args:
+        combos: list of parameter dicts, complete (see default_ps).
+        cache: RawCache to read the loop files through, or None.
+        memo_bytes: size limit of the PrefixMemo of a chunk.
+    """
+
+    def __init__(self, combos, cache=None, memo_bytes=512 * 1024**2):
+        self.memo = PrefixMemo(max_bytes=memo_bytes)
+        self.analyzers = [PixelAnalyzer(ps, keep_loops=False, memo=self.memo)
+                          for ps in combos]
+        self.cache = cache
+
+    def __call__(self, paths):
+        """Analyze the loop files at paths with every combination.
+
+        Returns:
+            list: for each combination, the list of per-pixel results dicts.
+        """
+        try:
+            if self.cache is not None:
+                x, y = self.cache.load_scan(paths)
+                stack = LoopStack(x, y, targets=paths)
+            else:
+                stack = LoopStack.from_files(paths)
+        except Exception:
+            return [analyzer.batch(paths) for analyzer in self.analyzers]
+        try:
+            keys = [file_key(p) for p in paths]
+            return [analyzer.analyze_stack(stack, keys=keys)
+                    for analyzer in self.analyzers]
+        finally:
+            # Nothing is shared between chunks.
+            self.memo.clear()
+
+
+class SweepResult(object):
+    """The results of every combination of a sweep.
+
+    Attributes:
+        grid: dict of parameter name -> values that was swept.
+        params: list of the parameter dicts of the combinations.
+        results: list of the ScanResult of each combination.
+        shape: (gy, gx) of the scan.
+    """
+
+    def __init__(self, grid, params, results):
+        self.grid = grid
+        self.params = params
+        self.results = results
+        self.shape = results[0].shape if results else (0, 0)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __getitem__(self, i):
+        return self.results[i]
+
+    def index(self, **params):
+        """Index of the combination with the given parameter values."""
+        for i, ps in enumerate(self.params):
+            if all(ps.get(k) == v for k, v in params.items()):
+                return i
+        raise KeyError('No combination with {}'.format(params))
+
+    def stack(self, key, fill=0.0):
+        """Stack the grid() of a per-pixel result over the combinations.
+
+        Returns:
+            np.ndarray: shape (n_combinations, gy, gx) + shape of the value.
+        """
+        return np.stack([r.grid(key, fill) for r in self.results])
+
+    def failed(self):
+        """(n_combinations, gy, gx) boolean array of the failed pixels."""
+        out = np.zeros((len(self),) + self.shape, dtype=bool)
+        for i, r in enumerate(self.results):
+            for x, y in r.errors():
+                out[i, y, x] = True
+        return out
+
+    @property
+    def Hcs(self):
+        """Hc triplets, shape (n_combinations, gy, gx, 3)."""
+        return self.stack('Hc')
+
+    @property
+    def Mrs(self):
+        """Mrem/Msat triplets, shape (n_combinations, gy, gx, 3)."""
+        return self.stack('Mr')
+
+
+def sweep(root_path, grid, user_ps={}, workers=None, chunksize=16,
+          cache=None):
+    """Analyze a scan directory for every combination of parameter values.
+
+    Args:
+        root_path: the scan directory. Must contain parameters.xml.
+        grid: dict of parameter name -> sequence of values, e.g.
+            {'thresh': [6, 7, 8], 'filt_ks': [101, 157]}.
+        user_ps: dict of parameters that override default_ps in every
+            combination.
+        workers: number of worker processes. Defaults to the number of CPUs.
+        chunksize: number of files handed to a worker at a time.
+        cache: a RawCache to read the loop files through, True to use a
+            RawCache in the default location, or None.
+
+    Returns:
+        SweepResult
+    """
+    base_ps = dict(default_ps)
+    base_ps.update(user_ps)
+    combos = combinations(grid, base_ps)
+    clust = Cluster(join(root_path, 'parameters.xml')).to_dict()
+    gx, gy = (clust['Rows'], clust['Cols'])
+    results = [ScanResult((gy, gx), clust, ps) for ps in combos]
+    if cache is True:
+        cache = RawCache()
+    analyzer = SweepAnalyzer(combos, cache=cache or None)
+    chunks = scan_chunks(scan_files(root_path), chunksize)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(chunks)))
+    if workers == 1:
+        _collect(results, map(analyzer, chunks))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            _collect(results, pool.imap_unordered(analyzer, chunks))
+    return SweepResult(grid, combos, results)
+
+
+def _collect(results, outputs):
+    for per_combo in outputs:
+        for result, pixels in zip(results, per_combo):
+            for pixel in pixels:
+                result.add(pixel)
+
+
+def save_sweep(sweep_result, out_path):
+    """Write the stacked maps of a SweepResult to a .npz file.
+
+    The file holds one (n_combinations, gy, gx[, 3]) array per entry of
+    batch.map_keys, the stacked 'failed' maps, and the parameters of every
+    combination and the swept grid as JSON strings under 'params' and
+    'grid'.
+    """
+    arrays = dict((k, sweep_result.stack(pk, fill=np.nan))
+                  for k, pk in map_keys)
+    arrays['failed'] = sweep_result.failed()
+    arrays['params'] = np.array(json.dumps(sweep_result.params))
+    arrays['grid'] = np.array(json.dumps(sweep_result.grid))
+    np.savez(out_path, **arrays)
+
+
+def sweep_path(root_path, out_dir):
+    """Name of the sweep file of the scan in root_path when saved to
+    out_dir.
+    """
+    return join(out_dir, basename(normpath(root_path)) + '_sweep.npz')
@@ -1,33 +1,62 @@
 # -*- coding: utf-8 -*-
 import numpy as np
-from collections import Iterable
-from scipy.optimize import curve_fit
-from scipy.ndimage import gaussian_filter
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
+
+from .loading import cycle_bounds, half_index
 
 #hello
 
+def inplace_safe(func):
+    """Declare that func can transform its input arrays in place.
+
+    Functions declared this way take two more keyword arguments:
+    inplace=False and scratch=None. Called with inplace=True they may
+    overwrite the x and y they are given and return them, and with a
+    transformer.Scratch they may take temporary arrays from it rather than
+    allocating them. A Transformer(inplace=True) calls them like that.
+    Otherwise they leave their input alone.
+    """
+    func.inplace_safe = True
+    return func
+
+
 def line(x, m, b):
     return m * x + b
 
 
-def scale(x, y, xsc=1.0, ysc=1.0, **kwargs):
+@inplace_safe
+def scale(x, y, xsc=1.0, ysc=1.0, inplace=False, **kwargs):
     """Scale data. For use with Transformer."""
+    if inplace:
+        x *= xsc
+        y *= ysc
+        return x, y
     return x * xsc, y * ysc
 
 
-def translate(x, y, xtrans=1.0, ytrans=1.0, **kwargs):
+@inplace_safe
+def translate(x, y, xtrans=1.0, ytrans=1.0, inplace=False, **kwargs):
     """Translate data. For use with Transformer."""
+    if inplace:
+        x += xtrans
+        y += ytrans
+        return x, y
     return x + xtrans, y + ytrans
 
 
-def invertx(x, y, **kwargs):
+@inplace_safe
+def invertx(x, y, inplace=False, **kwargs):
     """Multiply x by -1"""
-    return -x, y
+    return np.negative(x, out=x if inplace else None), y
 
 
-def inverty(x, y, **kwargs):
+@inplace_safe
+def inverty(x, y, inplace=False, **kwargs):
     """Multiply y by -1"""
-    return x, -y
+    return x, np.negative(y, out=y if inplace else None)
 
 
 def medfilt(x, y, ks=3, axis='y', **kwargs):
@@ -48,65 +77,131 @@ def medfilt(x, y, ks=3, axis='y', **kwargs):
     return x, y
 
 
-def wrapped_medfilt(x, y, ks=3, axis='y', **kwargs):
-    """Use scipy.signal.medfilt to filter either the x or y data. Also loop the
-    filter around to prevent edge effects.
+@inplace_safe
+def wrapped_medfilt(x, y, ks=3, axis='y', inplace=False, scratch=None,
+                    **kwargs):
+    """Median filter either the x or y data. Also loop the filter around to
+    prevent edge effects.
 
     If the data forms a closed loop the medfilt should account for this,
     otherwise there will be artifacts introduced in points near (less than
-    ks-1 / 2) the edge of the data. This version of medfilt accounts for that
-    by prepending the last ks data points and appending the first data points,
-    running medfilt, and then removing the pre/appended points.
-    
+    ks-1 / 2) the edge of the data. This version treats the data as
+    periodic, so the filter window near one end is filled from the other
+    end. See running_median.
+
+    x and y may also be 2-D stacks of loops, one loop per row, in which
+    case every row is filtered.
+
     Args:
         ks: and odd number that represents the width of the filter. See medfilt
             for more detail.
         axis: either 'x' or 'y'. Indicates which axis medfilt should be called
             on.
     """
-    from scipy.signal import medfilt
     _verify_axis(axis)
-    x = np.concatenate((x[-ks:], x, x[:ks]))
-    y = np.concatenate((y[-ks:], y, y[:ks]))
     if axis == 'x':
-        x = medfilt(x, ks)
-    elif axis == 'y': 
-        y = medfilt(y, ks)
-    return x[ks:-ks], y[ks:-ks]
+        x = _filtered(running_median, x, inplace, scratch, ks)
+    elif axis == 'y':
+        y = _filtered(running_median, y, inplace, scratch, ks)
+    return x, y
 
 
-def remove_offset(x, y, axis='y', **kwargs):
+def _filtered(filt, a, inplace, scratch, *args):
+    """filt(a, *args, out=...) for the in-place transformations: filtered
+    into a temporary array from scratch and copied back into a if inplace,
+    into a new array otherwise.
+    """
+    if not inplace:
+        return filt(a, *args)
+    tmp = scratch.like(a) if scratch is not None else None
+    a[...] = filt(a, *args, out=tmp)
+    return a
+
+
+def running_median(a, ks, axis=-1, out=None):
+    """Median of the ks wide window centered on every point of a, where the
+    window wraps around the ends of the data as if it were periodic.
+
+    This uses scipy.ndimage.median_filter with mode='wrap', so no padded
+    copies are made, and its 1-D rank filter keeps the window sorted as it
+    slides, so the cost per point grows like log(ks) rather than ks. For
+    N-D input every 1-D line along axis is filtered.
+
+    Args:
+        a: array to filter.
+        ks: odd width of the window.
+        axis: axis along which to filter.
+        out: array of the same shape and dtype as a to write the result
+            to, or None for a new one. Must not overlap a.
+
+    Returns:
+        np.ndarray: same shape and dtype as a.
+    """
+    from scipy.ndimage import median_filter
+    if ks % 2 != 1:
+        raise ValueError('ks must be odd, not {}'.format(ks))
+    a = np.asarray(a)
+    if out is None:
+        out = np.empty_like(a)
+    if a.ndim == 1:
+        median_filter(a, size=ks, mode='wrap', output=out)
+        return out
+    # ndimage only uses its fast rank filter on 1-D input, so filter line
+    # by line rather than with a (1, ks) footprint.
+    lines, out_lines = np.moveaxis(a, axis, -1), np.moveaxis(out, axis, -1)
+    for idx in np.ndindex(*lines.shape[:-1]):
+        median_filter(lines[idx], size=ks, mode='wrap', output=out_lines[idx])
+    return out
+
+
+@inplace_safe
+def remove_offset(x, y, axis='y', inplace=False, **kwargs):
     """Center data either horizontally or vertically (default to vertically).
 
-    This is done by the crude method of just doing y -= y.mean() (if axis='y').
+    This is done by the crude method of just returning y - y.mean() (if
+    axis='y'). The input is only modified if inplace.
 
     Args:
         axis: either 'x' or 'y'. Indicates which axis should be centered.
     """
     _verify_axis(axis)
     if axis == 'y':
-        y -= y.mean()
+        y = _subtract(y, y.mean(), inplace)
     elif axis == 'x':
-        x -= x.mean()
+        x = _subtract(x, x.mean(), inplace)
     return x, y
 
 
-def center(x, y, axis='y', **kwargs):
+@inplace_safe
+def center(x, y, axis='y', inplace=False, **kwargs):
     """Center data either horizontally or vertically (default to vertically).
 
-    Return y - average_of(y.max(), y.min())
+    Return y - average_of(y.max(), y.min()). The input is only modified if
+    inplace.
+
+    For 2-D stacks of loops every row is centered separately.
 
     Args:
         axis: either 'x' or 'y'. Indicates which axis should be centered.
     """
     _verify_axis(axis)
     if axis == 'y':
-        y -= 0.5 * (y.max() + y.min())
+        y = _subtract(y, 0.5 * (y.max(-1, keepdims=True) +
+                                y.min(-1, keepdims=True)), inplace)
     elif axis == 'x':
-        x -= 0.5 * (x.max() + x.min())
+        x = _subtract(x, 0.5 * (x.max(-1, keepdims=True) +
+                                x.min(-1, keepdims=True)), inplace)
     return x, y
 
 
+def _subtract(a, b, inplace):
+    """a - b, written into a if inplace."""
+    if inplace:
+        a -= b
+        return a
+    return a - b
+
+
 def unroll(x, y, axis='y', **kwargs):
     """Replace the x (y) data with np.arange(N) where N is the number of data
     points. 
@@ -146,17 +241,64 @@ def spline(x, y, axis='y', s=3.0, **kwargs):
         return spl(ylin), y
 
 
-def flatten_saturation(x, y, threshold=200, polarity='+', **kwargs):
+@inplace_safe
+def flatten_saturation(x, y, threshold=200, polarity='+', inplace=False,
+                       scratch=None, **kwargs):
     """Subtract a linear term from your data based on a fit to the saturation
     region.
+
+    For 2-D stacks of loops a separate line is fit to every row.
     """
-    from scipy.optimize import curve_fit
     if polarity == '+':
         mask = x > threshold
     elif polarity == '-':
         mask = x < threshold
-    popt, pcov = curve_fit(line, x[mask], y[mask])
-    return x, y - line(x, *popt)
+    m, b, _ = linfit(x, y, mask)
+    if not inplace:
+        return x, y - line(x, m[..., None], b[..., None])
+    if scratch is None:
+        y -= line(x, m[..., None], b[..., None])
+        return x, y
+    fit = scratch.like(y)
+    np.multiply(m[..., None], x, out=fit)
+    fit += b[..., None]
+    y -= fit
+    return x, y
+
+
+def linfit(x, y, mask=None):
+    """Least squares fit of a line to y(x), in closed form.
+
+    The fit is done along the last axis, so passing 2-D arrays fits one line
+    per row in a single call. mask selects the points of each row that take
+    part in the fit, which lets many segments of different lengths be fit at
+    once. Rows with fewer than two selected points give nan.
+
+    Args:
+        x, y: arrays that broadcast against each other.
+        mask: boolean array that broadcasts against x and y, or None to use
+            every point.
+
+    Returns:
+        tuple: (m, b, s) the slopes, intercepts and the standard deviations
+            of the residuals y - (m*x + b), with the last axis removed.
+    """
+    x, y = np.broadcast_arrays(x, y)
+    if mask is None:
+        w = np.ones(x.shape)
+    else:
+        w = np.broadcast_to(mask, x.shape).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = w.sum(-1)
+        xm = (w * x).sum(-1) / n
+        ym = (w * y).sum(-1) / n
+        dx = x - xm[..., None]
+        dy = y - ym[..., None]
+        m = (w * dx * dy).sum(-1) / (w * dx * dx).sum(-1)
+        m = np.where(n < 2, np.nan, m)
+        res = dy - m[..., None] * dx
+        s = np.sqrt((w * res * res).sum(-1) / n)
+    return m, ym - m * xm, s
 
 
 def _verify_axis(axis):
@@ -165,31 +307,89 @@ def _verify_axis(axis):
 
 
 def second_half(x, y, **kwargs):
-    N = len(x)
-    half = int((N-1)/2)
+    half = half_index(len(x))
     return x[half:], y[half:]
     
 
 def first_half(x, y, **kwargs):
-    N = len(x)
-    half = int((N-1)/2)
+    half = half_index(len(x))
     return x[:half], y[:half]
 
 
 def middle(x, y, **kwargs):
     N = len(x)
-    half = int((N-1)/2)
+    half = half_index(N)
     Nseg = 100
     return x[half-Nseg:N-1-Nseg], y[half-Nseg:N-1-Nseg]
     
 
 def ith_cycle(x, y, i, ncyc, delta=0, **kwargs):
-    N = len(x)
-    cycN = N/ncyc
-    start, end = i*cycN+delta, (i+1)*cycN+delta
+    """The i-th of ncyc equal cycles, shifted by delta points. To avoid
+    loading the other cycles of long files, read it with
+    reader.LoopReader.cycle instead.
+    """
+    start, end = cycle_bounds(len(x), i, ncyc, delta)
     return x[start:end], y[start:end]
     
 
+def resample_branches(x, y, n=500, lim=None, **kwargs):
+    """Resample the descending and ascending branches of a loop onto one
+    field grid, so that every loop of a stack shares the same x.
+
+    Each loop is split at its highest and lowest fields into a descending
+    and an ascending branch, both of which include the two turning points.
+    Both are interpolated linearly at n fields evenly spaced over lim
+    (values outside a branch's range are held at its end). The result runs
+    down the grid and back up it without repeating the turning points,
+    2n - 2 points in all.
+
+    For 2-D stacks of loops every row is resampled, and the shared x is
+    returned as a 1-D array that broadcasts against the rows of y.
+
+    Args:
+        n: number of grid fields per branch, at least 3.
+        lim: (low, high) field range of the grid. Defaults to the range
+            covered by every loop, which depends on the loops passed in;
+            give it to make results independent of how loops are stacked.
+
+    Returns:
+        tuple: (x, y) with x of shape (2n - 2,) and y of shape
+            (..., 2n - 2).
+    """
+    if n < 3:
+        raise ValueError('n must be at least 3, not {}'.format(n))
+    x, y = np.broadcast_arrays(x, y)
+    shape = y.shape
+    x = x.reshape(-1, shape[-1])
+    y = y.reshape(-1, shape[-1])
+    if lim is None:
+        lim = (x.min(-1).max(), x.max(-1).min())
+    grid = np.linspace(lim[0], lim[1], n)
+    out = np.empty((len(y), 2 * n - 2))
+    pos = np.arange(shape[-1] + 1)
+    # np.interp row by row is several times faster than one searchsorted
+    # over all rows laid end to end, see the resample stages of
+    # benchmarks/stages.py.
+    for xi, yi, o in zip(x, y, out):
+        top = np.argmax(xi)
+        k = (np.argmin(xi) - top) % len(xi)
+        # The loop from its highest field round to it again: the
+        # descending branch is [:k + 1] and the ascending one [k:].
+        turn = (top + pos) % len(xi)
+        xr, yr = xi[turn], yi[turn]
+        o[:n] = _interp_branch(grid, xr[:k + 1], yr[:k + 1])[::-1]
+        o[n:] = _interp_branch(grid, xr[k:], yr[k:])[1:-1]
+    x_out = np.concatenate((grid[::-1], grid[1:-1]))
+    return x_out, out.reshape(shape[:-1] + (2 * n - 2,))
+
+
+def _interp_branch(g, x, y):
+    """np.interp of one branch, whose x need not be sorted (noise in the
+    measured field)."""
+    order = np.argsort(x, kind='stable')
+    return np.interp(g, x[order], y[order])
+
+
 def vertical_offset(x, y, dy=0.1, **kwargs):
     if not hasattr(vertical_offset, 'offset'):
         vertical_offset.offset = 0.0
@@ -220,25 +420,36 @@ def normalize(x, y, xlim=None, ylim=None, n_avg=1, **kwargs):
             lim = (-lim, lim)
         center = (lim[0] + lim[1]) / 2.0
         width = lim[1] - lim[0]
-        u -= u.mean()
+        u = u - u.mean()
         uwidth = 2 * (_max_n_points(np.abs(u), n_avg).mean())
         res.append(u * (width / uwidth) + center)
     return res[0], res[1]
 
 
-def simple_normalize(x, y, n_avg=1, axis='y', **kwargs):
+@inplace_safe
+def simple_normalize(x, y, n_avg=1, axis='y', inplace=False, **kwargs):
     _verify_axis(axis)
     if axis == 'y':
-        return x, y/_max_n_points(np.abs(y), n_avg).mean()
+        return x, _divide(y, _max_n_points(np.abs(y), n_avg).mean(), inplace)
     else:
-        return x/_max_n_points(np.abs(x), n_avg).mean(), y
+        return _divide(x, _max_n_points(np.abs(x), n_avg).mean(), inplace), y
 
 
-def saturation_normalize(x, y, thresh=1.0, axis='y', **kwargs):
-    return x, y / _saturation_level(x, y, thresh)
+@inplace_safe
+def saturation_normalize(x, y, thresh=1.0, axis='y', inplace=False,
+                         **kwargs):
+    return x, _divide(y, _saturation_level(x, y, thresh), inplace)
     # return x[np.abs(x) > thresh], y[np.abs(x) > thresh]
 
 
+def _divide(a, b, inplace):
+    """a / b, written into a if inplace."""
+    if inplace:
+        a /= b
+        return a
+    return a / b
+
+
 def _max_n_points(arr, n=1):
     return _n_nearest_points(arr, n, arr.max())
 
@@ -257,10 +468,13 @@ def _n_nearest_points(arr, n=1, x0=0.0, other_arr=None):
 
 
 def _saturation_level(x, y, thresh):
-    return np.abs(y)[np.abs(x) > thresh].mean()
+    """Mean of |y| where |x| > thresh, per row for 2-D stacks of loops."""
+    mask = np.abs(x) > thresh
+    return ((np.abs(y) * mask).sum(-1, keepdims=True) /
+            mask.sum(-1, keepdims=True))
 
 
-def threshold_crop(x, y, thresh=np.float('inf'), axis='x', **kwargs):
+def threshold_crop(x, y, thresh=float('inf'), axis='x', **kwargs):
     """Clip of all points that are above thresh.
 
     Args:
@@ -273,7 +487,11 @@ def threshold_crop(x, y, thresh=np.float('inf'), axis='x', **kwargs):
     return x[ind], y[ind]
     
 
-def Hc_of(x, y, ks=2, fit_ks_multiplier=5.0, fit_int=(15.0, 20.0)):
+def Hc_of(x, y, ks=2, fit_ks_multiplier=5.0, fit_int=(15.0, 20.0), s_y=None):
+    """s_y is the y noise, a scalar or one value per point (e.g. the
+    standard error of averaged scans, see aggregate). Estimated with sigma_y
+    if None.
+    """
     # Setup indices
     gt0idx = x >= 0
     lt0idx = x < 0
@@ -286,43 +504,55 @@ def Hc_of(x, y, ks=2, fit_ks_multiplier=5.0, fit_int=(15.0, 20.0)):
     vals = (Hc_lt0, Hc_gt0, Hc_avg)
     print(('Hc: (-) {}, (+) {}, (avg) {}'.format(*vals)))
     # Compute sigma_y and m
-    s_y = sigma_y(x, y, fit_int)
-    fksm = fit_ks_multiplier
-    fitygt0 = y[gt0idx][ymgt0idx - fksm * ks:ymgt0idx + fksm * ks]
-    fitxgt0 = x[gt0idx][ymgt0idx - fksm * ks:ymgt0idx + fksm * ks]
-    fitylt0 = y[lt0idx][ymlt0idx - fksm * ks:ymlt0idx + fksm * ks]
-    fitxlt0 = x[lt0idx][ymlt0idx - fksm * ks:ymlt0idx + fksm * ks]
-    try:
-        (mgt0, _), _ = curve_fit(line, fitxgt0, fitygt0)
-        (mlt0, _), _ = curve_fit(line, fitxlt0, fitylt0)
-        m = (mgt0 + mlt0)/2.0
+    if s_y is None:
+        s_y = sigma_y(x, y, fit_int)
+    elif np.ndim(s_y):
+        s_y = (s_y[np.flatnonzero(gt0idx)[ymgt0idx]] +
+               s_y[np.flatnonzero(lt0idx)[ymlt0idx]]) / 2.
+    fks = int(fit_ks_multiplier * ks)
+    fitygt0 = y[gt0idx][ymgt0idx - fks:ymgt0idx + fks]
+    fitxgt0 = x[gt0idx][ymgt0idx - fks:ymgt0idx + fks]
+    fitylt0 = y[lt0idx][ymlt0idx - fks:ymlt0idx + fks]
+    fitxlt0 = x[lt0idx][ymlt0idx - fks:ymlt0idx + fks]
+    mgt0, _, _ = linfit(fitxgt0, fitygt0)
+    mlt0, _, _ = linfit(fitxlt0, fitylt0)
+    m = (mgt0 + mlt0)/2.0
+    if np.isfinite(m):
         s_x = proj_sigma(s_y, m)
         print(('sigma_y: {} proj_sigma: {} m: {}\n'.format(s_y, s_x, m)))
-    except TypeError:
-        print('Type Error in curve fit unable to project slope')
+    else:
+        print('Too few points around Hc to fit, unable to project slope')
         print(('sigma_y: {}\n'.format(s_y)))
-        m = np.float('inf')
-        s_x = np.float('0.0')
+        m = float('inf')
+        s_x = 0.0
     # return np.array(v), np.array(s_y)
     # return np.array(v), np.array(Hc_avg)
     return np.array([Hc_avg + x for x in (-s_x, 0, s_x)])
 
 
-def Mrem_of(x, y, ks=3, fit_int=(15.0, 20.0)):
-    # Setup indices
-    N = len(x)
-    inds = np.arange(N).reshape(4, N//4)
-    yq03 = y[inds[[0, 3]]].reshape(N//2) # yq03 = y quarters 0 and 3
-    xq03 = x[inds[[0, 3]]].reshape(N//2)
-    yq12 = y[inds[[1, 2]]].reshape(N//2)
-    xq12 = x[inds[[1, 2]]].reshape(N//2)
+def Mrem_of(x, y, ks=3, fit_int=(15.0, 20.0), s_y=None):
+    """s_y is the y noise, a scalar or one value per point. Estimated with
+    sigma_y if None.
+    """
+    # Setup indices. If N isn't divisible by 4 the last few points are left
+    # out of the quarters.
+    Q = len(x) // 4
+    inds = np.arange(4 * Q).reshape(4, Q)
+    yq03 = y[inds[[0, 3]]].reshape(2 * Q) # yq03 = y quarters 0 and 3
+    xq03 = x[inds[[0, 3]]].reshape(2 * Q)
+    yq12 = y[inds[[1, 2]]].reshape(2 * Q)
+    xq12 = x[inds[[1, 2]]].reshape(2 * Q)
     xmq03i = np.argmin(np.abs(xq03)) # xmq03i = indsof x min quarters 0 and 3
     xmq12i = np.argmin(np.abs(xq12))
     # Average over the kernel size
     yq03avg = abs(np.mean(yq03[xmq03i-ks:xmq03i+ks]))
     yq12avg = abs(np.mean(yq12[xmq12i-ks:xmq12i+ks]))
     mrem = (yq03avg + yq12avg)/2.
-    s_y = sigma_y(x, y, fit_int)
+    if s_y is None:
+        s_y = sigma_y(x, y, fit_int)
+    elif np.ndim(s_y):
+        s_y = (s_y[inds[[0, 3]]].reshape(2 * Q)[xmq03i] +
+               s_y[inds[[1, 2]]].reshape(2 * Q)[xmq12i]) / 2.
     return np.array([mrem+x for x in (-s_y, 0, s_y)])
 
 
@@ -330,12 +560,177 @@ def sigma_y(x, y, fit_int=(15.0, 20.0)):
     '''Estimate the y noise. fit_int designates a flat or linear region.
     Fit the region and subtract the linear term. Then the std of the 
     entire region is an estimate of the std of the whole sample.
+
+    For 2-D stacks of loops one estimate per row is returned.
     '''
-    N = len(x)
-    x_q1, y_q1 = x[:N//4], y[:N//4]
+    N = np.shape(x)[-1]
+    x_q1, y_q1 = x[..., :N//4], y[..., :N//4]
     idx = (fit_int[0] < x_q1) & (x_q1 < fit_int[1])
-    popt, pcov = curve_fit(line, x_q1[idx], y_q1[idx])
-    return np.std(y_q1[idx] - line(x_q1[idx], *popt))
+    return linfit(x_q1, y_q1, idx)[2]
+
+
+def coercivity(x, y, fit_int=(15.0, 20.0), fit_window=10, s_y=None):
+    '''Hc with its uncertainty for one loop or every row of a 2-D stack.
+
+    Like Hc_of, but the field where the loop crosses y = 0 is found by
+    linear interpolation between the two samples on either side of the
+    crossing rather than by averaging a window of samples. The crossing on
+    each side of x = 0 whose bracketing samples are closest to y = 0 is
+    used. The slope used to project the y noise onto x is fit to the
+    fit_window samples on either side of each crossing.
+
+    Args:
+        fit_int: field interval used by sigma_y to estimate the y noise.
+        fit_window: half width, in samples, of the slope fits.
+        s_y: y noise per loop, or per point if it has the shape of y (then
+            the noise at the two crossings is used). Estimated with sigma_y
+            if None.
+
+    Returns:
+        np.ndarray: (..., 3) the triplets Hc - s_x, Hc, Hc + s_x. Hc is nan
+            for loops that don't cross y = 0 on both sides of x = 0.
+    '''
+    x, y = np.broadcast_arrays(x, y)
+    if s_y is None:
+        s_y = sigma_y(x, y, fit_int)
+    per_point = np.shape(s_y) == y.shape
+    x0, i, score = _crossings(y, x)
+    Hcs, slopes, s_ys = [], [], []
+    for side in (x0 >= 0, x0 < 0):
+        best = np.argmin(np.where(side, score, np.inf), axis=-1)[..., None]
+        found = np.take_along_axis(side, best, -1)[..., 0]
+        Hcs.append(np.where(found, np.take_along_axis(x0, best, -1)[..., 0],
+                            np.nan))
+        center = np.take_along_axis(i, best, -1)
+        if per_point:
+            s_ys.append(_at_crossing(s_y, center))
+        win = (center + np.arange(-fit_window + 1, fit_window + 1)) % x.shape[-1]
+        m, _, _ = linfit(np.take_along_axis(x, win, -1),
+                         np.take_along_axis(y, win, -1))
+        slopes.append(m)
+    Hc = (np.abs(Hcs[0]) + np.abs(Hcs[1])) / 2.
+    m = (slopes[0] + slopes[1]) / 2.
+    if per_point:
+        s_y = (s_ys[0] + s_ys[1]) / 2.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s_x = np.where(np.isfinite(m), proj_sigma(s_y, m), 0.0)
+    return np.stack((Hc - s_x, Hc, Hc + s_x), axis=-1)
+
+
+def remanence(x, y, fit_int=(15.0, 20.0), s_y=None):
+    '''Mrem with its uncertainty for one loop or every row of a 2-D stack.
+
+    Like Mrem_of, but y at x = 0 is found by linear interpolation between
+    the two samples on either side of each zero crossing of x, and it works
+    for any number of samples. Mrem is the mean of |y| at the crossing
+    where x decreases through 0 and the one where it increases through 0
+    (of each kind, the one whose bracketing samples are closest to x = 0).
+
+    Args:
+        fit_int: field interval used by sigma_y to estimate the y noise.
+        s_y: y noise per loop, or per point if it has the shape of y (then
+            the noise at the two crossings is used). Estimated with sigma_y
+            if None.
+
+    Returns:
+        np.ndarray: (..., 3) the triplets Mrem - s_y, Mrem, Mrem + s_y.
+    '''
+    x, y = np.broadcast_arrays(x, y)
+    if s_y is None:
+        s_y = sigma_y(x, y, fit_int)
+    per_point = np.shape(s_y) == y.shape
+    y0, i, score = _crossings(x, y)
+    falling = x > np.roll(x, -1, axis=-1)
+    falling = np.take_along_axis(falling, i, -1)
+    ys, s_ys = [], []
+    for branch in (falling, ~falling):
+        best = np.argmin(np.where(branch, score, np.inf), axis=-1)[..., None]
+        found = np.take_along_axis(branch, best, -1)[..., 0]
+        ys.append(np.where(found, np.take_along_axis(y0, best, -1)[..., 0],
+                           np.nan))
+        if per_point:
+            s_ys.append(_at_crossing(s_y, np.take_along_axis(i, best, -1)))
+    mrem = (np.abs(ys[0]) + np.abs(ys[1])) / 2.
+    if per_point:
+        s_y = (s_ys[0] + s_ys[1]) / 2.
+    s_y = np.asarray(s_y)
+    return np.stack((mrem - s_y, mrem, mrem + s_y), axis=-1)
+
+
+def Hc_Mrem(x, y, fit_int=(15.0, 20.0), fit_window=10, s_y=None):
+    '''coercivity and remanence of one loop or a 2-D stack, sharing one y
+    noise estimate per loop.
+
+    Returns:
+        tuple: (Hc, Mrem) triplets, see coercivity and remanence.
+    '''
+    if s_y is None:
+        s_y = sigma_y(x, y, fit_int)
+    return (coercivity(x, y, fit_int, fit_window, s_y),
+            remanence(x, y, fit_int, s_y))
+
+
+def _at_crossing(s, i):
+    '''Mean of s at the two samples bracketing a crossing between sample i
+    and the next one, wrapping around the end of the loop. i has shape
+    (..., 1) as taken from the indices of _crossings.
+    '''
+    after = (i + 1) % s.shape[-1]
+    return (np.take_along_axis(s, i, -1)[..., 0] +
+            np.take_along_axis(s, after, -1)[..., 0]) / 2.
+
+
+def linear_gain(x, y, y_out):
+    '''Gain of y_out with respect to y, from a least squares fit of
+    y_out = g * y + a * x + b for one loop or every row of a 2-D stack.
+
+    Every stage of the usual pipelines (scale, flatten_saturation, center,
+    the median filters and saturation_normalize) maps a*y + b*x + c to
+    a*(its output) + ..., so g is how much the pipeline scaled y and the
+    noise of y should be scaled by it too.
+
+    Returns:
+        np.ndarray: g, one value per loop.
+    '''
+    x, y, y_out = np.broadcast_arrays(x, y, y_out)
+    A = np.stack((y, x, np.ones_like(y)), axis=-1)
+    AtA = np.einsum('...ni,...nj->...ij', A, A)
+    Atb = np.einsum('...ni,...n->...i', A, y_out)
+    try:
+        return np.linalg.solve(AtA, Atb[..., None])[..., 0, 0]
+    except np.linalg.LinAlgError:
+        return np.full(y.shape[:-1], np.nan)
+
+
+def median_noise_gain(ks):
+    '''Factor by which a running median of width ks scales the std of
+    white gaussian noise: sqrt(pi / (2 ks)), the std of the median of ks
+    samples for large ks, and 1 for ks = 1.
+    '''
+    return min(1.0, np.sqrt(np.pi / (2.0 * ks)))
+
+
+def _crossings(u, v):
+    '''Find where u changes sign between consecutive samples, treating
+    the data as a closed loop, and interpolate v there.
+
+    Returns:
+        tuple: (v0, i, score) arrays with one entry per sample i of u. Where
+            u changes sign between sample i and i + 1, v0 is v interpolated
+            at u = 0 and score is min(|u_i|, |u_i+1|). Elsewhere score is
+            inf. i is just arange(n) broadcast to the shape of u.
+    '''
+    u1 = np.roll(u, -1, axis=-1)
+    v1 = np.roll(v, -1, axis=-1)
+    cross = (u == 0) | (np.sign(u) * np.sign(u1) < 0)
+    # Where u repeats (u == u1, e.g. on the plateaus) t is inf or nan, but
+    # there is no crossing there and v0 is not used.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(u == 0, 0.0, u / (u - u1))
+        v0 = v + t * (v1 - v)
+    score = np.where(cross, np.minimum(np.abs(u), np.abs(u1)), np.inf)
+    i = np.broadcast_to(np.arange(u.shape[-1]), u.shape)
+    return v0, i, score
 
 
 def proj_sigma(sigma, m):
@@ -349,13 +744,26 @@ def proj_sigma(sigma, m):
     
 def loop_area(B,V):
     '''Find the area inside of the loop by trapezoidally integrating the top
-    and the bottom of the loop and finding the difference'''
-    left=np.argmin(B)
-    right=np.argmax(B)
-    top_area=np.trapz(V[right:left],B[right:left])
-    bottom_area1=np.trapz(V[0:right],B[0:right])
-    bottom_area2=np.trapz(V[left:len(B)+1],B[left:len(B)+1])
-    total_area=top_area-(bottom_area1+bottom_area2)
+    and the bottom of the loop and finding the difference
+
+    For 2-D stacks of loops (one per row) an array of areas is returned.'''
+    B, V = np.broadcast_arrays(B, V)
+    n = B.shape[-1]
+    left = np.argmin(B, axis=-1)[..., None]
+    right = np.argmax(B, axis=-1)[..., None]
+    # Running trapezoid integral, integral of V[a:b] dB is C[b-1] - C[a]
+    steps = 0.5 * (V[..., 1:] + V[..., :-1]) * np.diff(B, axis=-1)
+    C = np.concatenate((np.zeros(B.shape[:-1] + (1,)),
+                        np.cumsum(steps, axis=-1)), axis=-1)
+
+    def integral(a, b):
+        b = np.maximum(np.minimum(b, n) - 1, a)
+        return (np.take_along_axis(C, b, -1) -
+                np.take_along_axis(C, a, -1))[..., 0]
+    top_area = integral(right, left)
+    bottom_area1 = integral(np.zeros_like(right), right)
+    bottom_area2 = integral(left, np.full_like(left, n))
+    total_area = top_area - (bottom_area1 + bottom_area2)
     return total_area
 
 def fit_sin(B):
@@ -372,6 +780,7 @@ def fit_sin(B):
         xdata[k]=float(k)
         xdata[k]*=(2*np.pi)/Bl
         
+    from scipy.optimize import curve_fit
     par,junk=curve_fit(func, xdata, B)
 
     
@@ -380,70 +789,141 @@ def fit_sin(B):
         bdata[i]=float(i)
         bdata[i]=func(xdata[i],par[0],par[1], par[2])
     
-def clean(x,y, sigma=10, **kwargs):
-    '''does a gaussian filter on B and V data'''      
-    x=gaussian_filter(x,sigma)
-    y=gaussian_filter(y, sigma)       
+@inplace_safe
+def clean(x,y, sigma=10, inplace=False, scratch=None, **kwargs):
+    '''does a gaussian filter on B and V data (along each row for 2-D
+    stacks of loops)'''
+    x=_filtered(_gaussian, x, inplace, scratch, sigma)
+    y=_filtered(_gaussian, y, inplace, scratch, sigma)
     return x, y
 
+
+def _gaussian(a, sigma, out=None):
+    from scipy.ndimage import gaussian_filter1d
+    return gaussian_filter1d(a, sigma, axis=-1, output=out)
+
 def sat_field(B,V, thresh=.00001):
-    '''finds saturation point'''
+    '''finds saturation point
+
+    Walking back from the end of the loop (lsat) and from the maximum of B
+    (rsat), the saturation point is the first point where dV/dB is not
+    below thresh. If there is no such point the index is 0.
+
+    For 2-D stacks of loops (one per row) arrays of indices are returned.
+    '''
+    B, V = np.broadcast_arrays(B, V)
+    n = B.shape[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dV = _gradient(V, B)
+    idx = np.arange(n)
+    # Like the comparison in a while loop, nan is not below thresh.
+    candidates = np.where(~(dV < thresh), idx, -1)
+    lsat = candidates.max(-1)
+    right = np.argmax(B, axis=-1)
+    rsat = np.where(idx <= right[..., None], candidates, -1).max(-1)
+    return np.maximum(lsat, 0), np.maximum(rsat, 0)
+
+
+def _gradient(y, x):
+    """np.gradient(y, x) along the last axis, where x may differ from row
+    to row.
+    """
+    dx = np.diff(x, axis=-1)
+    dy = np.diff(y, axis=-1)
+    out = np.empty(np.shape(y))
+    dx1, dx2 = dx[..., :-1], dx[..., 1:]
+    a = -(dx2) / (dx1 * (dx1 + dx2))
+    b = (dx2 - dx1) / (dx1 * dx2)
+    c = dx1 / (dx2 * (dx1 + dx2))
+    out[..., 1:-1] = a * y[..., :-2] + b * y[..., 1:-1] + c * y[..., 2:]
+    out[..., 0] = dy[..., 0] / dx[..., 0]
+    out[..., -1] = dy[..., -1] / dx[..., -1]
+    return out
+
+
+def zero_crossings(B, V):
+    '''Find where the loop crosses V = 0 (after centering V, see center)
+    and the slope there.
+
+    The left crossing is the last place V goes from positive to negative,
+    the right crossing the last place it goes from negative to positive.
+    The index of a crossing is that of the sample just before it and the
+    slope is that of the segment across it. Both are 0 if there is no such
+    crossing.
+
+    For 2-D stacks of loops (one per row) arrays are returned.
+
+    Returns:
+        tuple: (lslope, rslope, lindex, rindex)
+    '''
+    B, V = np.broadcast_arrays(B, V)
+    y = V - 0.5 * (V.max(-1, keepdims=True) + V.min(-1, keepdims=True))
+    n = B.shape[-1]
+    idx = np.arange(n - 1)
+    up = (y[..., :-1] < 0) & (y[..., 1:] > 0)
+    down = (y[..., :-1] > 0) & (y[..., 1:] < 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = np.diff(y, axis=-1) / np.diff(B, axis=-1)
+    rindex = np.where(up, idx, -1).max(-1)
+    lindex = np.where(down, idx, -1).max(-1)
+    res = []
+    for i in (lindex, rindex):
+        found = i >= 0
+        i = np.maximum(i, 0)
+        slope = np.take_along_axis(slopes, i[..., None], -1)[..., 0]
+        res.append((np.where(found, slope, 0.0), i))
+    (lslope, lindex), (rslope, rindex) = res
+    return lslope, rslope, lindex, rindex
+
+
+def loop_features(B, V, thresh=.00001):
+    '''Compute the crossing slopes, saturation points and loop area of one
+    loop, or of every row of a 2-D stack of loops, in one call.
+
+    V is centered (on a copy) first, like x0slope does, and all features
+    are computed from the centered loop.
+
+    Returns:
+        dict: with keys 'lslope', 'rslope', 'lindex', 'rindex' (see
+            zero_crossings), 'lsat', 'rsat' (see sat_field) and 'area' (see
+            loop_area). Values are arrays with one entry per loop.
+    '''
+    B, V = np.broadcast_arrays(B, V)
+    V = V - 0.5 * (V.max(-1, keepdims=True) + V.min(-1, keepdims=True))
+    lslope, rslope, lindex, rindex = zero_crossings(B, V)
+    lsat, rsat = sat_field(B, V, thresh)
+    return {'lslope': lslope, 'rslope': rslope, 'lindex': lindex,
+            'rindex': rindex, 'lsat': lsat, 'rsat': rsat,
+            'area': loop_area(B, V)}
+
+
+def tangent_lines(B, V, lindex, rindex, lslope, rslope, n=100):
+    '''Build the tangent lines at the crossings found by zero_crossings,
+    for plotting. V should be centered (see center).
+
+    Returns:
+        list: [lx, ly, lx0, ly0, rx, ry, rx0, ry0] the left tangent line,
+            the left crossing point, the right tangent line and the right
+            crossing point.
+    '''
+    dx = np.arange(-n, n + 1) * np.abs(B[0] - B[1])
+    return [dx + B[lindex], dx * lslope, B[lindex], V[lindex],
+            dx + B[rindex], dx * rslope, B[rindex], V[rindex]]
+
 
-    dV=np.gradient(V,B)
-    
-    lsat=0
-    rsat=0    
-    
-    i=len(B)-1
-    while dV[i]<thresh:
-        i-=1
-    lsat=i
-    
-    i=np.argmax(B)
-    while dV[i]<thresh:
-        i-=1
-    rsat=i
-    
-    return lsat, rsat
-    
 def x0slope(B,V):
-    '''find the slope at the x intercepts'''
-    
-    rslope=0
-    lslope=0
-    rslopeindex=0
-    lslopeindex=0
-    x,y=center(B,V)
-   
-    for i in range(len(x)-1):
-        if((y[i]<0) and (y[i+1]>0)):
-            rslopeindex=i
-            rslope=(y[i+1]-y[i])/(x[i+1]-x[i])
-            
-        elif((y[i]>0) and (y[i+1]<0)):
-            lslopeindex=i
-            lslope=(y[i+1]-y[i])/(x[i+1]-x[i])
-        
+    '''find the slope at the x intercepts
+
+    Returns:
+        tuple: (lslope, rslope, tan) where tan is the list returned by
+            tangent_lines for the centered loop.
+    '''
+    x, y = center(B, np.array(V, dtype=float))
+    lslope, rslope, lindex, rindex = zero_crossings(x, y)
+    return lslope, rslope, tangent_lines(x, y, lindex, rindex, lslope,
+                                         rslope)
+
 
- 
-    lxarray=np.arange(-100,101)
-    lxarray=lxarray.astype(float)
-    lxarray*=np.abs(B[0]-B[1])   
-    lyarray=np.zeros((201))
-    lyarray+=lxarray*lslope  
-    lxarray+=B[lslopeindex]
-    
-    rxarray=np.arange(-100,101)
-    rxarray=rxarray.astype(float)
-    rxarray*=np.abs(B[0]-B[1])   
-    ryarray=np.zeros((201))
-    ryarray+=rxarray*rslope  
-    rxarray+=B[rslopeindex]
-    
-    
-    return lslope, rslope, [lxarray,lyarray,B[lslopeindex],V[lslopeindex],
-                            rxarray,ryarray,B[rslopeindex],V[rslopeindex]]
-                            
 def toggle(plots):
     for plot in plots:
         plot.set_visible(not plot.get_visible())
@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
 
 import re
-import collections
+import threading
+from collections import OrderedDict, namedtuple
 from os.path import basename
 
+import numpy as np
+
+from .prefixmemo import data_digest, key_digest, readonly
+from .profiling import Profile
+
+# One step of a compiled execution plan. params is a private copy of the
+# params passed to Transformer.add() and regex is the compiled filter (None
+# for dict filters).
+Stage = namedtuple('Stage', 'slot func params filter regex')
+
+
 def meets_conditions(conditions_dict, gleaner, x):
     gleaned = gleaner.glean(x)
     for c, v in conditions_dict.items():
@@ -31,15 +43,75 @@ class Transformer(object):
     feature, so all transformation funcs will be passed at 
     least on kwarg no matter what.
 
+    The transformations are compiled into an execution plan (a tuple of
+    Stages, in slot order, with precompiled filters) the first time the
+    Transformer is called, and the stages that apply to each target are
+    memoized, so calling the same Transformer on many targets only resolves
+    the filters once per target. Calls don't modify the Transformer or the
+    params dicts, so one Transformer can be used from several threads.
+    Note that the params are copied when the plan is compiled; changing a
+    params dict after the first call has no effect.
+
+    Profiling is off by default. enable_profiling() makes every stage record
+    its wall time, rows and array sizes into a profiling.Profile.
+
+    With a memo (a prefixmemo.PrefixMemo) the output of every stage is
+    stored, keyed by the input data, the target(s) and the stages up to and
+    including it, and calls start from the longest prefix of their stages
+    that is already in the memo. Changing the params of a late stage then
+    only reruns the stages from that one on. The input data is identified
+    by the key passed with it or, without one, by hashing it. The outputs
+    are kept as read-only views, and a call with a memo returns read-only
+    arrays.
+
+    With inplace=True the input data is copied once into arrays that are
+    kept from call to call, and the stages whose funcs are declared with
+    transformations.inplace_safe then work on those arrays in place, taking
+    any temporary arrays they need from a Scratch that is also kept. Once
+    the arrays exist (after the first call with data of the same shape) a
+    pipeline of such stages allocates next to nothing. Other stages are
+    called as usual and work on the arrays the previous stage returned,
+    which must then be new arrays or views of the arrays they were given.
+    The arrays returned by a call in this mode are reused by the next call
+    of the same Transformer in the same thread: copy them if they have to
+    outlive it. With a memo there is no such reuse: every column an
+    in-place stage is given is read-only (the input, or the stored output
+    of the stage before), so the stage works on a copy of it, and only the
+    stages that write make copies.
+
     Args:
         gleaner: object that provides a glean() method. Needed if you want to
             used gleaner conditions instead of a regex for the filter parameter
             in Transformer.add()
+        cache_size: number of targets whose active stages are remembered.
+        memo: PrefixMemo to store the output of every stage in, or None.
+        inplace: whether to run the stages in place, see above.
     """
 
-    def __init__(self, gleaner=None):
+    def __init__(self, gleaner=None, cache_size=4096, memo=None,
+                 inplace=False):
         self._transformations = {}
         self.gleaner = gleaner
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._plan = None
+        self._active = OrderedDict()
+        self.profile = None
+        self.name = None
+        self.memo = memo
+        self.inplace = inplace
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock'], state['_local']
+        state['_plan'], state['_active'] = None, OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._local = threading.local()
 
     def add(self, slot, func, params={}, filter='.*'):
         """Add a transformation that data will be pipelined through.
@@ -56,48 +128,310 @@ class Transformer(object):
         if not isinstance(slot, int):
             msg = 'slot must be integer not {}'.format(type(slot))
             raise ValueError(msg)
-        if not isinstance(func, collections.Callable):
+        if not callable(func):
             msg = 'func must be callable, got type {}'.format(type(func))
             raise ValueError(msg)
         if isinstance(filter, dict) and self.gleaner is None:
             raise ValueError('Cannot pass dict as filter unless using gleaner')
-        if slot not in list(self._transformations.keys()):
-            self._transformations[slot] = (func, params, filter)
-        else:
+        if slot in self._transformations:
             msg = "Tried to assign a second transformation to slot {}"
             raise ValueError(msg.format(slot))
+        if isinstance(filter, str):
+            re.compile(filter)
+        with self._lock:
+            self._transformations[slot] = (func, params, filter)
+            self._plan = None
+            self._active.clear()
+
+    def enable_profiling(self, profile=None, name=None):
+        """Record every stage applied from now on into a Profile.
+
+        The steps are named '<name>/<slot> <func name>'.
 
-    def __call__(self, datacols, target):
+        Args:
+            profile: profiling.Profile to record into. A new one is made if
+                None. Several Transformers may share one.
+            name: name of this Transformer in the step names.
+
+        Returns:
+            profiling.Profile
+        """
+        if profile is None:
+            profile = Profile()
+        self.profile = profile
+        self.name = name
+        return profile
+
+    def disable_profiling(self):
+        self.profile = None
+
+    def plan(self):
+        """Return the execution plan: a tuple of Stages in slot order."""
+        plan = self._plan
+        if plan is None:
+            with self._lock:
+                stages = []
+                for slot in sorted(self._transformations):
+                    func, params, filter = self._transformations[slot]
+                    regex = None
+                    if isinstance(filter, str):
+                        regex = re.compile(filter)
+                    stages.append(
+                        Stage(slot, func, dict(params), filter, regex))
+                plan = self._plan = tuple(stages)
+        return plan
+
+    def fingerprint(self):
+        """Return a string that identifies the plan: the slot, function,
+        params and filter of every stage. Transformers with equal
+        fingerprints transform data the same way, as long as the code of
+        their functions is the same.
+        """
+        return '\n'.join(self._stage_fingerprint(st) for st in self.plan())
+
+    def stages_for(self, target):
+        """Return the Stages of the plan that apply to target, in order."""
+        target = _target_path(target)
+        with self._lock:
+            stages = self._active.get(target)
+            if stages is not None:
+                self._active.move_to_end(target)
+                return stages
+        stages = tuple(st for st in self.plan() if self._applies(st, target))
+        with self._lock:
+            self._active[target] = stages
+            if len(self._active) > self.cache_size:
+                self._active.popitem(last=False)
+        return stages
+
+    def __call__(self, datacols, target, key=None):
         """Apply the transformations to the x, y data and
         return the result
+
+        key is a string that identifies the data for the memo, see
+        call_stack.
         """ 
-        # Need to get the path if target is a batchplotlib3.Target,
-        # otherwise it should be a string path already.
-        try:
-            target = target.path
-        except AttributeError:
-            pass
-        # Sort _transformations based on slot number from low to high
+        target = _target_path(target)
         # self.log.info('Transforming '+basename(target))
-        sorted_keys = sorted(self._transformations)
-        funcs, params_list = [], []
-        for key in sorted_keys:
-            func, params, filter = self._transformations[key]
-            string_match = isinstance(filter, str) and re.match(filter, target)
-            dict_match = (isinstance(filter, dict) and 
-                meets_conditions(filter, self.gleaner, target))
-            if string_match or dict_match:
-                # self.log.info('    Applying' + func.__name__)
-                funcs.append(func)
-                params.update(dict(target=target))
-                params_list.append(params)
-        # Apply the transformations in order to the data        
-        return self._pipeline(datacols, params_list, funcs)
-
-    def _pipeline(self, datacols, params_list, funcs):
-        """Take xy data and apply each func in funcs to the data
-        in order."""
-        for func, params in zip(funcs, params_list):
-            datacols = func(*datacols, **params)
+        steps = [(st, None) for st in self.stages_for(target)]
+        return self._run(steps, datacols, [target], stacked=False, key=key)
+
+    def call_stack(self, datacols, targets, key=None):
+        """Apply the transformations to stacks of data, one row per target,
+        and return the result.
+
+        Each transformation is called once with the rows of every target its
+        filter matches, so the transformation funcs must work row-wise on
+        2-D arrays (see transformations.py). If a filter matches only some
+        of the rows, the func must return arrays of the same shape as it was
+        given so the result can be put back in place. Instead of the target
+        kwarg, funcs are passed the list of matching targets as targets.
+
+        Args:
+            datacols: sequence of (n_targets, n_points) arrays.
+            targets: sequence of n_targets targets (file paths).
+            key: string that identifies datacols for the memo (e.g. the
+                rawcache.file_key of the files they were read from), so
+                that they don't have to be hashed. Calls with the same key
+                must pass the same data. Not needed without a memo.
+        """
+        targets = [_target_path(t) for t in targets]
+        active = [set(st.slot for st in self.stages_for(t)) for t in targets]
+        steps = []
+        for st in self.plan():
+            rows = np.array([st.slot in slots for slots in active], dtype=bool)
+            if rows.any():
+                steps.append((st, None if rows.all() else rows))
+        return self._run(steps, tuple(datacols), targets, stacked=True,
+                         key=key)
+
+    def _run(self, steps, datacols, targets, stacked, key=None):
+        """Apply steps, a list of (Stage, rows it applies to or None for
+        all), to datacols. With a memo, start from the output of the longest
+        prefix of steps found in it and store the outputs of the rest.
+        """
+        memo = self.memo
+        if memo is None:
+            if self.inplace:
+                datacols = self._copy_in(datacols)
+            for st, rows in steps:
+                datacols = self._apply(st, datacols, rows, targets, stacked)
+            return datacols
+        keys = self._prefix_keys(steps, datacols, targets, key)
+        start = 0
+        for i in range(len(steps), 0, -1):
+            cols = memo.get(keys[i - 1])
+            if cols is not None:
+                datacols, start = cols, i
+                break
+        if start == 0:
+            # Read-only like the outputs, so the in-place stages copy it
+            # rather than change the caller's arrays.
+            datacols = tuple(readonly(c) for c in datacols)
+        for i in range(start, len(steps)):
+            st, rows = steps[i]
+            datacols = self._apply(st, datacols, rows, targets, stacked)
+            # The stored views are passed on, so the next stage copies
+            # what it changes.
+            datacols = memo.put(keys[i], datacols)
         return datacols
 
+    def _prefix_keys(self, steps, datacols, targets, key=None):
+        """Memo keys of the outputs of each prefix of steps."""
+        if key is None:
+            h = data_digest(datacols, targets)
+        else:
+            h = key_digest(key, targets)
+        keys = []
+        for st, rows in steps:
+            h.update(self._stage_fingerprint(st).encode('utf-8'))
+            if rows is not None:
+                h.update(np.packbits(rows).tobytes())
+            keys.append(h.hexdigest())
+        return keys
+
+    @property
+    def scratch(self):
+        """The Scratch of the calling thread, for the in-place mode."""
+        scratch = getattr(self._local, 'scratch', None)
+        if scratch is None:
+            scratch = self._local.scratch = Scratch()
+        return scratch
+
+    def _copy_in(self, datacols):
+        """Copy datacols into the input arrays of the in-place mode, as
+        floats so that the stages can scale them in place.
+        """
+        scratch = self.scratch
+        out = []
+        for i, c in enumerate(datacols):
+            c = np.asarray(c)
+            buf = scratch.get(('input', i), c.shape, np.result_type(c, 1.0))
+            np.copyto(buf, c)
+            out.append(buf)
+        return tuple(out)
+
+    def _inplace_kwargs(self, st, datacols):
+        """Extra kwargs for stage st in the in-place mode, and datacols with
+        the columns it must not write to (read-only, or overlapping another
+        column) replaced by copies, as floats like in _copy_in.
+        """
+        if not (self.inplace and getattr(st.func, 'inplace_safe', False)):
+            return {}, datacols
+        cols = []
+        for c in datacols:
+            if (not c.flags.writeable or
+                    any(np.may_share_memory(c, o) for o in cols)):
+                c = np.array(c, dtype=np.result_type(c, 1.0))
+            cols.append(c)
+        return {'inplace': True, 'scratch': self.scratch}, tuple(cols)
+
+    def _apply(self, st, datacols, rows, targets, stacked):
+        """Apply one stage to datacols, see __call__ and call_stack."""
+        profile = self.profile
+        if not stacked:
+            # self.log.info('    Applying' + st.func.__name__)
+            extra, datacols = self._inplace_kwargs(st, datacols)
+            kwargs = dict(st.params, target=targets[0], **extra)
+            if profile is None:
+                return st.func(*datacols, **kwargs)
+            return profile.call(self._step(st), st.func, datacols, kwargs)
+        if rows is None:
+            extra, datacols = self._inplace_kwargs(st, datacols)
+            kwargs = dict(st.params, targets=targets, **extra)
+            if profile is None:
+                return st.func(*datacols, **kwargs)
+            return profile.call(self._step(st), st.func, datacols, kwargs,
+                                rows=len(targets))
+        selected = [t for t, r in zip(targets, rows) if r]
+        # Fancy indexing copies, so the subset can be changed in place.
+        subset = [np.broadcast_to(c, datacols[-1].shape)[rows]
+                  for c in datacols]
+        extra, subset = self._inplace_kwargs(st, subset)
+        kwargs = dict(st.params, targets=selected, **extra)
+        if profile is None:
+            out = st.func(*subset, **kwargs)
+        else:
+            out = profile.call(self._step(st), st.func, subset, kwargs,
+                               rows=len(selected))
+        merged = []
+        for c, o in zip(datacols, out):
+            if not (self.inplace and c.shape == datacols[-1].shape and
+                    c.flags.writeable):
+                c = np.array(np.broadcast_to(c, datacols[-1].shape))
+            if c[rows].shape != np.shape(o):
+                msg = ('{} changed the shape of a subset of rows, '
+                       'cannot merge it back into the stack')
+                raise ValueError(msg.format(st.func.__name__))
+            c[rows] = o
+            merged.append(c)
+        return tuple(merged)
+
+    def _stage_fingerprint(self, stage):
+        return '{} {}.{} {} {}'.format(
+            stage.slot, stage.func.__module__,
+            getattr(stage.func, '__qualname__', stage.func.__name__),
+            _sorted_repr(stage.params), _sorted_repr(stage.filter))
+
+    def _step(self, stage):
+        """Name of stage in the profile."""
+        return '{}/{} {}'.format(self.name or 'transformer', stage.slot,
+                                 getattr(stage.func, '__name__', stage.func))
+
+    def _applies(self, stage, target):
+        """Whether stage applies to target."""
+        if stage.regex is not None:
+            return bool(stage.regex.match(target))
+        if isinstance(stage.filter, dict):
+            return meets_conditions(stage.filter, self.gleaner, target)
+        return False
+
+
+class Scratch(object):
+    """Arrays kept from call to call to work in, see Transformer(inplace=True).
+
+    An array is only reallocated when it is asked for with another shape or
+    dtype than the last time, so a pipeline run over many loops of the same
+    length reuses the same few arrays.
+    """
+
+    def __init__(self):
+        self._arrays = {}
+
+    def get(self, key, shape, dtype):
+        """The array kept under key, with the given shape and dtype. Its
+        contents are whatever was last written to it.
+        """
+        a = self._arrays.get(key)
+        if a is None or a.shape != tuple(shape) or a.dtype != dtype:
+            a = self._arrays[key] = np.empty(shape, dtype)
+        return a
+
+    def like(self, a, key='tmp'):
+        """A temporary array with the shape and dtype of a, to be used only
+        until the transformation that asked for it returns. There is one
+        per key, shape and dtype, so a transformation that needs two of
+        the same shape at once must pass different keys.
+        """
+        a = np.asarray(a)
+        return self.get((key, a.shape, a.dtype.str), a.shape, a.dtype)
+
+    def nbytes(self):
+        return sum(a.nbytes for a in self._arrays.values())
+
+
+def _sorted_repr(obj):
+    """repr of obj that doesn't depend on the order of dict keys."""
+    if isinstance(obj, dict):
+        return '{' + ', '.join('{!r}: {}'.format(k, _sorted_repr(obj[k]))
+                               for k in sorted(obj)) + '}'
+    return repr(obj)
+
+
+def _target_path(target):
+    # Need to get the path if target is a batchplotlib3.Target,
+    # otherwise it should be a string path already.
+    try:
+        return target.path
+    except AttributeError:
+        return target
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Incremental analysis of a scan directory while it is being acquired."""
+import multiprocessing
+import os
+import time
+from os.path import exists, join
+
+import numpy as np
+
+from .engine import PixelAnalyzer, ScanResult, default_ps, scan_gleaner
+from .lvxml2dict import Cluster
+
+
+class ScanWatcher(object):
+    """Analyze the averaged loop files of a scan as they appear.
+
+    Every call to poll() lists the scan directory and analyzes the averaged
+    files that are new or have changed since they were last analyzed. A file
+    is only picked up once its size and modification time are the same on
+    two consecutive polls, so files that are still being written are left
+    for a later poll.
+
+    The results go into result (a ScanResult) and the Hc and Mrem grids,
+    which are updated in place one pixel at a time.
+
+    Args:
+        root_path: the scan directory.
+        user_ps: dict of parameters that override default_ps.
+        workers: number of worker processes used for each batch of new
+            files. With workers=1 (default) they run in the calling process.
+        cache: RawCache to read the loop files through, or None.
+        results: ResultCache of per-pixel results, or None.
+
+    Attributes:
+        result: ScanResult with the pixels analyzed so far, or None until
+            parameters.xml has been written.
+        Hcs: (gy, gx, 3) array of Hc triplets, zero for missing pixels.
+        Mrs: (gy, gx, 3) array of Mrem/Msat triplets.
+    """
+
+    def __init__(self, root_path, user_ps={}, workers=1, cache=None,
+                 results=None):
+        self.root_path = root_path
+        self.ps = dict(default_ps)
+        self.ps.update(user_ps)
+        self.workers = workers
+        self.gleaner = scan_gleaner()
+        self.analyzer = PixelAnalyzer(self.ps, keep_loops=False, cache=cache,
+                                      results=results)
+        self.result = None
+        self.Hcs = self.Mrs = None
+        self._done = {}
+        self._last_seen = {}
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Shut down the worker pool, if one was started."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def complete(self):
+        """Whether every pixel of the scan has been analyzed."""
+        if self.result is None:
+            return False
+        gy, gx = self.result.shape
+        return len(self.result) == gx * gy
+
+    def poll(self):
+        """Analyze the averaged files that are new or changed and settled.
+
+        Returns:
+            list: (x, y) of the pixels that were updated.
+        """
+        if self.result is None and not self._start():
+            return []
+        ready = []
+        for f in sorted(os.listdir(self.root_path)):
+            if not self.gleaner.glean(f)['averaged']:
+                continue
+            try:
+                st = os.stat(join(self.root_path, f))
+            except OSError:
+                continue
+            sig = (st.st_size, st.st_mtime_ns)
+            if self._done.get(f) == sig:
+                continue
+            if self._last_seen.get(f) == sig:
+                ready.append(f)
+            self._last_seen[f] = sig
+        updated = []
+        for pixel in self._analyze([join(self.root_path, f) for f in ready]):
+            self._update(pixel)
+            updated.append((pixel['x'], pixel['y']))
+        for f in ready:
+            self._done[f] = self._last_seen[f]
+        return updated
+
+    def watch(self, interval=2.0, callback=None, timeout=None,
+              until_complete=True):
+        """Poll the scan directory every interval seconds.
+
+        Args:
+            interval: seconds between polls.
+            callback: called as callback(watcher, updated) after every poll
+                that updated at least one pixel.
+            timeout: stop after this many seconds. None means no limit.
+            until_complete: stop once every pixel has been analyzed.
+
+        Returns:
+            ScanResult
+        """
+        start = time.time()
+        while True:
+            updated = self.poll()
+            if updated and callback is not None:
+                callback(self, updated)
+            if until_complete and self.complete():
+                break
+            if timeout is not None and time.time() - start > timeout:
+                break
+            time.sleep(interval)
+        return self.result
+
+    def _start(self):
+        """Set up the result and grids once parameters.xml exists."""
+        params_path = join(self.root_path, 'parameters.xml')
+        if not exists(params_path):
+            return False
+        clust = Cluster(params_path).to_dict()
+        gx, gy = (clust['Rows'], clust['Cols'])
+        self.result = ScanResult((gy, gx), clust, self.ps)
+        self.Hcs = np.zeros((gy, gx, 3))
+        self.Mrs = np.zeros((gy, gx, 3))
+        return True
+
+    def _analyze(self, paths):
+        if not paths:
+            return []
+        if self.workers == 1 or len(paths) == 1:
+            return self.analyzer.batch(paths)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+        n = -(-len(paths) // self.workers)
+        chunks = [paths[i:i + n] for i in range(0, len(paths), n)]
+        return [pixel for pixels in self._pool.map(self.analyzer.batch, chunks)
+                for pixel in pixels]
+
+    def _update(self, pixel):
+        x, y = pixel['x'], pixel['y']
+        self.result.add(pixel)
+        self.Hcs[y, x] = pixel['Hc']
+        self.Mrs[y, x] = pixel['Mr']
@@ -9,9 +9,15 @@ setup(name='scmoplot',
       author_email='julian.irwin@gmail.com',
       url='https://github.com/UW-Physics-Rzchlab/scmoplot',
       license='MIT',
-      packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
+      packages=find_packages(exclude=['ez_setup', 'examples', 'tests',
+                                      'benchmarks']),
       include_package_data=True,
       zip_safe=False,
       install_requires=[],
-      setup_requires=[]
+      setup_requires=[],
+      entry_points={
+          'console_scripts': [
+              'scmoplot-batch = scmoplot.cli:main',
+          ],
+      },
       )
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from benchmarks.synthetic import make_scan
+
+
+@pytest.fixture(scope='session')
+def scan_dir(tmp_path_factory):
+    """A small synthetic scan: 4 x 3 pixels of averaged loops with Hc from
+    20 to 40 (2 to 4 after the pipelines scale the field).
+    """
+    root = tmp_path_factory.mktemp('scan')
+    make_scan(str(root), gx=4, gy=3, n_points=2000, seed=0)
+    return str(root)
+
+
+@pytest.fixture
+def scan_copy(tmp_path):
+    """A scan like scan_dir, in a directory of its own that tests may
+    change.
+    """
+    make_scan(str(tmp_path), gx=4, gy=3, n_points=1000, seed=1)
+    return str(tmp_path)
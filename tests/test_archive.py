@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+from scmoplot.archive import ScanArchive, archive_path, save_archive
+from scmoplot.batch import map_arrays
+from scmoplot.engine import analyze
+
+
+def assert_pixel_equal(read, pixel):
+    assert sorted(read) == sorted(pixel)
+    for k, v in pixel.items():
+        if k in ('loop', 'loop2'):
+            for a, b in zip(read[k], np.broadcast_arrays(*v)):
+                np.testing.assert_array_equal(a, b)
+        elif k in ('Hc', 'Mr'):
+            np.testing.assert_array_equal(read[k], v)
+        else:
+            # Floats survive JSON exactly.
+            assert read[k] == v, k
+
+
+@pytest.fixture(params=[None, 300], ids=['samples', 'resampled'])
+def archived(request, scan_copy, tmp_path_factory):
+    # One pixel that fails, stored with its error and without loops.
+    bad = os.path.join(scan_copy, 'scan=0x=3y=2averaged')
+    os.remove(bad)
+    os.symlink(bad + '.missing', bad)
+    result = analyze(scan_copy, {'resample': request.param}, workers=1)
+    path = archive_path(scan_copy, str(tmp_path_factory.mktemp('out')))
+    save_archive(result, path)
+    return result, path
+
+
+def test_pixel_round_trip(archived):
+    result, path = archived
+    assert list(result.errors()) == [(3, 2)]
+    with ScanArchive(path) as archive:
+        assert archive.shape == result.shape == (3, 4)
+        assert archive.ps == result.ps
+        assert len(archive) == len(result) == 12
+        for xy in result:
+            read = archive.pixel(*xy)
+            assert_pixel_equal(read, result[xy])
+            if xy != (3, 2):
+                B, V = archive.loop(*xy)
+                np.testing.assert_array_equal(B, result[xy]['loop'][0])
+                np.testing.assert_array_equal(V, result[xy]['loop'][1])
+        assert 'loop' not in archive.pixel(3, 2)
+        assert archive.pixel(3, 2)['error'] == result[3, 2]['error']
+        with pytest.raises(KeyError):
+            archive.loop(3, 2)
+        assert 'loop' not in archive.pixel(0, 0, loops=False)
+
+
+def test_maps_round_trip(archived):
+    result, path = archived
+    with ScanArchive(path) as archive:
+        arrays = map_arrays(result)
+        assert archive.maps() == sorted(arrays)
+        for name, a in arrays.items():
+            np.testing.assert_array_equal(archive.map(name), a)
+        back = archive.to_result()
+    assert back.shape == result.shape
+    for xy in result:
+        assert_pixel_equal(back[xy], result[xy])
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_scan
+from scmoplot import engine
+from scmoplot.batch import export_maps
+from scmoplot.campaign import Checkpoint, checkpoint_path, run_campaign
+
+
+class Killed(BaseException):
+    """Stands in for Ctrl-C or the process being killed."""
+
+
+@pytest.fixture
+def campaign(tmp_path):
+    make_scan(str(tmp_path / 'w1' / 's1'), 4, 3, 600, Hc=(8., 16.))
+    make_scan(str(tmp_path / 'w1' / 's2'), 3, 3, 600, Hc=(8., 16.), seed=1)
+    return str(tmp_path / 'w*' / '*'), str(tmp_path / 'out')
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """List of the number of pixels of every chunk analyzed. The run is
+    killed when the list is as long as analyze_chunk.kill_after.
+    """
+    calls = []
+    original = engine.PixelAnalyzer.analyze_chunk
+
+    def analyze_chunk(self, chunk):
+        if len(calls) == analyze_chunk.kill_after:
+            raise Killed()
+        calls.append(len(chunk.todo))
+        return original(self, chunk)
+    analyze_chunk.kill_after = None
+    monkeypatch.setattr(engine.PixelAnalyzer, 'analyze_chunk', analyze_chunk)
+    return calls, analyze_chunk
+
+
+def test_resume_after_kill(campaign, analyzed, tmp_path):
+    scans, out = campaign
+    calls, analyze_chunk = analyzed
+    # Killed once the 3 chunks of s1 (12 pixels) are done; s2 has 9.
+    analyze_chunk.kill_after = 3
+    with pytest.raises(Killed):
+        run_campaign([scans], out, workers=1, chunksize=4, prefetch=0)
+    assert sum(calls) == 12
+    ckpt = Checkpoint(checkpoint_path(out))
+    assert sum(len(p) for p in ckpt.pixels.values()) == 12
+    assert len(ckpt.maps) == 1
+    # A line cut short by the kill is ignored.
+    with open(checkpoint_path(out), 'a') as f:
+        f.write('{"scan": "cut sh')
+
+    del calls[:]
+    analyze_chunk.kill_after = None
+    summary = run_campaign([scans], out, workers=1, chunksize=4)
+    assert sum(calls) == 9
+    assert summary.failed_scans() == [] and summary.n_failures() == 0
+    for name in ('s1', 's2'):
+        ref = str(tmp_path / '{}_ref.npz'.format(name))
+        export_maps(str(tmp_path / 'w1' / name), ref, workers=1)
+        with np.load(os.path.join(out, '{}_maps.npz'.format(name))) as m, \
+                np.load(ref) as r:
+            np.testing.assert_array_equal(m['Hcs'], r['Hcs'])
+            np.testing.assert_array_equal(m['Mrs'], r['Mrs'])
+
+    # Everything is done now.
+    del calls[:]
+    run_campaign([scans], out, workers=1, chunksize=4)
+    assert sum(calls) == 0
+
+
+def test_retry_failed(campaign, analyzed, tmp_path):
+    scans, out = campaign
+    calls, _ = analyzed
+    bad = engine.scan_files(str(tmp_path / 'w1' / 's2'))[0]
+    with open(bad) as f:
+        good = f.read()
+    with open(bad, 'w') as f:
+        f.write('garbage\n')
+    with pytest.warns(UserWarning):
+        summary = run_campaign([scans], out, workers=1)
+    assert summary.n_failures() == 1
+    with open(bad, 'w') as f:
+        f.write(good)
+    del calls[:]
+    summary = run_campaign([scans], out, workers=1, retry_failed=True)
+    assert sum(calls) == 1
+    assert summary.n_failures() == 0
+
+
+def test_other_parameters_do_not_resume(campaign):
+    scans, out = campaign
+    run_campaign([scans], out, workers=1)
+    with pytest.raises(ValueError):
+        run_campaign([scans], out, {'thresh': 6}, workers=1)
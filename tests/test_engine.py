@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from scmoplot import transformations as tfms
+from scmoplot.engine import PixelAnalyzer, analyze, default_ps, scan_files
+from scmoplot.loading import load_loop
+
+# Spacing of the scaled field samples around B = 0 in the synthetic loops:
+# 2 pi * 10 / 2000. The sample based Hc_of is only good to about that.
+FIELD_STEP = 0.032
+
+
+def _quiet(func, *args, **kwargs):
+    # Hc_of prints its results.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def test_analyze_matches_per_loop_Hc_Mrem(scan_dir):
+    result = analyze(scan_dir, workers=1, keep_loops=False)
+    assert not result.errors()
+    analyzer = PixelAnalyzer(default_ps, keep_loops=False)
+    fit_int = (default_ps['thresh'], default_ps['max'])
+    for path in scan_files(scan_dir):
+        B, V = analyzer.tfmr(load_loop(path), path)
+        Hc = _quiet(tfms.Hc_of, B, V, fit_int=fit_int)
+        Mr = _quiet(tfms.Mrem_of, B, V, fit_int=fit_int)
+        gleaned = analyzer.gleaner.glean(path)
+        x, y = int(gleaned['x']), int(gleaned['y'])
+        np.testing.assert_allclose(result.Hcs[y, x], Hc, atol=FIELD_STEP)
+        np.testing.assert_allclose(result.Mrs[y, x], Mr, atol=5e-3)
+
+
+def test_Hc_map_follows_scan(tmp_path):
+    from benchmarks.synthetic import make_scan
+    Hcs = make_scan(str(tmp_path), gx=3, gy=2, n_points=2000, noise=0.01)
+    result = analyze(str(tmp_path), workers=1, keep_loops=False)
+    assert result.shape == (2, 3)
+    np.testing.assert_allclose(result.Hcs[..., 1], 0.1 * Hcs,
+                               atol=FIELD_STEP)
+
+
+def test_workers_agree(scan_dir):
+    one = analyze(scan_dir, workers=1, chunksize=5)
+    two = analyze(scan_dir, workers=2, chunksize=5)
+    np.testing.assert_array_equal(one.Hcs, two.Hcs)
+    np.testing.assert_array_equal(one.Mrs, two.Mrs)
+    np.testing.assert_array_equal(one.grid('area'), two.grid('area'))
+
+
+def test_batch_matches_single_loops(scan_dir):
+    analyzer = PixelAnalyzer(default_ps)
+    paths = scan_files(scan_dir)
+    single = [_quiet(analyzer, p) for p in paths]
+    batched = analyzer.batch(paths)
+    for s, b in zip(single, batched):
+        assert s['path'] == b['path'] and b['error'] is None
+        for k in ('Hc', 'Mr', 'area', 'lslope', 'rslope', 'lsat', 'rsat',
+                  'loop', 'loop2'):
+            np.testing.assert_allclose(s[k], b[k], rtol=1e-6, atol=1e-9)
+
+
+@pytest.mark.filterwarnings('ignore:loadtxt')
+def test_bad_file_only_fails_its_pixel(scan_copy):
+    paths = scan_files(scan_copy)
+    with open(paths[0], 'w') as f:
+        f.write('garbage\n')
+    result = analyze(scan_copy, workers=1)
+    errors = result.errors()
+    assert len(errors) == 1
+    assert len(result) == len(paths)
+
+
+def test_resample(scan_dir):
+    from scmoplot.engine import make_transformers
+    ps = dict(default_ps, resample=300)
+    tfmr, tfmr2 = make_transformers(ps)
+    # Resampling comes after the saturation corrections and filters.
+    for t in (tfmr, tfmr2):
+        assert t.plan()[-1].func is tfms.resample_branches
+    plain = analyze(scan_dir, workers=1, keep_loops=False)
+    result = analyze(scan_dir, ps, workers=1, keep_loops=True)
+    assert not result.errors()
+    np.testing.assert_allclose(result.Hcs[..., 1], plain.Hcs[..., 1],
+                               atol=FIELD_STEP)
+    np.testing.assert_allclose(result.Mrs[..., 1], plain.Mrs[..., 1],
+                               atol=5e-3)
+    assert result[0, 0]['loop'][0].shape == (598,)
+
+
+@pytest.fixture(scope='session')
+def scans_dir(tmp_path_factory):
+    """A scan with 4 individual scans per pixel besides the averaged
+    files, whose noise matches the standard error of the scans.
+    """
+    from benchmarks.synthetic import make_scan
+    root = tmp_path_factory.mktemp('scans')
+    make_scan(str(root), gx=3, gy=2, n_points=2000, n_scans=4, seed=2)
+    return str(root)
+
+
+def _half_width(triplets):
+    return np.mean((triplets[..., 2] - triplets[..., 0]) / 2)
+
+
+@pytest.mark.filterwarnings('error')
+@pytest.mark.parametrize('extra', [{}, {'filt_ks': 31}, {'resample': 500}])
+def test_aggregate_uncertainties(scans_dir, extra):
+    ps = dict(default_ps, **extra)
+    # The sigma_y of the averaged files, without resampling.
+    plain = analyze(scans_dir, dict(ps, resample=None), workers=1)
+    agg = analyze(scans_dir, ps, workers=1, aggregate=True)
+    for k in ('Hcs', 'Mrs'):
+        ratio = (_half_width(getattr(agg, k)) /
+                 _half_width(getattr(plain, k)))
+        assert 0.7 < ratio < 1.4, (k, ratio)
+
+
+def test_median_noise_gain():
+    rng = np.random.default_rng(0)
+    noise = rng.normal(size=(20, 2000))
+    for ks in (1, 3, 31, 157):
+        filtered = tfms.running_median(noise, ks)
+        assert abs(filtered.std() / tfms.median_noise_gain(ks) - 1) < 0.1
+
+
+def test_mismatched_noise_warns():
+    analyzer = PixelAnalyzer(default_ps)
+    x = np.linspace(-10, 10, 50)
+    with pytest.warns(UserWarning, match='sigma_y'):
+        assert analyzer._noise(x, x, x, x, np.ones(40)) is None
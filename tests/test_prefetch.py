@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from scmoplot.prefetch import Prefetcher, format_stats
+
+
+class Reader(object):
+    """read function that records how far ahead of the caller it runs."""
+
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+        self.started = []
+        self.taken = 0
+        self.running = self.max_running = self.max_ahead = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, item):
+        with self._lock:
+            self.started.append(item)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            # Reads started but not yet taken by the caller.
+            self.max_ahead = max(self.max_ahead,
+                                 len(self.started) - self.taken)
+        time.sleep(self.seconds)
+        with self._lock:
+            self.running -= 1
+        if item == 'bad':
+            raise IOError('cannot read {}'.format(item))
+        return item * 10
+
+
+@pytest.mark.parametrize('depth, threads', [(1, None), (2, None), (3, 1),
+                                            (4, 4)])
+def test_reads_ahead_at_most_depth(depth, threads):
+    reader = Reader(0.005)
+    prefetcher = Prefetcher(range(20), reader, depth=depth, threads=threads)
+    out = []
+    for value in prefetcher:
+        with reader._lock:
+            reader.taken += 1
+        out.append(value)
+        time.sleep(0.002)
+    assert out == [i * 10 for i in range(20)]
+    assert reader.started == list(range(20))
+    # The value being used plus depth read ahead of it.
+    assert reader.max_ahead <= depth + 1
+    assert reader.max_running <= min(threads or depth, depth)
+    assert prefetcher.count == 20
+
+
+def test_stops_reading_when_the_caller_stops():
+    reader = Reader()
+    prefetcher = Prefetcher(range(100), reader, depth=3)
+    for value in prefetcher:
+        if value == 40:
+            break
+    # Items 0 to 4 taken, at most 3 read ahead.
+    assert len(reader.started) <= 5 + 3
+    assert prefetcher.count == 4
+
+
+def test_errors_raised_in_order():
+    reader = Reader()
+    out = []
+    with pytest.raises(IOError):
+        for value in Prefetcher([1, 2, 'bad', 4], reader, depth=2):
+            out.append(value)
+    assert out == [10, 20]
+
+
+def test_depth_must_be_positive():
+    with pytest.raises(ValueError):
+        Prefetcher([], Reader(), depth=0)
+
+
+def test_stats_compute_bound():
+    # Each read (0.01 s) is shorter than the computation on the previous
+    # item (0.03 s), so all but the first read are hidden.
+    prefetcher = Prefetcher(range(10), Reader(0.01), depth=2)
+    for value in prefetcher:
+        time.sleep(0.03)
+    stats = prefetcher.stats()
+    assert list(stats) == ['items', 'read_seconds', 'wait_seconds',
+                           'compute_seconds', 'overlap']
+    assert stats['items'] == 10
+    assert stats['read_seconds'] >= 10 * 0.01
+    assert stats['compute_seconds'] >= 10 * 0.03
+    assert stats['wait_seconds'] < stats['read_seconds']
+    assert stats['overlap'] > 0.5
+    line = format_stats(stats)
+    assert line.endswith('10 chunks')
+    assert '{:.0f}% hidden'.format(100 * stats['overlap']) in line
+
+
+def test_stats_read_bound():
+    # One reader thread and no computation: the iteration waits for every
+    # read, so almost none of it is hidden.
+    prefetcher = Prefetcher(range(5), Reader(0.02), depth=1)
+    assert list(prefetcher) == [0, 10, 20, 30, 40]
+    stats = prefetcher.stats()
+    assert stats['items'] == 5
+    assert stats['wait_seconds'] <= stats['read_seconds'] + 0.01
+    assert stats['overlap'] < 0.5
+
+
+def test_stats_before_iterating():
+    stats = Prefetcher(range(3), Reader()).stats()
+    assert stats['items'] == 0 and stats['overlap'] == 0.0
+
+
+def test_analyze_io_stats(scan_dir):
+    from scmoplot.engine import analyze
+    result = analyze(scan_dir, workers=1, chunksize=5, keep_loops=False,
+                     prefetch=2)
+    # 12 files in chunks of 5.
+    assert result.io_stats['items'] == 3
+    assert not result.errors()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from scmoplot import transformer
+from scmoplot import transformations as tfms
+from scmoplot.engine import PixelAnalyzer, default_ps, scan_files
+from scmoplot.loopstack import LoopStack
+from scmoplot.prefixmemo import PrefixMemo
+
+
+def make_tfmr(memo, thresh=7, inplace=False):
+    tfmr = transformer.Transformer(memo=memo, inplace=inplace)
+    tfmr.add(10, tfms.scale, {'xsc': 0.1})
+    tfmr.add(20, tfms.flatten_saturation, {'threshold': thresh})
+    tfmr.add(30, tfms.wrapped_medfilt, {'ks': 31})
+    tfmr.add(40, tfms.saturation_normalize, {'thresh': thresh})
+    return tfmr
+
+
+@pytest.fixture
+def stack(scan_dir):
+    paths = scan_files(scan_dir)
+    return LoopStack.from_files(paths), paths
+
+
+def test_get_returns_read_only_views():
+    memo = PrefixMemo()
+    a = np.arange(4.0)
+    memo.put('k', (a,))
+    got, = memo.get('k')
+    again, = memo.get('k')
+    assert not got.flags.writeable
+    assert np.shares_memory(got, again)
+    assert a.flags.writeable
+    assert memo.get('other') is None
+    assert (memo.hits, memo.misses) == (2, 1)
+
+
+
+def test_counts_from_threads(tmp_path):
+    import threading
+    for i in range(0, 20, 2):
+        PrefixMemo(spill_dir=str(tmp_path)).put('k{}'.format(i),
+                                                (np.arange(3.0),))
+    # Every even key is a hit, the first get of each from spill_dir.
+    memo = PrefixMemo(spill_dir=str(tmp_path))
+    n_threads, n_gets = 8, 400
+
+    def work():
+        for i in range(n_gets):
+            memo.get('k{}'.format(i % 20))
+    threads = [threading.Thread(target=work) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert memo.hits == memo.misses == n_threads * n_gets // 2
+
+
+@pytest.mark.parametrize('inplace', [False, True])
+def test_prefix_reuse(stack, inplace):
+    (s, paths), memo = stack, PrefixMemo()
+    x0, y0 = s.x.copy(), s.y.copy()
+    plain = make_tfmr(None, 6).call_stack((s.x, s.y), paths)
+    make_tfmr(memo, 7, inplace).call_stack((s.x, s.y), paths, key='scan')
+    hits = memo.hits
+    # Only the stages from flatten_saturation on differ.
+    tfmr = make_tfmr(memo, 6, inplace)
+    for _ in range(2):
+        out = tfmr.call_stack((s.x, s.y), paths, key='scan')
+        for o, p in zip(out, plain):
+            assert not o.flags.writeable
+            np.testing.assert_array_equal(o, p)
+    assert memo.hits == hits + 2
+    np.testing.assert_array_equal(s.x, x0)
+    np.testing.assert_array_equal(s.y, y0)
+
+
+def test_key_skips_hashing(stack, monkeypatch):
+    (s, paths), memo = stack, PrefixMemo()
+    tfmr = make_tfmr(memo)
+    expected = tfmr.call_stack((s.x, s.y), paths)
+
+    def no_hashing(*args):
+        raise AssertionError('data was hashed')
+    monkeypatch.setattr(transformer, 'data_digest', no_hashing)
+    out = tfmr.call_stack((s.x, s.y), paths, key='scan')
+    for o, e in zip(out, expected):
+        np.testing.assert_array_equal(o, e)
+    hits = memo.hits
+    tfmr.call_stack((s.x, s.y), paths, key='scan')
+    assert memo.hits == hits + 1
+
+
+def test_spill_dir(stack, tmp_path):
+    s, paths = stack
+    memo = PrefixMemo(spill_dir=str(tmp_path))
+    expected = make_tfmr(memo).call_stack((s.x, s.y), paths, key='scan')
+    fresh = PrefixMemo(spill_dir=str(tmp_path))
+    out = make_tfmr(fresh, inplace=True).call_stack((s.x, s.y), paths,
+                                                    key='scan')
+    assert (fresh.hits, fresh.misses) == (1, 0)
+    for o, e in zip(out, expected):
+        assert not o.flags.writeable
+        np.testing.assert_array_equal(o, e)
+
+
+def test_analyzer_with_memo(scan_dir):
+    paths = scan_files(scan_dir)
+    plain = PixelAnalyzer(default_ps, keep_loops=False).batch(paths)
+    memo = PrefixMemo()
+    PixelAnalyzer(dict(default_ps, thresh=6), keep_loops=False,
+                  memo=memo).batch(paths)
+    analyzer = PixelAnalyzer(default_ps, keep_loops=False, memo=memo)
+    for _ in range(2):
+        for a, b in zip(plain, analyzer.batch(paths)):
+            np.testing.assert_array_equal(a['Hc'], b['Hc'])
+            np.testing.assert_array_equal(a['Mr'], b['Mr'])
+            assert a['area'] == b['area']
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+from scmoplot.engine import scan_files
+from scmoplot.loading import load_loop
+from scmoplot.rawcache import RawCache
+
+
+class CountingLoader(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        return load_loop(path)
+
+
+@pytest.fixture
+def loader():
+    return CountingLoader()
+
+
+@pytest.fixture
+def paths(scan_copy):
+    return scan_files(scan_copy)
+
+
+def test_hit(tmp_path, paths, loader):
+    cache = RawCache(str(tmp_path / 'raw'), loader=loader)
+    x, y = cache.load(paths[0])
+    x2, y2 = cache.load(paths[0])
+    assert loader.calls == 1
+    assert len(cache.entries()) == 1
+    assert isinstance(x2, np.memmap)
+    np.testing.assert_array_equal(np.array([x2, y2]),
+                                  np.array(load_loop(paths[0])))
+    # Copy-on-write: changing what was returned leaves the entry alone.
+    y2[:] = 0
+    np.testing.assert_array_equal(cache.load(paths[0])[1], y)
+
+
+def test_load_scan_shares_file_entries(tmp_path, paths, loader):
+    cache = RawCache(str(tmp_path / 'raw'), loader=loader)
+    x, y = cache.load_scan(paths[:6])
+    assert x.shape == y.shape == (6, 1000)
+    assert loader.calls == 6
+    sx, sy = cache.load_scan(paths[2:5])
+    bx, by = cache.load(paths[4])
+    np.testing.assert_array_equal(sy, y[2:5])
+    np.testing.assert_array_equal(by, y[4])
+    assert loader.calls == 6
+    assert len(cache.entries()) == 6
+
+
+def test_invalidate_on_mtime_change(tmp_path, paths, loader):
+    cache = RawCache(str(tmp_path / 'raw'), loader=loader)
+    cache.load(paths[0])
+    st = os.stat(paths[0])
+    os.utime(paths[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    cache.load(paths[0])
+    assert loader.calls == 2
+
+
+def test_invalidate_and_rebuild(tmp_path, paths, loader):
+    cache = RawCache(str(tmp_path / 'raw'), loader=loader)
+    cache.load_scan(paths[:3])
+    cache.invalidate(paths[:2])
+    assert len(cache.entries()) == 1
+    cache.rebuild(paths[0])
+    assert loader.calls == 4
+    assert len(cache.entries()) == 2
+
+
+def test_evict(tmp_path, paths):
+    cache = RawCache(str(tmp_path / 'raw'))
+    cache.load(paths[0])
+    entry_size = cache.size()
+    cache.max_bytes = 3 * entry_size
+    for path in paths[1:6]:
+        cache.load(path)
+    assert len(cache.entries()) == 3
+    assert cache.size() <= cache.max_bytes
+    cache.clear()
+    assert cache.entries() == []
+
+
+def test_unequal_lengths(tmp_path, paths):
+    cache = RawCache(str(tmp_path / 'raw'),
+                     loader=lambda p: [a[:500] if p == paths[1] else a
+                                       for a in load_loop(p)])
+    with pytest.raises(ValueError):
+        cache.load_scan(paths[:3])
+
+
+def test_open_shares_entry_with_load(tmp_path, paths, loader):
+    cache = RawCache(str(tmp_path / 'raw'), loader=loader)
+    arr = cache.open(paths[0])
+    assert arr.shape == (2, 1000)
+    x, y = cache.load(paths[0])
+    assert loader.calls == 0
+    np.testing.assert_allclose(y, load_loop(paths[0])[1])
+
+
+def test_cold_run_lists_once(tmp_path, paths, monkeypatch):
+    from scmoplot import rawcache
+    listings = []
+    list_entries = rawcache.list_entries
+
+    def counting(*args):
+        listings.append(args)
+        return list_entries(*args)
+    monkeypatch.setattr(rawcache, 'list_entries', counting)
+    cache = RawCache(str(tmp_path / 'raw'))
+    cache.load_scan(paths)
+    for path in paths[:3]:
+        cache.invalidate(path)
+        cache.open(path)
+    assert len(listings) == 1
+
+
+def test_open_entry_bigger_than_max_bytes(tmp_path, paths):
+    cache = RawCache(str(tmp_path / 'raw'))
+    cache.load(paths[1])
+    cache.max_bytes = 100
+    arr = cache.open(paths[0])
+    np.testing.assert_allclose(arr, np.array(load_loop(paths[0])))
+    # Everything else is evicted to make room.
+    assert [e[0] for e in cache.entries()] == [cache._entry(paths[0])]
+    x, y = cache.load(paths[2])
+    np.testing.assert_array_equal(y, load_loop(paths[2])[1])
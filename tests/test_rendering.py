@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from scmoplot.engine import analyze
+
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+
+
+def test_clip_segment():
+    from scmoplot.rendering import _clip_segment
+    box = (0, 0, 1, 1)
+    np.testing.assert_allclose(
+        _clip_segment(np.array([-1., 2.]), np.array([.5, .5]), box),
+        [[0, .5], [1, .5]])
+    np.testing.assert_allclose(
+        _clip_segment(np.array([.2, .4]), np.array([.2, .8]), box),
+        [[.2, .2], [.4, .8]])
+    assert _clip_segment(np.array([2., 3.]), np.array([0., 1.]), box) is None
+
+
+def test_loop_grid(scan_dir):
+    import matplotlib.pyplot as plt
+    from scmoplot.rendering import plot_loop_grid
+    result = analyze(scan_dir, workers=1, keep_loops=True)
+    gy, gx = result.shape
+    fig, check = plot_loop_grid(result)
+    try:
+        ax = fig.axes[0]
+        # Every tangent line stays in its cell.
+        for seg in ax.collections[2].get_segments():
+            cell = np.floor(seg.mean(axis=0))
+            assert (seg >= cell - 1e-9).all()
+            assert (seg <= cell + 1 + 1e-9).all()
+        # One scatter of the Hc and Mrem triplets.
+        markers = ax.collections[3].get_offsets()
+        assert 0 < len(markers) <= 6 * gx * gy
+    finally:
+        plt.close(fig)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+from scmoplot.engine import PixelAnalyzer, default_ps, scan_files
+from scmoplot.resultcache import ResultCache
+
+
+@pytest.fixture
+def paths(scan_copy):
+    return scan_files(scan_copy)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / 'results'))
+
+
+def test_put_get(cache, paths):
+    key = cache.key(paths[0], 'fp')
+    assert cache.get(key) is None
+    cache.put(key, {'x': 1, 'y': 2, 'path': paths[0], 'Hc': np.arange(3.)})
+    res = cache.get(key)
+    assert sorted(res) == ['Hc']
+    np.testing.assert_array_equal(res['Hc'], np.arange(3.))
+
+
+def test_key(cache, paths):
+    key = cache.key(paths[0], 'fp')
+    assert cache.key(paths[0], 'other fp') != key
+    # Content addressed: touching the file keeps its key.
+    st = os.stat(paths[0])
+    os.utime(paths[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.key(paths[0], 'fp') == key
+    with open(paths[0], 'a') as f:
+        f.write('1 2 3\n')
+    assert cache.key(paths[0], 'fp') != key
+
+
+def test_bad_entry_is_a_miss(cache, paths):
+    key = cache.key(paths[0], 'fp')
+    cache.put(key, {'Hc': np.arange(3.)})
+    with open(cache._entry(key), 'wb') as f:
+        f.write(b'not a pickle')
+    assert cache.get(key) is None
+    assert cache.entries() == []
+
+
+def test_evict(cache, paths):
+    cache.put(cache.key(paths[0], 'fp'), {'Hc': np.zeros(100)})
+    cache.max_bytes = 2 * cache.size()
+    for path in paths[1:5]:
+        cache.put(cache.key(path, 'fp'), {'Hc': np.zeros(100)})
+    assert len(cache.entries()) == 2
+    assert cache.size() <= cache.max_bytes
+
+
+def test_analyzer_hits(cache, paths):
+    analyzer = PixelAnalyzer(default_ps, keep_loops=False, results=cache)
+    first = analyzer.batch(paths)
+    assert len(cache.entries()) == len(paths)
+    chunk = analyzer.read_chunk(paths)
+    assert chunk.todo == []
+    second = analyzer.analyze_chunk(chunk)
+    for a, b in zip(first, second):
+        assert (a['x'], a['y'], a['path']) == (b['x'], b['y'], b['path'])
+        np.testing.assert_array_equal(a['Hc'], b['Hc'])
+        np.testing.assert_array_equal(a['Mr'], b['Mr'])
+    # A changed file is analyzed again.
+    lines = open(paths[1]).read().splitlines()
+    with open(paths[1], 'w') as f:
+        f.write('\n'.join(lines[:-1]) + '\n')
+    assert analyzer.read_chunk(paths).todo == [1]
+
+
+@pytest.mark.filterwarnings('ignore:loadtxt')
+def test_unreadable_file_fails_its_pixel(cache, scan_copy, paths):
+    from scmoplot.engine import analyze
+    os.remove(paths[0])
+    os.symlink(paths[0] + '.missing', paths[0])
+    result = analyze(scan_copy, workers=1, results=cache)
+    assert list(result.errors()) == [(0, 0)]
+    assert len(cache.entries()) == len(paths) - 1
+    # Again, with the other pixels from the cache.
+    result = analyze(scan_copy, workers=1, results=cache)
+    assert list(result.errors()) == [(0, 0)]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from scmoplot.batch import map_keys
+from scmoplot.engine import analyze, default_ps, scan_chunks, scan_files
+from scmoplot.sweep import SweepAnalyzer, combinations, sweep
+
+# thresh reruns the first pipeline from flatten_saturation, filt_ks both
+# pipelines from their median filters, and max only the extraction.
+GRID = {'thresh': [6, 8], 'filt_ks': [31, 101], 'max': [9, 10]}
+
+
+@pytest.fixture(scope='module')
+def swept(scan_dir):
+    return sweep(scan_dir, GRID, workers=1, chunksize=5)
+
+
+def test_combinations():
+    combos = combinations(GRID, {'ylim': 1.1, 'max': 20})
+    assert len(combos) == 8
+    assert combos[0] == {'filt_ks': 31, 'max': 9, 'thresh': 6, 'ylim': 1.1}
+    # The last parameter in sorted order varies fastest.
+    assert [ps['thresh'] for ps in combos[:2]] == [6, 8]
+
+
+def test_sweep_matches_analyze(scan_dir, swept):
+    assert len(swept) == 8 and swept.shape == (3, 4)
+    assert not swept.failed().any()
+    for i, ps in enumerate(swept.params):
+        # A chunksize that splits the scan differently.
+        result = analyze(scan_dir, ps, workers=1, chunksize=3,
+                         keep_loops=False)
+        assert swept.index(**dict((k, ps[k]) for k in GRID)) == i
+        assert sorted(swept[i].pixels) == sorted(result.pixels)
+        for k, pk in map_keys:
+            np.testing.assert_allclose(
+                swept.stack(pk, fill=np.nan)[i],
+                result.grid(pk, fill=np.nan), rtol=1e-12, atol=1e-12,
+                err_msg='{} of {}'.format(k, ps))
+        for xy, pixel in result.pixels.items():
+            for k in ('lindex', 'rindex', 'lsat', 'rsat'):
+                assert swept[i][xy][k] == pixel[k]
+
+
+def test_sweep_shares_the_memo(scan_dir):
+    combos = [dict(default_ps, **ps) for ps in combinations(GRID)]
+    analyzer = SweepAnalyzer(combos)
+    puts = []
+    put = analyzer.memo.put
+    analyzer.memo.put = lambda key, cols: puts.append(key) or put(key, cols)
+    paths = scan_chunks(scan_files(scan_dir), 16)[0]
+    per_combo = analyzer(paths)
+    assert len(per_combo) == 8
+    assert all(len(pixels) == len(paths) for pixels in per_combo)
+    # Each stage runs once per distinct prefix of stage params instead of
+    # 8 * 9 times. tfmr: scale, flatten_saturation and center per thresh,
+    # wrapped_medfilt and saturation_normalize per (thresh, filt_ks);
+    # tfmr2: its scale is that of tfmr, then 3 stages per filt_ks.
+    assert len(puts) == len(set(puts)) == 1 + 2 + 2 + 4 + 4 + 3 * 2
+    assert len(analyzer.memo) == 0
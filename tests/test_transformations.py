@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from scipy.optimize import curve_fit
+from scipy.signal import medfilt
+
+from scmoplot import transformations as tfms
+
+
+def padded_medfilt(a, ks):
+    """The wrapped_medfilt of old: medfilt of a with its last and first ks
+    points wrapped around its ends.
+    """
+    a = np.concatenate((a[-ks:], a, a[:ks]))
+    return medfilt(a, ks)[ks:-ks]
+
+
+def curve_fit_line(x, y):
+    """Slope and intercept of the line fit by curve_fit, as they were found
+    before linfit.
+    """
+    (m, b), _ = curve_fit(tfms.line, x, y)
+    return m, b
+
+
+def curve_fit_sigma_y(x, y, fit_int=(15.0, 20.0)):
+    """The sigma_y of old."""
+    N = len(x)
+    x_q1, y_q1 = x[:N // 4], y[:N // 4]
+    idx = (fit_int[0] < x_q1) & (x_q1 < fit_int[1])
+    m, b = curve_fit_line(x_q1[idx], y_q1[idx])
+    return np.std(y_q1[idx] - tfms.line(x_q1[idx], m, b))
+
+
+def curve_fit_Hc_of(x, y, ks=2, fit_ks_multiplier=5.0, fit_int=(15.0, 20.0)):
+    """The Hc_of of old, which fit the slopes at the crossings with
+    curve_fit, less its prints.
+    """
+    gt0idx = x >= 0
+    lt0idx = x < 0
+    ymgt0idx = np.argmin(np.abs(y[gt0idx]))
+    ymlt0idx = np.argmin(np.abs(y[lt0idx]))
+    Hc_gt0 = x[gt0idx][ymgt0idx - ks:ymgt0idx + ks].mean()
+    Hc_lt0 = x[lt0idx][ymlt0idx - ks:ymlt0idx + ks].mean()
+    Hc_avg = (abs(Hc_gt0) + abs(Hc_lt0)) / 2.
+    s_y = curve_fit_sigma_y(x, y, fit_int)
+    fks = int(fit_ks_multiplier * ks)
+    mgt0, _ = curve_fit_line(x[gt0idx][ymgt0idx - fks:ymgt0idx + fks],
+                             y[gt0idx][ymgt0idx - fks:ymgt0idx + fks])
+    mlt0, _ = curve_fit_line(x[lt0idx][ymlt0idx - fks:ymlt0idx + fks],
+                             y[lt0idx][ymlt0idx - fks:ymlt0idx + fks])
+    s_x = s_y / ((mgt0 + mlt0) / 2.0)
+    return np.array([Hc_avg + d for d in (-s_x, 0, s_x)])
+
+
+def curve_fit_Mrem_of(x, y, ks=3, fit_int=(15.0, 20.0)):
+    """The Mrem_of of old, with the curve_fit sigma_y."""
+    N = len(x)
+    inds = np.arange(N).reshape(4, N // 4)
+    yq03 = y[inds[[0, 3]]].reshape(N // 2)
+    xq03 = x[inds[[0, 3]]].reshape(N // 2)
+    yq12 = y[inds[[1, 2]]].reshape(N // 2)
+    xq12 = x[inds[[1, 2]]].reshape(N // 2)
+    xmq03i = np.argmin(np.abs(xq03))
+    xmq12i = np.argmin(np.abs(xq12))
+    yq03avg = abs(np.mean(yq03[xmq03i - ks:xmq03i + ks]))
+    yq12avg = abs(np.mean(yq12[xmq12i - ks:xmq12i + ks]))
+    mrem = (yq03avg + yq12avg) / 2.
+    s_y = curve_fit_sigma_y(x, y, fit_int)
+    return np.array([mrem + d for d in (-s_y, 0, s_y)])
+
+
+def quiet(func, *args, **kwargs):
+    """func(*args, **kwargs) without the prints of the legacy estimators."""
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+@pytest.fixture
+def loops():
+    rng = np.random.default_rng(3)
+    return rng.normal(size=(5, 400)).cumsum(axis=1)
+
+
+@pytest.mark.parametrize('ks', [1, 3, 31, 157])
+def test_running_median_1d(loops, ks):
+    np.testing.assert_array_equal(tfms.running_median(loops[0], ks),
+                                  padded_medfilt(loops[0], ks))
+
+
+@pytest.mark.parametrize('ks', [3, 31, 157])
+def test_running_median_2d(loops, ks):
+    expected = np.array([padded_medfilt(row, ks) for row in loops])
+    np.testing.assert_array_equal(tfms.running_median(loops, ks), expected)
+    np.testing.assert_array_equal(
+        tfms.running_median(loops.T, ks, axis=0), expected.T)
+
+
+def test_running_median_out(loops):
+    out = np.empty_like(loops)
+    res = tfms.running_median(loops, 31, out=out)
+    assert res is out
+    np.testing.assert_array_equal(out, tfms.running_median(loops, 31))
+
+
+def test_running_median_even_ks(loops):
+    with pytest.raises(ValueError):
+        tfms.running_median(loops[0], 4)
+
+
+@pytest.mark.parametrize('axis', ['x', 'y'])
+def test_wrapped_medfilt(loops, axis):
+    x, y = loops[:, ::-1].copy(), loops.copy()
+    x0, y0 = x.copy(), y.copy()
+    fx, fy = tfms.wrapped_medfilt(x, y, ks=31, axis=axis)
+    # The input is left alone unless inplace.
+    np.testing.assert_array_equal(x, x0)
+    np.testing.assert_array_equal(y, y0)
+    filtered, kept = (fx, fy) if axis == 'x' else (fy, fx)
+    np.testing.assert_array_equal(kept, x0 if axis == 'y' else y0)
+    np.testing.assert_array_equal(
+        filtered, [padded_medfilt(row, 31) for row in
+                   (x0 if axis == 'x' else y0)])
+    ix, iy = tfms.wrapped_medfilt(x, y, ks=31, axis=axis, inplace=True)
+    assert ix is x and iy is y
+    np.testing.assert_array_equal(ix, fx)
+    np.testing.assert_array_equal(iy, fy)
+
+
+def test_Hc_Mrem_pinned():
+    """The Hc and Mrem of a synthetic loop before (the curve_fit Hc_of and
+    Mrem_of of old) and after (Hc_Mrem, interpolated crossings) they were
+    batched.
+    """
+    from benchmarks.synthetic import make_loop
+    from scmoplot.engine import default_ps, make_transformers
+    B, V = make_loop(2000, Hc=20.0, rng=np.random.default_rng(0))
+    x, y = make_transformers(default_ps)[0]((B, V), 'scan=0x=0y=0averaged')
+    fit_int = (default_ps['thresh'], default_ps['max'])
+    Hc_old = curve_fit_Hc_of(x, y, fit_int=fit_int)
+    Mr_old = curve_fit_Mrem_of(x, y, fit_int=fit_int)
+    Hc, Mr = tfms.Hc_Mrem(x, y, fit_int)
+    # curve_fit stops at a relative tolerance of ~1.5e-8.
+    np.testing.assert_allclose(Hc_old, [1.96333343, 1.96629239, 1.96925135],
+                               rtol=1e-7)
+    np.testing.assert_allclose(Mr_old, [0.94339955, 0.94704929, 0.95069904],
+                               rtol=1e-7)
+    np.testing.assert_allclose(Hc, [1.97963098, 1.98256594, 1.98550089],
+                               rtol=1e-7)
+    np.testing.assert_allclose(Mr, [0.94294884, 0.94659859, 0.95024833],
+                               rtol=1e-7)
+    # The legacy estimators kept in the module still give the old values.
+    np.testing.assert_allclose(quiet(tfms.Hc_of, x, y, fit_int=fit_int),
+                               Hc_old, rtol=1e-7)
+    np.testing.assert_allclose(quiet(tfms.Mrem_of, x, y, fit_int=fit_int),
+                               Mr_old, rtol=1e-7)
+
+
+def test_coercivity_interpolates_crossings():
+    # Piecewise linear loops, whose crossings of y = 0 fall between
+    # samples: interpolation finds them exactly.
+    t = np.arange(400) / 400.0 + 0.01
+    x = 10 * np.cos(2 * np.pi * t)
+    rising = np.sin(2 * np.pi * t) < 0
+    Hcs = np.array([2.0, 3.3])[:, None]
+    y = np.clip((x - np.where(rising, Hcs, -Hcs)) / 1.5, -1, 1)
+    Hc = tfms.coercivity(x, y, fit_int=(7, 10))
+    np.testing.assert_allclose(Hc[:, 1], Hcs[:, 0], rtol=1e-12)
+    # One loop that never crosses y = 0.
+    assert np.isnan(tfms.coercivity(x, np.ones_like(x), (7, 10))[1])
+
+
+def analytic_loop(n_points=1000, Hc=3.0, width=2.0, phase=0.1):
+    """A loop of field 10 cos(2 pi t) whose signal is exactly
+    tanh((x -+ Hc) / width) on its ascending and descending branches.
+    """
+    t = np.arange(n_points) / float(n_points) + phase
+    x = 10 * np.cos(2 * np.pi * t)
+    rising = np.sin(2 * np.pi * t) < 0
+    return x, np.tanh((x - np.where(rising, Hc, -Hc)) / width)
+
+
+def test_resample_branches_round_trip():
+    x, y = analytic_loop()
+    n = 200
+    rx, ry = tfms.resample_branches(x, y, n=n, lim=(-10, 10))
+    assert rx.shape == ry.shape == (2 * n - 2,)
+    # Down the grid, then back up it.
+    assert (np.diff(rx[:n]) < 0).all() and (np.diff(rx[n - 1:]) > 0).all()
+    np.testing.assert_allclose(rx[:n], np.linspace(10, -10, n))
+    # The turning points are kept.
+    top, bottom = np.argmax(x), np.argmin(x)
+    assert ry[0] == y[top] and ry[n - 1] == y[bottom]
+    # Linear interpolation of the samples, which are at most 2 pi 10 / 1000
+    # apart: the error is below spacing**2 / 8 * max|y''| ~ 1e-4.
+    expected = np.tanh((rx - np.where(np.arange(2 * n - 2) < n, -3, 3)) / 2)
+    inside = np.abs(rx) < x.max()
+    np.testing.assert_allclose(ry[inside], expected[inside], atol=2e-4)
+    # And back: the resampled branches interpolated at the measured fields.
+    rising = np.sin(2 * np.pi * (np.arange(1000) / 1000. + 0.1)) < 0
+    for branch, sel in ((slice(n - 1, None), rising),
+                        (slice(None, n), ~rising)):
+        order = np.argsort(rx[branch])
+        back = np.interp(x[sel], rx[branch][order], ry[branch][order])
+        np.testing.assert_allclose(back, y[sel], atol=5e-3)
+
+
+def test_resample_branches_stack():
+    loops = [analytic_loop(phase=p, Hc=h) for p, h in
+             ((0.1, 3.0), (0.35, 2.0), (0.8, 4.0))]
+    x = np.array([l[0] for l in loops])
+    y = np.array([l[1] for l in loops])
+    rx, ry = tfms.resample_branches(x, y, n=100, lim=(-10, 10))
+    assert rx.shape == (198,) and ry.shape == (3, 198)
+    for i, (xi, yi) in enumerate(loops):
+        one = tfms.resample_branches(xi, yi, n=100, lim=(-10, 10))
+        np.testing.assert_array_equal(one[0], rx)
+        np.testing.assert_array_equal(one[1], ry[i])
+    with pytest.raises(ValueError):
+        tfms.resample_branches(x, y, n=2)
+
+
+@pytest.fixture
+def lines():
+    """Noisy lines of different slopes, one per row."""
+    rng = np.random.default_rng(7)
+    x = np.linspace(-20, 20, 300)
+    m = rng.normal(size=(4, 1))
+    return x, m * x + rng.normal(size=4)[:, None] + \
+        rng.normal(scale=0.3, size=(4, 300))
+
+
+def test_linfit_matches_polyfit(lines):
+    x, y = lines
+    m, b, s = tfms.linfit(x, y)
+    assert m.shape == b.shape == s.shape == (4,)
+    for i, row in enumerate(y):
+        pm, pb = np.polyfit(x, row, 1)
+        np.testing.assert_allclose([m[i], b[i]], [pm, pb], rtol=1e-10)
+        np.testing.assert_allclose(s[i], np.std(row - (pm * x + pb)),
+                                   rtol=1e-10)
+        np.testing.assert_allclose([m[i], b[i]], curve_fit_line(x, row),
+                                   rtol=1e-6)
+
+
+def test_linfit_masked_segments(lines):
+    # One segment of a different length per row, down to two points.
+    x, y = lines
+    bounds = [(0, 300), (10, 40), (150, 290), (200, 202)]
+    mask = np.zeros(y.shape, dtype=bool)
+    for row, (lo, hi) in zip(mask, bounds):
+        row[lo:hi] = True
+    m, b, s = tfms.linfit(x, y, mask)
+    for i, (lo, hi) in enumerate(bounds):
+        pm, pb = np.polyfit(x[lo:hi], y[i, lo:hi], 1)
+        np.testing.assert_allclose([m[i], b[i]], [pm, pb], rtol=1e-8)
+        np.testing.assert_allclose(
+            s[i], np.std(y[i, lo:hi] - (pm * x[lo:hi] + pb)), atol=1e-12)
+
+
+def test_linfit_too_few_points(lines):
+    x, y = lines
+    mask = np.ones(y.shape, dtype=bool)
+    mask[1] = False
+    mask[2] = x == x[5]
+    m, b, s = tfms.linfit(x, y, mask)
+    assert np.isnan([m[1], b[1], s[1], m[2], b[2]]).all()
+    assert np.isfinite([m[0], m[3]]).all()
+    assert np.isnan(tfms.linfit(x[:1], y[0, :1])[0])
+
+
+@pytest.mark.parametrize('polarity, threshold', [('+', 10.0), ('-', -5.0)])
+def test_flatten_saturation_matches_curve_fit(lines, polarity, threshold):
+    x, y = lines
+    _, flat = tfms.flatten_saturation(x, y, threshold, polarity)
+    mask = x > threshold if polarity == '+' else x < threshold
+    for i, row in enumerate(y):
+        # curve_fit stops at a relative tolerance of ~1.5e-8.
+        m, b = curve_fit_line(x[mask], row[mask])
+        np.testing.assert_allclose(flat[i], row - (m * x + b), atol=1e-6)
+        m, b = np.polyfit(x[mask], row[mask], 1)
+        np.testing.assert_allclose(flat[i], row - (m * x + b), atol=1e-12)
+        np.testing.assert_allclose(
+            tfms.flatten_saturation(x, row, threshold, polarity)[1], flat[i],
+            atol=1e-12)
+
+
+def test_sigma_y_matches_curve_fit():
+    from benchmarks.synthetic import make_loop
+    rng = np.random.default_rng(4)
+    loops = [make_loop(2000, Hc=Hc, rng=rng) for Hc in (20.0, 30.0, 40.0)]
+    x = np.array([l[0] for l in loops])
+    y = np.array([l[1] for l in loops])
+    fit_int = (60.0, 100.0)
+    s = tfms.sigma_y(x, y, fit_int)
+    assert s.shape == (3,)
+    for i in range(3):
+        expected = curve_fit_sigma_y(x[i], y[i], fit_int)
+        np.testing.assert_allclose(s[i], expected, rtol=1e-8)
+        np.testing.assert_allclose(tfms.sigma_y(x[i], y[i], fit_int),
+                                   expected, rtol=1e-8)
+
+
+@pytest.mark.parametrize('Hc', [20.0, 35.0])
+def test_Hc_of_matches_curve_fit(Hc):
+    from benchmarks.synthetic import make_loop
+    from scmoplot.engine import default_ps, make_transformers
+    B, V = make_loop(2000, Hc=Hc, rng=np.random.default_rng(5))
+    x, y = make_transformers(default_ps)[0]((B, V), 'scan=0x=0y=0averaged')
+    fit_int = (default_ps['thresh'], default_ps['max'])
+    np.testing.assert_allclose(quiet(tfms.Hc_of, x, y, fit_int=fit_int),
+                               curve_fit_Hc_of(x, y, fit_int=fit_int),
+                               rtol=1e-8)
+
+
+def old_center(B, V):
+    """The loop V centered as center did it, in place, before there were
+    stacks of loops.
+    """
+    V -= 0.5 * (V.max() + V.min())
+    return B, V
+
+
+def old_x0slope(B, V):
+    """The per-loop x0slope of old. Like it, this centers V in place."""
+    rslope = 0
+    lslope = 0
+    rslopeindex = 0
+    lslopeindex = 0
+    x, y = old_center(B, V)
+    for i in range(len(x) - 1):
+        if y[i] < 0 and y[i + 1] > 0:
+            rslopeindex = i
+            rslope = (y[i + 1] - y[i]) / (x[i + 1] - x[i])
+        elif y[i] > 0 and y[i + 1] < 0:
+            lslopeindex = i
+            lslope = (y[i + 1] - y[i]) / (x[i + 1] - x[i])
+    lxarray = np.arange(-100, 101).astype(float)
+    lxarray *= np.abs(B[0] - B[1])
+    lyarray = np.zeros(201)
+    lyarray += lxarray * lslope
+    lxarray += B[lslopeindex]
+    rxarray = np.arange(-100, 101).astype(float)
+    rxarray *= np.abs(B[0] - B[1])
+    ryarray = np.zeros(201)
+    ryarray += rxarray * rslope
+    rxarray += B[rslopeindex]
+    return lslope, rslope, [lxarray, lyarray, B[lslopeindex], V[lslopeindex],
+                            rxarray, ryarray, B[rslopeindex], V[rslopeindex]]
+
+
+def old_sat_field(B, V, thresh=.00001):
+    """The per-loop sat_field of old, which walks back with while loops."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dV = np.gradient(V, B)
+    i = len(B) - 1
+    while dV[i] < thresh:
+        i -= 1
+    lsat = i
+    i = np.argmax(B)
+    while dV[i] < thresh:
+        i -= 1
+    return lsat, i
+
+
+def old_loop_area(B, V):
+    """The per-loop loop_area of old."""
+    trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+    left = np.argmin(B)
+    right = np.argmax(B)
+    top_area = trapezoid(V[right:left], B[right:left])
+    bottom_area1 = trapezoid(V[0:right], B[0:right])
+    bottom_area2 = trapezoid(V[left:len(B) + 1], B[left:len(B) + 1])
+    return top_area - (bottom_area1 + bottom_area2)
+
+
+def old_features(B, V):
+    """The features of one loop as the engine used to extract them: x0slope
+    centered V, then sat_field and loop_area worked on the centered loop.
+    """
+    V = np.array(V, dtype=float)
+    lslope, rslope, tan = old_x0slope(B, V)
+    lsat, rsat = old_sat_field(B, V)
+    return dict(lslope=lslope, rslope=rslope, lsat=lsat, rsat=rsat,
+                area=old_loop_area(B, V)), tan
+
+
+@pytest.fixture(scope='module')
+def feature_loops():
+    """Synthetic loops as the engine measures them (through tfmr2), which
+    share their field, and analytic loops of different fields, phases and
+    lengths.
+    """
+    from benchmarks.synthetic import make_loop
+    from scmoplot.engine import default_ps, make_transformers
+    tfmr2 = make_transformers(default_ps)[1]
+    rng = np.random.default_rng(11)
+    measured = []
+    for Hc, noise in ((20.0, 0.05), (30.0, 0.02), (45.0, 0.1)):
+        B, V = make_loop(2000, Hc=Hc, noise=noise, rng=rng)
+        measured.append(tfmr2((B, V), 'scan=0x=0y=0averaged'))
+    analytic = []
+    for phase, Hc, slope in ((0.1, 3.0, 0.0), (0.37, 2.0, 0.01),
+                             (0.8, 4.5, -0.02)):
+        x, y = analytic_loop(1000, Hc=Hc, phase=phase)
+        analytic.append((x, y + slope * x + 0.3))
+    return measured, analytic
+
+
+def check_features(B, V, features, i=Ellipsis):
+    """Compare features (or row i of them) with those of the old code."""
+    expected, tan = old_features(B, V)
+    for k, v in expected.items():
+        np.testing.assert_allclose(features[k][i], v, rtol=1e-10,
+                                   atol=1e-12, err_msg=k)
+    # Where the tangent lines of old were drawn.
+    assert B[features['lindex'][i]] == tan[2]
+    assert B[features['rindex'][i]] == tan[6]
+
+
+def test_loop_features_single(feature_loops):
+    measured, analytic = feature_loops
+    for B, V in measured + analytic:
+        features = tfms.loop_features(B, V)
+        check_features(B, V, features)
+        assert tfms.loop_area(B, V) == pytest.approx(old_loop_area(B, V))
+
+
+def test_loop_features_stack(feature_loops):
+    measured, analytic = feature_loops
+    # A shared field and a stack of signals.
+    B = measured[0][0]
+    V = np.array([v for b, v in measured])
+    assert all((b == B).all() for b, v in measured)
+    features = tfms.loop_features(B, V)
+    for i, row in enumerate(V):
+        check_features(B, row, features, i)
+    # A field per row.
+    B = np.array([b for b, v in analytic])
+    V = np.array([v for b, v in analytic])
+    features = tfms.loop_features(B, V)
+    assert features['area'].shape == (3,)
+    for i in range(3):
+        check_features(B[i], V[i], features, i)
+    # The stand-alone functions agree with loop_features on centered loops.
+    y = V - 0.5 * (V.max(-1, keepdims=True) + V.min(-1, keepdims=True))
+    lslope, rslope, lindex, rindex = tfms.zero_crossings(B, V)
+    np.testing.assert_array_equal(lindex, features['lindex'])
+    np.testing.assert_array_equal(rindex, features['rindex'])
+    np.testing.assert_array_equal(lslope, features['lslope'])
+    lsat, rsat = tfms.sat_field(B, y)
+    np.testing.assert_array_equal(lsat, features['lsat'])
+    np.testing.assert_array_equal(rsat, features['rsat'])
+    np.testing.assert_allclose(tfms.loop_area(B, y), features['area'],
+                               rtol=1e-12)
+
+
+def test_x0slope_tangent_lines(feature_loops):
+    measured, analytic = feature_loops
+    for B, V in measured + analytic:
+        V0 = V.copy()
+        lslope, rslope, tan = tfms.x0slope(B, V)
+        # The caller's V isn't centered in place any more.
+        np.testing.assert_array_equal(V, V0)
+        old_lslope, old_rslope, old_tan = old_x0slope(B, V0)
+        assert (lslope, rslope) == pytest.approx((old_lslope, old_rslope),
+                                                 rel=1e-12)
+        assert len(tan) == len(old_tan) == 8
+        for a, b in zip(tan, old_tan):
+            np.testing.assert_allclose(a, b, rtol=1e-12, atol=1e-12)
+
+
+def test_zero_crossings_none():
+    B = np.linspace(-1, 1, 50)
+    assert tfms.zero_crossings(B, np.zeros(50)) == (0.0, 0.0, 0, 0)
+    # Rows that only go up, only go down and never cross.
+    lslope, rslope, lindex, rindex = tfms.zero_crossings(
+        B, np.array([B, -B, np.ones(50)]))
+    np.testing.assert_array_equal(lindex, [0, 24, 0])
+    np.testing.assert_array_equal(rindex, [24, 0, 0])
+    np.testing.assert_allclose(lslope, [0, -1, 0])
+    np.testing.assert_allclose(rslope, [1, 0, 0])
+
+
+def test_sat_field_no_point_qualifies():
+    # dV/dB is below thresh everywhere, where the old while loops ran off
+    # the array.
+    B = np.linspace(-10, 10, 200)
+    assert tfms.sat_field(B, -B) == (0, 0)
+    assert tfms.sat_field(B, np.zeros(200)) == (0, 0)
+    lsat, rsat = tfms.sat_field(B, np.array([-B, B, np.zeros(200)]))
+    np.testing.assert_array_equal(lsat, [0, 199, 0])
+    np.testing.assert_array_equal(rsat, [0, 199, 0])
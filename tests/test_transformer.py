@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import numpy as np
+import pytest
+
+from scmoplot import transformations as tfms
+from scmoplot.engine import PixelAnalyzer, default_ps, make_transformers
+from scmoplot.transformer import Transformer
+
+
+def test_plan_is_compiled_once_across_threads():
+    tfmr = Transformer()
+    tfmr.add(1, tfms.scale, {'xsc': 2.0})
+    tfmr.add(2, tfms.translate, {'xtrans': 1.0, 'ytrans': 0.0},
+             filter='.*a$')
+    x, y = np.arange(5.0), np.arange(5.0)
+    n = 8
+    barrier = threading.Barrier(n)
+    plans, outs = [None] * n, [None] * n
+
+    def work(i):
+        barrier.wait()
+        plans[i] = tfmr.plan()
+        outs[i] = [tfmr((x, y), t) for t in ('a', 'b') * 50]
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(p is plans[0] for p in plans)
+    for out in outs:
+        for (ox, oy), t in zip(out, ('a', 'b') * 50):
+            np.testing.assert_array_equal(ox, 2 * x + (t == 'a'))
+            np.testing.assert_array_equal(oy, y)
+
+
+def test_params_are_copied():
+    params = {'xsc': 2.0}
+    tfmr = Transformer()
+    tfmr.add(1, tfms.scale, params)
+    x, y = np.arange(3.0), np.arange(3.0)
+    tfmr((x, y), 'a')
+    assert params == {'xsc': 2.0}
+    params['xsc'] = 5.0
+    np.testing.assert_array_equal(tfmr((x, y), 'a')[0], 2 * x)
+    # add() makes the next call compile a new plan, with the params as
+    # they are then.
+    tfmr.add(2, tfms.scale, {'xsc': 3.0})
+    np.testing.assert_array_equal(tfmr((x, y), 'a')[0], 15 * x)
+
+
+def test_callers_ps_unchanged(scan_dir):
+    from scmoplot.engine import analyze
+    ps = dict(default_ps, thresh=6)
+    before = dict(ps)
+    make_transformers(ps)
+    PixelAnalyzer(ps)
+    analyze(scan_dir, ps, workers=1)
+    assert ps == before
+
+
+def test_add_checks_its_arguments():
+    tfmr = Transformer()
+    tfmr.add(1, tfms.scale)
+    with pytest.raises(ValueError):
+        tfmr.add(1, tfms.center)
+    with pytest.raises(ValueError):
+        tfmr.add('2', tfms.center)
+    with pytest.raises(ValueError):
+        tfmr.add(2, tfms.center, filter={'x': '1'})
+
+
+@pytest.mark.parametrize('extra', [{}, {'resample': 300, 'filt_ks': 31}])
+def test_inplace_handoff_leaves_input_alone(scan_dir, extra):
+    from scmoplot.engine import scan_files
+    from scmoplot.loopstack import LoopStack
+    ps = dict(default_ps, **extra)
+    paths = scan_files(scan_dir)
+    stack = LoopStack.from_files(paths)
+    x0, y0 = stack.x.copy(), stack.y.copy()
+    expected = [t.call_stack((stack.x, stack.y), paths)
+                for t in make_transformers(ps)]
+    tfmr, tfmr2 = make_transformers(ps, inplace=True)
+    for _ in range(2):
+        # tfmr2 gets the same arrays tfmr was given.
+        out = tfmr.call_stack((stack.x, stack.y), paths)
+        out2 = tfmr2.call_stack((stack.x, stack.y), paths)
+        np.testing.assert_array_equal(stack.x, x0)
+        np.testing.assert_array_equal(stack.y, y0)
+        for got, want in zip((out, out2), expected):
+            for g, w in zip(got, want):
+                np.testing.assert_array_equal(g, w)
+    # Same for single loops.
+    loop = (stack.x[0], stack.y[0])
+    expected = [t(loop, paths[0]) for t in make_transformers(ps)]
+    out, out2 = tfmr(loop, paths[0]), tfmr2(loop, paths[0])
+    np.testing.assert_array_equal(stack.y, y0)
+    for got, want in zip((out, out2), expected):
+        for g, w in zip(got, want):
+            np.testing.assert_array_equal(g, w)
+
+
+def test_inplace_reuses_buffers():
+    tfmr = Transformer(inplace=True)
+    tfmr.add(1, tfms.scale, {'xsc': 0.5})
+    tfmr.add(2, tfms.center, filter='.*a')
+    x = np.arange(12).reshape(2, 6)
+    y = np.arange(12).reshape(2, 6)
+    ox, oy = tfmr.call_stack((x, y), ['a', 'b'])
+    assert ox.dtype == float
+    np.testing.assert_array_equal(oy[0], y[0] - 2.5)
+    np.testing.assert_array_equal(oy[1], y[1])
+    ox2, oy2 = tfmr.call_stack((x, y), ['a', 'b'])
+    assert np.shares_memory(ox, ox2)
+    np.testing.assert_array_equal(x, np.arange(12).reshape(2, 6))
+
+
+def test_kept_loops_are_copies(scan_dir):
+    from scmoplot.engine import analyze
+    result = analyze(scan_dir, workers=1, keep_loops=True)
+    loop, other = result[0, 0]['loop'][1], result[1, 0]['loop'][1]
+    assert not np.shares_memory(loop, other)
+    assert np.abs(loop - other).max() > 0
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+from os.path import join
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_loop, make_scan, write_loop
+from scmoplot.engine import PixelAnalyzer, default_ps
+from scmoplot.watch import ScanWatcher
+
+
+def averaged(x, y):
+    return 'scan=0x={}y={}averaged'.format(x, y)
+
+
+@pytest.fixture
+def acquisition(tmp_path):
+    """A finished 2 x 2 scan with individual scans to copy from, and an
+    empty directory to acquire it into.
+    """
+    src, dst = str(tmp_path / 'src'), str(tmp_path / 'dst')
+    make_scan(src, gx=2, gy=2, n_points=1000, n_scans=2, seed=3)
+    os.makedirs(dst)
+    return src, dst
+
+
+def expected_Hc(path):
+    return PixelAnalyzer(default_ps, keep_loops=False)(path)['Hc']
+
+
+def test_picks_up_settled_files(acquisition):
+    src, dst = acquisition
+    with ScanWatcher(dst) as watcher:
+        # Nothing to do before parameters.xml is written.
+        assert watcher.poll() == [] and watcher.result is None
+        shutil.copy(join(src, 'parameters.xml'), dst)
+        for name in (averaged(0, 0), averaged(1, 0), 'scan=0x=0y=1',
+                     'scan=1x=0y=1'):
+            shutil.copy(join(src, name), dst)
+        # Seen once: not settled yet.
+        assert watcher.poll() == []
+        assert watcher.result.shape == (2, 2)
+        assert sorted(watcher.poll()) == [(0, 0), (1, 0)]
+        # The individual scans are never analyzed, nor are files twice.
+        assert watcher.poll() == []
+        assert len(watcher.result) == 2 and not watcher.complete()
+        np.testing.assert_allclose(watcher.Hcs[0, 1],
+                                   expected_Hc(join(src, averaged(1, 0))))
+        assert (watcher.Hcs[1] == 0).all()
+
+
+def test_ignores_files_being_written(acquisition):
+    src, dst = acquisition
+    shutil.copy(join(src, 'parameters.xml'), dst)
+    with ScanWatcher(dst) as watcher:
+        with open(join(src, averaged(0, 1)), 'rb') as f:
+            data = f.read()
+        path = join(dst, averaged(0, 1))
+        # Written in three parts, polled in between.
+        for part in range(3):
+            with open(path, 'ab') as f:
+                f.write(data[part * len(data) // 3:
+                             (part + 1) * len(data) // 3])
+            assert watcher.poll() == []
+        assert watcher.poll() == [(0, 1)]
+        assert watcher.result[0, 1]['error'] is None
+        np.testing.assert_allclose(watcher.Hcs[1, 0], expected_Hc(path))
+
+
+def test_reanalyzes_rewritten_files(acquisition):
+    src, dst = acquisition
+    for name in ('parameters.xml', averaged(0, 0), averaged(1, 0),
+                 averaged(0, 1), averaged(1, 1)):
+        shutil.copy(join(src, name), dst)
+    with ScanWatcher(dst) as watcher:
+        watcher.poll()
+        assert len(watcher.poll()) == 4 and watcher.complete()
+        path = join(dst, averaged(1, 1))
+        B, V = make_loop(1000, Hc=15.0, noise=0.01,
+                         rng=np.random.default_rng(0))
+        write_loop(path, B, V)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert watcher.poll() == []
+        assert watcher.poll() == [(1, 1)]
+        np.testing.assert_allclose(watcher.Hcs[1, 1], expected_Hc(path))
+        assert watcher.Hcs[1, 1, 1] < 2.0
+
+
+def test_watch_until_complete(acquisition):
+    src, dst = acquisition
+    for name in os.listdir(src):
+        shutil.copy(join(src, name), dst)
+    updates = []
+    with ScanWatcher(dst) as watcher:
+        result = watcher.watch(interval=0.01, timeout=5,
+                               callback=lambda w, u: updates.append(u))
+    assert result is watcher.result and watcher.complete()
+    assert sorted(updates[0]) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    assert not result.errors()